@@ -7,9 +7,13 @@ Created on Tue Aug 19 09:53:00 2025
 if __name__ == "__main__":
 
     # Import relevant modules
+    import os
     import arcpy
-    import pandas as pd
-    import matplotlib.pyplot as plt
+    import numpy as np
+    from numpy.lib import recfunctions as rfn
+    from road_hotspot import attributes, gi_star, incremental, network, pipeline, profiling, weights_cache
+    from road_hotspot.report import FIGURE_CACHE_NAME, ReportStatistics, generate_html_report
+    from road_hotspot.backends.arcgis import ArcpyBackend
 
     # Get inputs from the user
 
@@ -27,47 +31,32 @@ if __name__ == "__main__":
     date_span = str(arcpy.GetParameterAsText(11)).lower()  # REQUIRED: time span to average the crash data
     report = arcpy.GetParameterAsText(12) # OPTIONAL: Boolean to get automated report
     report_path = arcpy.GetParameterAsText(13)  # OPTIONAL: Get the report path
+    engine = str(arcpy.GetParameterAsText(14)).lower()  # OPTIONAL: Hotspot engine {ArcGIS, NumPy}, defaults to ArcGIS
+    append_mode = str(arcpy.GetParameterAsText(15)).lower() == "true"  # OPTIONAL: Only process crashes added since the last run
+    category_values = arcpy.GetParameterAsText(16)  # OPTIONAL: Incident categories, VALUE of the report type field or FIELD=VALUE
+    category_output = arcpy.GetParameterAsText(17) or "Category_hotspots"  # OPTIONAL: Category hotspot table name
+    workers = int(arcpy.GetParameterAsText(18) or 1)  # OPTIONAL: Worker processes for the tiled NumPy engine
+    stage_profiles = str(arcpy.GetParameterAsText(19)).lower() == "true"  # OPTIONAL: cProfile dump of every stage
+    space_time_output = arcpy.GetParameterAsText(20)  # OPTIONAL: Space-time hotspot output name, NumPy engine only
+    permutations = int(arcpy.GetParameterAsText(21) or 0)  # OPTIONAL: Permutations for pseudo p-values, NumPy engine only
+    fdr = str(arcpy.GetParameterAsText(22)).lower() == "true"  # OPTIONAL: False Discovery Rate correction of Gi_Bin
+    report_inline = str(arcpy.GetParameterAsText(23)).lower() == "true"  # OPTIONAL: Embed the report figures in the HTML
+    neighborhood = (arcpy.GetParameterAsText(24) or "euclidean").lower()  # OPTIONAL: Gi* neighborhoods, NumPy engine only
+
+    # Wall time, CPU time, peak memory and rows of every stage, written next to the workspace
+    profile_path = incremental.get_sidecar_path(arcpy.env.workspace, profiling.PROFILE_NAME)
+    run_profile = profiling.RunProfile(profile_path + "_cprofile" if stage_profiles else None)
+    backend = ArcpyBackend(arcpy.env.workspace)  # Reads and writes the layers of the pipeline
 
     # arcpy.env.outputCoordinateSystem = arcpy.GetParameterAsText(9) # REQUIRED: Spatial Reference for calculations
     # Hotspot functions
-    def get_time_span(date_span, date_field, crash_data):  # Input Parameters: date span, date field, crash point data
-        """
-        :param date_span: Date span of choice {year, month, day}
-        :param date_field: Date field from crash data layer
-        :param crash_data: Crash data points
-        :return: Time span value to calculate average crash incidents
-        """
-        date_values = {"year": 365, "month": 30, "week": 7}  # date value dictionary
-        dates = []  # Store the single dates
-
-        # Create an array based on the date field values
-        crash_array = arcpy.da.FeatureClassToNumPyArray(crash_data, date_field)
-
-        for i in crash_array:  # For each field element in the array
-            dates.append(i[0])  # Append the date value to the dates list
-
-        # Calculate the time span based on the data date field
-        time_span = round(((max(dates) - min(dates)) / date_values[date_span]).astype(float))
-
-        return time_span  # Return the time span value
-
-
-    def get_snap_distance(dist, units):
-        if dist != "":  # If max_distance was shared
-            distance = dist + " " + units  # Create the distance variable
-            return distance
-        else:  # Else set the max distance to 25 miles
-            distance = "0.25 Miles"
-            return distance
-
-
     # Snap points to road network function
     def snap_points(max_dist, crash_points, road_lines,
                     units):  # Max distance, crash point layer, road line layer, distance units
         # Create a copy of the crash data point layer to snap to the road layer
-        copied_points = arcpy.management.CopyFeatures(crash_points, "crash_data_copy")
+        copied_points = arcpy.management.CopyFeatures(crash_points, r"memory\crash_data_copy")
         # Snap the crash data to the road network
-        distance = get_snap_distance(max_dist, units)
+        distance = pipeline.get_snap_distance(max_dist, units)
         # Create snap environments
         snap_environment_1 = [road_lines, "EDGE", distance]  # Create the snap environment variable
         snap_environment_2 = [road_lines, "VERTEX", distance]  # Create the snap environment variable
@@ -78,66 +67,77 @@ if __name__ == "__main__":
         return snapped_points  # Return the snapped points
 
 
+    def get_null_values(table, fields):
+        # Read null text values as empty strings and null numbers as -1
+        field_types = {field.name: field.type for field in arcpy.ListFields(table)}
+        return {field: "" if field_types.get(field) == "String" else -1 for field in fields}
+
+
     def get_road_length(road_lines, units):
-        # If units were not provided, default to US miles
-        if units == "":
-            field_name = "Length_mi"
-            arcpy.management.CalculateGeometryAttributes(road_lines, [[field_name, "LENGTH"]], "MILES_US")
-            return field_name
-        else:  # Else, get the field name and length in specified units
-            field_name = "Length" + "_" + units[:2].lower()
-            arcpy.management.CalculateGeometryAttributes(road_lines, [[field_name, "LENGTH"]], units)
-            return field_name
-
-
-    def classify_incident(crash_points, report_type_field, fatalities_name):
-        # Create an update cursor and set a 1 value if the row represent a fatal incident and 0 if not
-        arcpy.management.AddField(crash_points, "Fatalities", "LONG")  # Create new field
-        # Create update cursor for feature class
-        with arcpy.da.UpdateCursor(crash_points, [report_type_field, "Fatalities"]) as cursor:
-            for row in cursor:  # For each row on the cursor
-                if row[0] == fatalities_name:  # If the row has a fatality
-                    row[1] = 1  # Set the value to 1
-                else:
-                    row[1] = 0  # Else 0
-                cursor.updateRow(row)  # Update the cursor
-            arcpy.AddMessage("Crash and fatalities data points joined to the road data.")
+        # Add the length field, in the units or else in US miles
+        field_name = pipeline.get_length_field(units)
+        arcpy.management.CalculateGeometryAttributes(road_lines, [[field_name, "LENGTH"]], units or "MILES_US")
+        return field_name
+
+
+    def classify_incident(crash_points, report_type_field, fatalities_name, categories=()):
+        # Set a 1 value in a new Fatalities field if the row represent a fatal incident and 0 if not,
+        # and a 1 or 0 one-hot field for every incident category
+        oid_field = arcpy.Describe(crash_points).OIDFieldName
+        crash_fields = pipeline.get_crash_fields(report_type_field if fatalities_name else "", categories)
+        crash_array = arcpy.da.TableToNumPyArray(crash_points, ["OID@"] + crash_fields,
+                                                 null_value=get_null_values(crash_points, crash_fields))
+        fields = [crash_array["OID@"]]
+        names = ["OID_JOIN"]
+        if fatalities_name:
+            fields.append(attributes.get_fatal_flag(crash_array[report_type_field], fatalities_name))
+            names.append("Fatalities")
+        if categories:
+            category_flags = attributes.get_category_flags(crash_array, categories)
+            fields += list(category_flags.T)
+            names += [attributes.get_count_field(name) for _, _, name in categories]
+        # Write the flags back in a single pass
+        arcpy.da.ExtendTable(crash_points, oid_field, np.rec.fromarrays(fields, names=names), "OID_JOIN",
+                             append_only=False)
+        arcpy.AddMessage("Crash incidents classified.")
 
 
     # Create field mapping
-    def create_field_map(road_lines, crash_points):
+    def create_field_map(road_lines, crash_points, sum_fields=(("Fatalities", "tot_fata", "Total fatalities"),)):
         # Create a FieldMappings object and add all fields from the target (road_network)
         field_mappings = arcpy.FieldMappings()
 
         # Add all fields from the road network (target feature class)
         field_mappings.addTable(road_lines)
 
-        # Create a FieldMap for the Fatalities field from the join feature class
-        fatalities_fieldmap = arcpy.FieldMap()
+        for input_name, output_name, alias in sum_fields:  # Fatalities and one-hot category fields
+            # Create a FieldMap for the field from the join feature class
+            sum_fieldmap = arcpy.FieldMap()
 
-        # Add the 'Fatalities' field from the joined table to this FieldMap
-        fatalities_fieldmap.addInputField(crash_points, "Fatalities")
+            # Add the field from the joined table to this FieldMap
+            sum_fieldmap.addInputField(crash_points, input_name)
 
-        # Set the properties of the output field that will be created
-        output_field = fatalities_fieldmap.outputField
-        output_field.name = "tot_fata"
-        output_field.aliasName = "Total fatalities"
-        output_field.type = "LONG"
+            # Set the properties of the output field that will be created
+            output_field = sum_fieldmap.outputField
+            output_field.name = output_name
+            output_field.aliasName = alias
+            output_field.type = "LONG"
 
-        # Set the merge rule to "Sum" to total up fatalities for segments with multiple crashes
-        fatalities_fieldmap.mergeRule = "Sum"
-        fatalities_fieldmap.outputField = output_field
+            # Set the merge rule to "Sum" to total up the incidents for segments with multiple crashes
+            sum_fieldmap.mergeRule = "Sum"
+            sum_fieldmap.outputField = output_field
 
-        # Add the customized FieldMap to the FieldMappings object
-        field_mappings.addFieldMap(fatalities_fieldmap)
+            # Add the customized FieldMap to the FieldMappings object
+            field_mappings.addFieldMap(sum_fieldmap)
         return field_mappings
 
 
     # Prepare the road data
-    def prep_roads(road_lines, crash_points, fat_field=False, report_type_field="", fatalities_variable_name=""):
+    def prep_roads(road_lines, crash_points, fat_field=False, report_type_field="", fatalities_variable_name="",
+                   categories=()):
         # Join crash data to the road network
         # Do a Spatial Join joining the road network and the snapped point data
-        if not fat_field:  # If no fatalities field have been provided
+        if not fat_field and not categories:  # If no fatalities field or categories have been provided
             # Join the road data and get the crash count
             joined_crash_roads = arcpy.analysis.SpatialJoin(road_lines,
                                                             crash_points,
@@ -147,208 +147,174 @@ if __name__ == "__main__":
                                                             match_option="INTERSECT")
             arcpy.AddMessage("Crash data points joined to the road data.")
             return joined_crash_roads
-        else:  # If there is a fatalities field
-            # Classify the crash incidents adding 1 if it has a fatality else 0
-            classify_incident(crash_points, report_type_field, fatalities_variable_name)
-
-            # Create a fieldmap to link fatalities count to the roads
-            field_map_result = create_field_map(road_lines, crash_points)
+        else:  # If there is a fatalities field or categories
+            # Classify the crash incidents adding 1 if it has a fatality (or belongs to a category) else 0
+            with run_profile.stage("classify"):
+                classify_incident(crash_points, report_type_field, fatalities_variable_name if fat_field else "",
+                                  categories)
+
+            # Create a fieldmap to link fatalities and category counts to the roads
+            sum_fields = [("Fatalities", attributes.FATALITY_COUNT_FIELD, "Total fatalities")] if fat_field else []
+            sum_fields += [(attributes.get_count_field(name), attributes.get_count_field(name), "Total " + value)
+                           for _, value, name in categories]
+            field_map_result = create_field_map(road_lines, crash_points, sum_fields)
 
             # Perform the spatial join with the configured field mappings
             joined_crash_roads = arcpy.analysis.SpatialJoin(
                 road_lines,
                 crash_points,
-                "Crash_fatalities_count",
+                "Crash_fatalities_count" if fat_field else "joined_crash_road_data",
                 join_operation="JOIN_ONE_TO_ONE",
                 join_type="KEEP_ALL",
                 field_mapping=field_map_result,
                 match_option="INTERSECT"
             )
-            where_clause = "tot_fata IS NULL"
-            # To correct null values in Fatalities field
-            with arcpy.da.UpdateCursor(joined_crash_roads, "tot_fata", where_clause) as cursor:
-                for row in cursor:  # For each row on the cursor
-                    row[0] = 0
-                    cursor.updateRow(row)  # Update the cursor
             return joined_crash_roads
 
 
-    def get_avg_crash(road_lines, time_span, date_span, length_field):
-        # Create a new field "Avg_Crash_per_Year"
-        # Create an update cursor and calculate the average crash per year value
-        arcpy.management.AddField(road_lines, "Avg_crash_yr", "DOUBLE")  # Create new field
-
-        fields = ["Join_Count", length_field, "Avg_crash_yr"]  # Fields to use on the update cursor
-
-        # Create update cursor for feature class
-        with arcpy.da.UpdateCursor(road_lines, fields) as cursor:
-            for row in cursor:  # For each row on the cursor
-                avg_crash = row[0] / (time_span * row[1])  # Calculate the average number of crashes per year
-                row[2] = avg_crash  # Store the average number of crashes in the new field
-                cursor.updateRow(row)  # Update the cursor
+    def attribute_stage(road_lines, time_span, date_span, length_field, fat_field=False, categories=(),
+                        statistics=None):
+        # Read the join count, fatalities, category counts and length columns once, null counts are read as 0
+        count_fields = [attributes.FATALITY_COUNT_FIELD] if fat_field else []
+        count_fields += [attributes.get_count_field(name) for _, _, name in categories]
+        fields = ["OID@", "Join_Count", length_field] + count_fields
+        null_values = {field: 0 for field in [length_field] + count_fields}
+        road_array = arcpy.da.TableToNumPyArray(road_lines, fields, null_value=null_values)
+        if statistics is not None:  # Segment statistics of the report from the columns already read
+            statistics.update_segments(road_array["Join_Count"], road_array[length_field])
+
+        # Calculate the average crashes (and fatalities) per segment length per date span for all rows at once
+        tot_fata = road_array[attributes.FATALITY_COUNT_FIELD] if fat_field else None
+        road_attributes, zero_length = attributes.get_road_attributes(road_array["Join_Count"], road_array[length_field],
+                                                                      time_span, tot_fata=tot_fata)
+        if zero_length:
+            arcpy.AddWarning("%d road segments have a zero length, their average incidents were set to 0." % zero_length)
+        if categories:  # Rates of every category as one matrix operation
+            category_fields = [attributes.get_count_field(name) for _, _, name in categories]
+            category_counts = np.column_stack([road_array[field] for field in category_fields])
+            category_rates = attributes.get_category_rates(category_counts, road_array[length_field], time_span,
+                                                           categories)
+            road_attributes = rfn.merge_arrays([road_attributes, category_rates,
+                                                rfn.repack_fields(road_array[category_fields])],
+                                               flatten=True, usemask=False)
+
+        # Replace the count fields with the null filled values and write all fields back in a single pass
+        if count_fields:
+            arcpy.management.DeleteField(road_lines, count_fields)
+        oid_field = arcpy.Describe(road_lines).OIDFieldName
+        output_array = rfn.append_fields(road_attributes, "OID_JOIN", road_array["OID@"], usemask=False)
+        arcpy.da.ExtendTable(road_lines, oid_field, output_array, "OID_JOIN", append_only=False)
+        if fat_field:
+            arcpy.management.AlterField(road_lines, attributes.FATALITY_COUNT_FIELD, new_field_alias="Total fatalities")
+            arcpy.AddMessage("Average fatal incidents per road segment per %s calculated" % date_span)
+        if categories:
+            arcpy.AddMessage("Average incidents of %d categories per road segment per %s calculated" %
+                             (len(categories), date_span))
         arcpy.AddMessage("Average crash incidents per road segment per %s calculated" % date_span)
 
-    def get_avg_fat(road_lines, time_span, date_span, length_field):
-        # Create a new field "Avg_Crash_per_Year"
-        # Create an update cursor and calculate the average fatalities per segment length by year value
-        arcpy.management.AddField(road_lines, "Avg_fata_yr", "DOUBLE")  # Create new field
-
-        fields = ["tot_fata", length_field, "Avg_fata_yr"]  # Fields to use on the update cursor
-
-        # Create update cursor for feature class
-        with arcpy.da.UpdateCursor(road_lines, fields) as cursor:
-            for row in cursor:  # For each row on the cursor
-                avg_crash = row[0] / (time_span * row[1])  # Calculate the average number of crashes per year
-                row[2] = avg_crash  # Store the average number of crashes in the new field
-                cursor.updateRow(row)  # Update the cursor
-
-        arcpy.AddMessage("Average fatal incidents per road segment per %s calculated" % date_span)
+    # Run the Hotspot Analysis for average crash incidents per road segment
+    def get_distance_band(crash_points, road_lines):
+        # Calculate the average 8 neighbor distance once for every analysis field
+        if engine == "numpy":  # Road segments, as the pipeline of the NumPy engine
+            road_array = arcpy.da.FeatureClassToNumPyArray(road_lines, ["TARGET_FID", "SHAPE@XY"])
+            return weights_cache.get_distance_band(road_array["SHAPE@XY"], road_array["TARGET_FID"],
+                                                   weights_cache.get_cache_dir(arcpy.env.workspace))
+        distance_band = arcpy.stats.CalculateDistanceBand(crash_points, 8, "EUCLIDEAN_DISTANCE")  # Crash points
+        return float(distance_band[1])  # Get the Average 8 neighbor distance
+
+
+    def get_weights_file(road_lines, distance_band):
+        # Build the fixed distance band spatial weights matrix once and reuse it from the cache folder
+        road_array = arcpy.da.FeatureClassToNumPyArray(road_lines, ["TARGET_FID", "SHAPE@XY"])
+        geometry_hash = incremental.get_geometry_hash(road_array["TARGET_FID"], road_array["SHAPE@XY"])
+        cache_dir = weights_cache.get_cache_dir(arcpy.env.workspace)
+        weights_file = os.path.join(cache_dir, weights_cache.get_cache_key(geometry_hash, distance_band) + ".swm")
+        if os.path.exists(weights_file):
+            os.utime(weights_file)  # Mark the entry as recently used
+        else:
+            arcpy.stats.GenerateSpatialWeightsMatrix(road_lines, "TARGET_FID", weights_file, "FIXED_DISTANCE",
+                                                     "EUCLIDEAN", Threshold_Distance=distance_band,
+                                                     Row_Standardization="NO_STANDARDIZATION")
+            weights_cache.evict(cache_dir)
+        return weights_file
 
 
     # Run the Hotspot Analysis for average crash incidents per road segment
-    def hotspot_analysis(road_lines, crash_points, incident_type, incident_field, output):
-        # Calculate the distance band
-        distance_band = arcpy.stats.CalculateDistanceBand(crash_points, 8, "EUCLIDEAN_DISTANCE")
-        avg_distance = distance_band[1]  # Get the Average 8 neighbor distance
+    def hotspot_analysis(road_lines, distance_band, incident_type, incident_field, output, statistics=None):
+        if engine == "numpy":  # Compute Gi* with NumPy/SciPy instead of the Hot Spot Analysis tool
+            return numpy_hotspot_analysis(road_lines, distance_band, incident_type, incident_field, output,
+                                          statistics)
 
         # Run the hotspot analysis tool with average crash per time span
         incident_hotspots = arcpy.stats.HotSpots(road_lines,
                                                  # Input the road layer with the calculated average crashes
                                                  incident_field,  # Input the average yearly crash column
                                                  output,  # Set the name of the output file
-                                                 "FIXED_DISTANCE_BAND",  # Set the spatial relationship
+                                                 "GET_SPATIAL_WEIGHTS_FROM_FILE",  # Set the spatial relationship
                                                  "EUCLIDEAN_DISTANCE",  # Set the distance method
-                                                 Distance_Band_or_Threshold_Distance=avg_distance)  # Set the threshold distance
+                                                 Weights_Matrix_File=get_weights_file(road_lines, distance_band),
+                                                 Apply_False_Discovery_Rate__FDR__Correction="APPLY_FDR" if fdr
+                                                 else "NO_FDR")
+        if statistics is not None:  # Hot and cold spots of the report, only the Gi_Bin column is read
+            statistics.update_hotspots(arcpy.da.TableToNumPyArray(incident_hotspots, "Gi_Bin")["Gi_Bin"])
         arcpy.AddMessage("%s Hotspot calculated." % incident_type)
         return incident_hotspots
 
-    #### REPORT FUNCTIONS
-    # Get dataframes from layers to create the HTML report
-    def get_dfs(data_layer, fields):
-        array_data = arcpy.da.FeatureClassToNumPyArray(data_layer, fields)
-        df_data = pd.DataFrame(array_data)
-        return df_data
 
-    def get_totals(data_layer):
-        total_incidents = int(arcpy.management.GetCount(crash_data)[0])
-        return total_incidents
+    def add_source_id(road_lines):
+        # Store the road segment ObjectID in a SOURCE_ID field, as the Hot Spot Analysis tool does
+        if "SOURCE_ID" in [field.name for field in arcpy.ListFields(road_lines)]:
+            return
+        oid_field = arcpy.Describe(road_lines).OIDFieldName
+        oids = arcpy.da.FeatureClassToNumPyArray(road_lines, "OID@")["OID@"]
+        source_ids = np.rec.fromarrays([oids, oids], names=["OID_JOIN", "SOURCE_ID"])
+        arcpy.da.ExtendTable(road_lines, oid_field, source_ids, "OID_JOIN", append_only=False)
 
 
-    def get_mean_incidents(df, incident_field, date_field):
-        # Create a copy to avoid modifying the original DataFrame
-        df_copy = df.copy()
+    def read_hotspot_inputs(road_lines, fields):
+        # Get the segment midpoints (feature centroids, the location used by the Hot Spot Analysis tool)
+        add_source_id(road_lines)
+        road_array = arcpy.da.FeatureClassToNumPyArray(road_lines, ["SOURCE_ID", "SHAPE@XY"] + fields,
+                                                       null_value={field: 0 for field in fields})
+        return road_array["SOURCE_ID"], road_array["SHAPE@XY"], {field: road_array[field] for field in fields}
 
-        # Convert to datetime if it's not already
-        df_copy[date_field] = pd.to_datetime(df_copy[date_field])
 
-        df_copy["day"] = df_copy[date_field].dt.day_name()
-        df_copy['year'] = df_copy[date_field].dt.year
-        days_ordered = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-        df_copy['day'] = pd.Categorical(df_copy['day'], categories=days_ordered, ordered=True)
+    def numpy_hotspot_analysis(road_lines, distance_band, incident_type, incident_field, output, statistics=None):
+        source_ids, points, values = read_hotspot_inputs(road_lines, [incident_field])
 
-        if incident_field not in df_copy.columns or incident_field == "":
-            daily_incident = df_copy.groupby('day').size()  # Use size() instead of count()
-            yearly_incident = df_copy.groupby('year').size()  # Use size() instead of count()
-            return daily_incident, yearly_incident
-        else:
-            daily_incident = df_copy.groupby('day')[incident_field].mean()
-            yearly_incident = df_copy.groupby('year')[incident_field].mean()
-            return daily_incident, yearly_incident
-
-
-    def get_incident_plot(incident_mean, time_step, plot_type, report_path):
-        """
-        :param incident_mean: Mean value to plot
-        :param time_step: Time step to be used
-        :param plot_type: Either "Fatalities" or "Crashes"
-        :return: Void
-        """
-        # Plot the figure (Mean Incidents)
-        plot_title = plot_type + " by " + time_step
-        plt.figure()  # Creates a new, blank figure
-        incident_mean.plot(kind='line', figsize=(8, 6), title=plot_title, color='green', linewidth=3)
-        y_label = "Mean " + plot_type.lower()
-        plt.ylabel(y_label)
-        plt.xlabel("Time step")  # Add a label to the x-axis
-        incident_png = plot_type + "_" + time_step + ".png"
-        plot_path = report_path + "\\" + incident_png
-        # Save the plot
-        plt.savefig(plot_path, dpi=300, bbox_inches='tight')
-        plt.close()
-
-        # Return image name
-        return incident_png
-
-
-    def get_descriptive_variables(roads_df, total_roads):
-        segments_with_crashes = len(roads_df[roads_df['Join_Count'] > 0])  # Get the segments with crashes
-        crash_involvement_rate = (
-                                             segments_with_crashes / total_roads) * 100  # Get the percentage of segments with crashes
-        return segments_with_crashes, crash_involvement_rate
-
-
-    def generate_html_report(fatalities, crash_df, roads_df, hotspot_df, fatalities_df, crash_data_layer,
-                             road_data_layer, total_crashes, total_roads, date_span, date_field, report_output):
-
-        # Get descriptive variables
-        segments_with_crashes, crash_involvement_rate = get_descriptive_variables(roads_df, total_roads)
-
-        ## Create plots
-        # Get mean crashes values
-        if fatalities:
-            total_fatalities = fatalities_df['Fatalities'].sum()
-            daily_fatalities, yearly_fatalities = get_mean_incidents(fatalities_df, incident_field="Fatalities",
-                                                                     date_field=date_field)
-            daily_fat_plot = get_incident_plot(daily_fatalities, time_step="Daily", plot_type="Fatalities", report_path=report_output)
-            yearly_fat_plot = get_incident_plot(yearly_fatalities, time_step="Yearly", plot_type="Fatalities", report_path=report_output)
-        else:
-            daily_fat_plot = ""
-            yearly_fat_plot = ""
-            total_fatalities = "Not analyzed"
-
-        daily_crashes, yearly_crashes = get_mean_incidents(crash_df, incident_field="", date_field=date_field)
-
-        # Prepare plots
-        daily_crash_plot = get_incident_plot(daily_crashes, time_step="Daily", plot_type="Crashes",report_path=report_output)
-        yearly_crash_plot = get_incident_plot(yearly_crashes, time_step="Yearly", plot_type="Crashes",report_path=report_output)
-
-        # Get mean fatalities values
-
-        # Get number of hot and cold spots
-        hot_spots = len(hotspot_df[hotspot_df['Gi_Bin'] > 0])
-        cold_spots = len(hotspot_df[hotspot_df['Gi_Bin'] < 0])
-
-        # Open HTML template file
-        html_template_path = r".\report_template.html"
-        with open(html_template_path, 'r', encoding='utf-8') as file:
-            html_content = file.read()
-
-        # Create substitution dictionary
-        substitutions = {
-            '{crash_data_name}': crash_data_layer,
-            '{road_data_name}': road_data_layer,
-            '{crash_length}': str(total_crashes),
-            '{fatalities}': str(total_fatalities),
-            '{hotspots}': str(hot_spots),
-            '{coldspots}': str(cold_spots),
-            '{segments_with_crashes}': str(segments_with_crashes),
-            '{crash_involvement_rate}': "%.2f %%" % crash_involvement_rate,
-            '{analysis_period}': date_span.title(),
-            '{fatalities_by_day}': daily_fat_plot,
-            '{fatalities_by_year}': yearly_fat_plot,
-            '{crash_by_day}': daily_crash_plot,
-            '{crash_by_year}': yearly_crash_plot,
-        }
-
-        # Replace placeholders with actual values
-        for placeholder, value in substitutions.items():
-            html_content = html_content.replace(placeholder, str(value))
-
-        # Write the updated HTML file
-        output_html_path = report_output + r"\Crash_Analysis_Report.html"
-        with open(output_html_path, 'w', encoding='utf-8') as file:
-            file.write(html_content)
-        arcpy.AddMessage("HTML report generation completed successfully.")
+        # Calculate GiZScore, GiPValue and Gi_Bin
+        z_scores, p_values, neighbors = pipeline.get_gi_star(points, values[incident_field], distance_band, source_ids,
+                                                             weights_cache.get_cache_dir(arcpy.env.workspace), workers,
+                                                             permutations)
+        hotspots = gi_star.get_hotspot_array(z_scores, p_values, neighbors, source_ids, fdr)
+        if statistics is not None:  # Hot and cold spots of the report
+            statistics.update_hotspots(hotspots["Gi_Bin"])
+
+        # Write the output feature class with the hotspot fields
+        incident_hotspots = arcpy.management.CopyFeatures(road_lines, output)
+        arcpy.da.ExtendTable(incident_hotspots, "SOURCE_ID", hotspots, "SOURCE_ID", append_only=False)
+        arcpy.AddMessage("%s Hotspot calculated." % incident_type)
+        return incident_hotspots
+
+    def category_hotspot_analysis(road_lines, distance_band, categories, output):
+        # Get the segment midpoints and the rate of every category
+        rate_fields = [attributes.get_rate_field(name) for _, _, name in categories]
+        source_ids, points, values = read_hotspot_inputs(road_lines, rate_fields)
+
+        # Calculate the z-scores of every category at once with the shared neighborhoods
+        rates = np.column_stack([values[field] for field in rate_fields])
+        z_scores, p_values, neighbors = pipeline.get_gi_star(points, rates, distance_band, source_ids,
+                                                             weights_cache.get_cache_dir(arcpy.env.workspace), workers,
+                                                             permutations)
+        hotspots = gi_star.get_category_array(z_scores, p_values, neighbors, [name for _, _, name in categories],
+                                              source_ids, fdr)
+        hotspots = rfn.merge_arrays([hotspots, np.rec.fromarrays([values[field] for field in rate_fields],
+                                                                 names=rate_fields)], flatten=True, usemask=False)
+
+        # Write a single table with the rates and hotspot fields of every category
+        output_table = backend.write_table(output, hotspots)
+        arcpy.AddMessage("Hotspots of %d incident categories calculated." % len(categories))
+        return output_table
 
     # Exception handling
 
@@ -363,6 +329,14 @@ if __name__ == "__main__":
     class InvalidDateSpan(Exception):  # Exception class to handle invalid date span
         pass
 
+
+    class InvalidEngine(Exception):  # Exception class to handle invalid hotspot engine
+        pass
+
+
+    class InvalidNeighborhood(Exception):  # Exception class to handle invalid Gi* neighborhoods
+        pass
+
     try:
 
         # Check extension
@@ -385,64 +359,101 @@ if __name__ == "__main__":
             # Raise the custom error
             raise InvalidDateSpan
 
+        # Check hotspot engine input
+        if engine not in ["", "arcgis", "numpy"]:  # If the engine is not supported
+            # Raise the custom error
+            raise InvalidEngine
+
+        # Check neighborhood input
+        if neighborhood not in network.NEIGHBORHOODS:  # If the neighborhood is not supported
+            # Raise the custom error
+            raise InvalidNeighborhood
+
         # Set environment settings MAYBE MOVE DOWN
         arcpy.env.overwriteOutput = True
         arcpy.addOutputsToMap = True
 
         # Apply functions to get hotspot analysis
-        time_span = get_time_span(date_span, date_field, crash_data) # Get time span
-        snapped_points = snap_points(max_distance, crash_data, road_network, units) # Snap points to roads
-        road_length = get_road_length(road_network, units) # Get the road length
+        # The NumPy engine assigns the crashes to the roads in memory, which needs a projected coordinate system
+        native_snapping = engine == "numpy" and backend.is_projected(road_network)
+        if engine == "numpy" and not native_snapping:
+            arcpy.AddWarning("The road network is not projected, crash points will be snapped with the Snap tool.")
+        if append_mode and not native_snapping:
+            arcpy.AddWarning("The append mode needs the NumPy engine and a projected road network, "
+                             "all crashes will be processed.")
+        if permutations and engine != "numpy":
+            arcpy.AddWarning("The permutation p-values need the NumPy engine, the analytic p-values will be used.")
+        if neighborhood == "network" and not native_snapping:
+            arcpy.AddWarning("The network neighborhoods need the NumPy engine and a projected road network, "
+                             "the Euclidean distance band will be used.")
+        if space_time_output and not native_snapping:
+            arcpy.AddWarning("The space-time hotspots need the NumPy engine and a projected road network, "
+                             "they will not be calculated.")
+        # Incident categories counted in the same join as the crashes
+        categories = attributes.parse_categories(category_values.split(";"), report_type_field) if category_values else []
+
+        if native_snapping:
+            # In memory assignment, columnar store and Gi* of the pipeline shared with the command line
+            pipeline.run(backend, crash_data, date_field, road_network, crash_output, date_span,
+                         fatalities=bool(fatalities), fatalities_output=fatalities_output,
+                         report_type_field=report_type_field, fatalities_name=fatalities_variable_name,
+                         max_distance=max_distance, units=units, categories=categories,
+                         category_output=category_output, append_mode=append_mode, workers=workers,
+                         report_path=report_path if report else "", run_profile=run_profile,
+                         space_time_output=space_time_output, permutations=permutations, fdr=fdr,
+                         report_inline=report_inline, neighborhood=neighborhood)
+        else:
+            with run_profile.stage("snap"):
+                snapped_points = snap_points(max_distance, crash_data, road_network, units) # Snap points to roads
 
-        if fatalities:
             ## Join the crash data to the road network
-            joined_roads = prep_roads(road_network, snapped_points, fat_field=True, report_type_field=report_type_field, fatalities_variable_name=fatalities_variable_name)
-            get_avg_crash(joined_roads, time_span, date_field,
-                          road_length)  # Calculate average crashes per road segment
-            get_avg_fat(joined_roads, time_span, date_field,
-                        road_length)  # Calculate average fatalities per road segment
-            fatalities_hotspots = hotspot_analysis(joined_roads,
-                                                   snapped_points,
-                                                   incident_type="Fatalities",
-                                                   incident_field="Avg_fata_yr",
-                                                   output=fatalities_output)
-            crash_hotspots = hotspot_analysis(joined_roads,
-                                              snapped_points,
-                                              incident_type="Crashes",
-                                              incident_field="Avg_crash_yr",
-                                              output=crash_output)
+            with run_profile.stage("join"):
+                joined_roads = prep_roads(road_network, snapped_points, fat_field=bool(fatalities),
+                                          report_type_field=report_type_field,
+                                          fatalities_variable_name=fatalities_variable_name, categories=categories)
+            # Dates only pass of the crash table, keeping the date extent and report tallies as running aggregates
+            with run_profile.stage("time_span") as stage:
+                crash_aggregates = pipeline.stream_crashes(backend, crash_data, date_field, report_type_field,
+                                                           fatalities_variable_name if fatalities else "")
+                stage["rows"] = crash_aggregates.n_crashes
+            time_span = crash_aggregates.get_time_span(date_span)  # Get time span
+            # Report statistics collected by the next stages, the report does not read the layers again
+            statistics = ReportStatistics(crash_aggregates, units) if report else None
+
+            with run_profile.stage("distance_band"):
+                distance_band = get_distance_band(snapped_points, joined_roads)  # Shared by every hotspot analysis
+
+            # Calculate average crashes (and fatalities) per road segment
+            with run_profile.stage("length"):
+                road_length = get_road_length(joined_roads, units)  # Get the road length of the joined copy
+            with run_profile.stage("rates"):
+                attribute_stage(joined_roads, time_span, date_span, road_length, fat_field=bool(fatalities),
+                                categories=categories, statistics=statistics)
+            if fatalities:
+                with run_profile.stage("hotspot_fatalities"):
+                    fatalities_hotspots = hotspot_analysis(joined_roads,
+                                                           distance_band,
+                                                           incident_type="Fatalities",
+                                                           incident_field="Avg_fata_yr",
+                                                           output=fatalities_output)
+            with run_profile.stage("hotspot_crashes"):
+                crash_hotspots = hotspot_analysis(joined_roads,
+                                                  distance_band,
+                                                  incident_type="Crashes",
+                                                  incident_field="Avg_crash_yr",
+                                                  output=crash_output,
+                                                  statistics=statistics)
+            if categories:  # One combined table with the hotspots of every category
+                with run_profile.stage("hotspot_categories"):
+                    category_hotspot_analysis(joined_roads, distance_band, categories, category_output)
             if report:
-                crash_df = get_dfs(crash_data, [date_field, "OBJECTID"])
-                fatalities_df = get_dfs(crash_data, [date_field, "Fatalities"])
-                hotspot_df = get_dfs(crash_hotspots, ["Gi_Bin", "GiZScore", "GiPValue"])
-                road_df = get_dfs(joined_roads,["Join_Count", "Length_mi", "Avg_crash_yr", "OBJECTID"])
-                total_roads = get_totals(joined_roads)
-                total_crashes = get_totals(crash_data)
-                generate_html_report(fatalities=True,crash_df=crash_df,roads_df=road_df,
-                                                     hotspot_df=hotspot_df,total_roads=total_roads,
-                                                     date_span=date_span,date_field=date_field,
-                                                     crash_data_layer=crash_data, road_data_layer=joined_roads,
-                                                     total_crashes=total_crashes,fatalities_df=fatalities_df,
-                                                     report_output=report_path)
-        else:
-            joined_roads = prep_roads(road_network, snapped_points, fat_field=False)
-            get_avg_crash(joined_roads, time_span, date_field,
-                          road_length)  # Calculate average crashes per road segment
-            crash_hotspots = hotspot_analysis(joined_roads,
-                                              snapped_points,
-                                              incident_type="Crashes",
-                                              incident_field="Avg_crash_yr",
-                                              output=crash_output)
-            if report:
-                crash_df = get_dfs(crash_data, [date_field, "OBJECTID"])
-                hotspot_df = get_dfs(crash_hotspots, ["Gi_Bin", "GiZScore", "GiPValue"])
-                road_df = get_dfs(joined_roads,["Join_Count", "Length_mi", "Avg_crash_yr", "OBJECTID"])
-                total_roads = get_totals(joined_roads)
-                total_crashes = get_totals(crash_data)
-                generate_html_report(fatalities=False,roads_df=road_df,hotspot_df=hotspot_df,
-                                                     fatalities_df=None,crash_data_layer=crash_data,road_data_layer=road_network,
-                                                     total_crashes=total_crashes,total_roads=total_roads,date_span=date_span,
-                                                     date_field=date_field,crash_df=crash_df,report_output=report_path)
+                generate_html_report(fatalities=bool(fatalities), statistics=statistics,
+                                     date_span=date_span,
+                                     crash_data_layer=crash_data, road_data_layer=road_network,
+                                     report_output=report_path, run_profile=run_profile, workers=workers,
+                                     inline=report_inline,
+                                     cache_dir=incremental.get_sidecar_path(arcpy.env.workspace, FIGURE_CACHE_NAME))
+                arcpy.AddMessage("HTML report generation completed successfully.")
 
 
     except LicenseError:
@@ -451,9 +462,14 @@ if __name__ == "__main__":
         arcpy.AddError("The date field %s field is not valid." % date_field)
     except InvalidDateSpan:
         arcpy.AddError("The date %s is not valid. The values should be Year, Month, or Week." % date_span)
-
-
-
-
-
-
+    except InvalidEngine:
+        arcpy.AddError("The hotspot engine %s is not valid. The values should be ArcGIS or NumPy." % engine)
+    except InvalidNeighborhood:
+        arcpy.AddError("The neighborhood %s is not valid. The values should be Euclidean or Network." % neighborhood)
+    except ValueError as error:  # Invalid data found by the pipeline, e.g. crashes without dates
+        arcpy.AddError(str(error))
+    finally:
+        # Write the run profile even when a stage failed
+        if run_profile.stages:
+            profile_files = run_profile.write(profile_path)
+            arcpy.AddMessage("Run profile written to %s." % profile_files[0])
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""
+Importable building blocks and pipeline of the Road Accident Hotspot tool.
+
+The array modules only depend on NumPy/SciPy, the layers are read and written through a
+geometry/IO backend (road_hotspot.backends) and arcpy is only imported by the arcpy backend,
+so the pipeline runs in the ArcGIS script tool (main.py) and headless from the command line
+with ``python -m road_hotspot``.
+"""
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Command line entry point of the hotspot pipeline.
+
+Run from the Tool folder, e.g.::
+
+    python -m road_hotspot crashes.gpkg roads.gpkg --date-field CRASH_DATE --output results.gpkg
+
+The GeoPandas backend is the default; --backend arcpy runs the same pipeline on feature
+classes, with --output being the workspace folder or geodatabase.
+"""
+import argparse
+import logging
+import sys
+
+from road_hotspot import attributes, incremental, network, permutation, pipeline, profiling
+from road_hotspot.backends import BACKENDS, get_backend
+
+
+def get_parser():
+    """
+    :return: Argument parser of the command line
+    """
+    parser = argparse.ArgumentParser(prog="python -m road_hotspot", description="Road accident hotspot analysis.")
+    parser.add_argument("crashes", help='Crash point layer, "path" or "path|layer"')
+    parser.add_argument("roads", help='Polyline road layer in a projected coordinate system, "path" or "path|layer"')
+    parser.add_argument("--date-field", required=True, help="Date field of the crash layer")
+    parser.add_argument("--output", required=True, help="Output GeoPackage, or workspace for the arcpy backend")
+    parser.add_argument("--backend", choices=BACKENDS, default="geopandas", help="Geometry/IO backend")
+    parser.add_argument("--crash-output", default="Crash_hotspots", help="Crash hotspot layer name")
+    parser.add_argument("--date-span", choices=sorted(attributes.DATE_VALUES), default="year",
+                        help="Date span of the averages")
+    parser.add_argument("--report-type-field", default="", help="Report type field")
+    parser.add_argument("--fatal-value", default="", help="Report type value of the fatal incidents, "
+                                                          "enables the fatality hotspots")
+    parser.add_argument("--fatalities-output", default="Fatalities_hotspots", help="Fatality hotspot layer name")
+    parser.add_argument("--snap-distance", default="", help="Snap distance, 0.25 miles by default")
+    parser.add_argument("--units", default="", help="Units of the snap distance and segment lengths, e.g. Meters")
+    parser.add_argument("--categories", default="", help="Incident categories, VALUE or FIELD=VALUE separated by ;")
+    parser.add_argument("--category-output", default="Category_hotspots", help="Category hotspot table name")
+    parser.add_argument("--space-time-output", default="", help="Space-time hotspot layer name, enables the "
+                                                                "Gi* of every period and the trend per segment")
+    parser.add_argument("--permutations", type=int, default=0, help="Conditional permutations per segment for "
+                                                                     "pseudo p-values, e.g. 999")
+    parser.add_argument("--fdr", action="store_true", help="Apply the False Discovery Rate correction to Gi_Bin")
+    parser.add_argument("--seed", type=int, default=permutation.DEFAULT_SEED, help="Seed of the permutations")
+    parser.add_argument("--permutation-memory", type=float, default=permutation.MAX_BLOCK_BYTES / 1024 ** 2,
+                        help="Memory ceiling of a block of permutations per worker, in MB")
+    parser.add_argument("--neighborhood", choices=network.NEIGHBORHOODS, default="euclidean",
+                        help="Neighborhoods of Gi*, by straight line distance or along the roads")
+    parser.add_argument("--append", action="store_true", help="Only process the crashes added since the last run")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes of the tiled assignment and Gi*")
+    parser.add_argument("--report", default="", help="Folder of the HTML report")
+    parser.add_argument("--report-inline", action="store_true", help="Embed the report figures in the HTML file")
+    parser.add_argument("--report-format", choices=("png", "svg"), default="png", help="Format of the report figures")
+    parser.add_argument("--profile-stages", action="store_true", help="Save a cProfile dump of every stage")
+    return parser
+
+
+def main(argv=None):
+    """
+    :param argv: Command line arguments, sys.argv if None
+    :return: Exit code
+    """
+    args = get_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    backend = get_backend(args.backend, args.output)
+    if args.backend == "arcpy":  # The scratch outputs go to the same workspace
+        import arcpy
+        arcpy.env.workspace = args.output
+        arcpy.env.overwriteOutput = True
+
+    profile_path = incremental.get_sidecar_path(args.output, profiling.PROFILE_NAME)
+    run_profile = profiling.RunProfile(profile_path + "_cprofile" if args.profile_stages else None)
+    categories = attributes.parse_categories(args.categories.split(";"), args.report_type_field)
+    try:
+        pipeline.run(backend, args.crashes, args.date_field, args.roads, args.crash_output, args.date_span,
+                     fatalities=bool(args.fatal_value), fatalities_output=args.fatalities_output,
+                     report_type_field=args.report_type_field, fatalities_name=args.fatal_value,
+                     max_distance=args.snap_distance, units=args.units, categories=categories,
+                     category_output=args.category_output, append_mode=args.append, workers=args.workers,
+                     report_path=args.report, run_profile=run_profile, space_time_output=args.space_time_output,
+                     permutations=args.permutations, fdr=args.fdr, seed=args.seed,
+                     permutation_memory=int(args.permutation_memory * 1024 ** 2), report_inline=args.report_inline,
+                     report_format=args.report_format, neighborhood=args.neighborhood)
+    except ValueError as error:
+        logging.getLogger("road_hotspot").error(str(error))
+        return 1
+    finally:
+        if run_profile.stages:
+            backend.message("Run profile written to %s." % run_profile.write(profile_path)[0])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized attribute stage: fatality flags, null filling and average incident rates.
+
+The functions work on whole columns at once so the attribute table is read once and
+written back once, instead of one cursor pass (and one Python operation per row) per field.
+"""
+import re
+
+import numpy as np
+
+# Output fields of the road attribute stage
+CRASH_RATE_FIELD = "Avg_crash_yr"
+FATALITY_RATE_FIELD = "Avg_fata_yr"
+FATALITY_COUNT_FIELD = "tot_fata"
+CATEGORY_NAME_LENGTH = 20  # Keeps the category field names valid in a file geodatabase
+
+# Days in each date span
+DATE_VALUES = {"year": 365, "month": 30, "week": 7}
+
+
+def get_fatal_flag(report_types, fatalities_name):
+    """
+    :param report_types: Array with the report type of every crash
+    :param fatalities_name: Report type value that identifies a fatal incident
+    :return: Array with 1 for fatal incidents and 0 for the rest
+    """
+    return (np.asarray(report_types) == fatalities_name).astype(np.int32)
+
+
+def parse_categories(entries, default_field):
+    """
+    :param entries: Category values, as VALUE (for the default field) or FIELD=VALUE
+    :param default_field: Field holding the values given without a field, e.g. the report type field
+    :return: List of (field, value, name) tuples, name being usable in field names
+    """
+    categories = []
+    for entry in entries:
+        entry = entry.strip().strip("'\"")  # Multivalue parameters quote the values with spaces
+        if not entry:
+            continue
+        field, value = entry.split("=", 1) if "=" in entry else (default_field, entry)
+        name = re.sub(r"\W+", "_", value.strip()).strip("_")[:CATEGORY_NAME_LENGTH] or "Blank"
+        categories.append((field.strip(), value.strip(), name))
+    return categories
+
+
+def get_count_field(name):
+    """
+    :param name: Category name
+    :return: Field with the incidents of the category per segment
+    """
+    return "Cnt_" + name
+
+
+def get_rate_field(name):
+    """
+    :param name: Category name
+    :return: Field with the average incidents of the category per segment length and date span
+    """
+    return "Avg_" + name + "_yr"
+
+
+def get_value_flag(values, value):
+    """
+    :param values: Array with the field value of every crash, None or NaN for the nulls
+    :param value: Category value as written by the user, e.g. "INJURY" or "1"
+    :return: Boolean array, True where the crash has the value. Numeric values are compared as numbers, so 1.0
+             matches "1", and the nulls never match
+    """
+    values = np.asarray(values)
+    try:
+        number = float(value)
+    except ValueError:
+        number = None
+    if values.dtype.kind in "iuf":
+        return values == number if number is not None else np.zeros(len(values), dtype=bool)
+    if values.dtype != object:
+        return values.astype(str) == value
+
+    # Cursor and Arrow columns: the text is compared, and the numbers too when the field holds numbers
+    null = np.equal(values, None) | (values != values)
+    flag = ~null & (values.astype(str) == value)
+    present = values[~null]
+    if number is not None and len(present) and not isinstance(present[0], (str, bytes)):
+        flag[~null] |= present.astype(float) == number
+    return flag
+
+
+def get_category_flags(columns, categories):
+    """
+    :param columns: Mapping (e.g. structured array) from field name to the crash values
+    :param categories: List of (field, value, name) tuples
+    :return: (n, k) one-hot array, 1 where the crash belongs to the category
+    """
+    flags = [get_value_flag(columns[field], value) for field, value, _ in categories]
+    return np.column_stack(flags).astype(np.int32)
+
+
+def get_category_rates(category_counts, lengths, time_span, categories):
+    """
+    :param category_counts: (n, k) array with the incidents of each category per segment
+    :param lengths: Road segment length
+    :param time_span: Number of date spans covered by the crash data
+    :param categories: List of (field, value, name) tuples
+    :return: Structured array with one rate field per category
+    """
+    rates = get_rates(category_counts, lengths, time_span)[0]
+    category_rates = np.zeros(len(rates), dtype=[(get_rate_field(name), np.float64) for _, _, name in categories])
+    for column, (_, _, name) in enumerate(categories):
+        category_rates[get_rate_field(name)] = rates[:, column]
+    return category_rates
+
+
+def get_time_span(min_date, max_date, date_span):
+    """
+    :param min_date: Earliest crash date
+    :param max_date: Latest crash date
+    :param date_span: Date span of choice {year, month, week}
+    :return: Fractional number of date spans between both dates, at least one day
+    """
+    if min_date is None or max_date is None or np.isnat(np.datetime64(min_date)) or np.isnat(np.datetime64(max_date)):
+        raise ValueError("The crashes have no valid dates, the time span of the averages cannot be calculated.")
+    days = (np.datetime64(max_date) - np.datetime64(min_date)) / np.timedelta64(1, "D")
+    # Not rounded: a few months of crashes with a yearly span would give 0 and every rate would be 0
+    return max(float(days), 1.0) / DATE_VALUES[date_span]
+
+
+def get_rates(counts, lengths, time_span):
+    """
+    :param counts: Incidents per road segment, (n,) or (n, k) for k categories
+    :param lengths: Road segment length
+    :param time_span: Number of date spans covered by the crash data
+    :return: Incidents per unit length per date span, and the number of zero length segments
+    """
+    counts = np.asarray(counts, dtype=float)
+    exposure = time_span * np.asarray(lengths, dtype=float)
+
+    # Zero length segments (or a zero time span) get a rate of 0 instead of a ZeroDivisionError
+    valid = exposure > 0
+    zero_length = int(np.count_nonzero(~valid))
+    if counts.ndim == 2:  # Same exposure for every category
+        exposure = exposure[:, None]
+        valid = valid[:, None]
+    rates = np.divide(counts, exposure, out=np.zeros_like(counts), where=valid)
+    return rates, zero_length
+
+
+def get_road_attributes(join_count, lengths, time_span, tot_fata=None):
+    """
+    :param join_count: Crashes per road segment
+    :param lengths: Road segment length
+    :param time_span: Number of date spans covered by the crash data
+    :param tot_fata: Fatalities per road segment with nulls already filled, None to skip the fatality rate
+    :return: Structured array with the rate fields and the number of zero length segments
+    """
+    dtype = [(CRASH_RATE_FIELD, np.float64)]
+    if tot_fata is not None:
+        dtype += [(FATALITY_RATE_FIELD, np.float64), (FATALITY_COUNT_FIELD, np.int32)]
+
+    attributes = np.zeros(len(join_count), dtype=dtype)
+    attributes[CRASH_RATE_FIELD], zero_length = get_rates(join_count, lengths, time_span)
+    if tot_fata is not None:
+        attributes[FATALITY_RATE_FIELD] = get_rates(tot_fata, lengths, time_span)[0]
+        attributes[FATALITY_COUNT_FIELD] = tot_fata
+    return attributes, zero_length
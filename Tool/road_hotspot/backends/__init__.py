@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""
+Geometry and IO backends of the hotspot pipeline.
+
+The backend modules are imported on demand, so arcpy is only imported when the arcpy
+backend is chosen and GeoPandas only when the GeoPandas one is.
+"""
+BACKENDS = ("arcpy", "geopandas")
+
+
+def get_backend(name, workspace=None):
+    """
+    :param name: Backend name {arcpy, geopandas}
+    :param workspace: Working directory, geodatabase or GeoPackage of the outputs
+    :return: Backend instance
+    """
+    name = name.lower()
+    if name == "arcpy":
+        from road_hotspot.backends.arcgis import ArcpyBackend
+        return ArcpyBackend(workspace)
+    if name == "geopandas":
+        from road_hotspot.backends.geo import GeoPandasBackend
+        return GeoPandasBackend(workspace)
+    raise ValueError("The backend %s is not valid. The values should be %s." % (name, ", ".join(BACKENDS)))
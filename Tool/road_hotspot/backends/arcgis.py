@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+arcpy backend: feature classes and tables of a folder or geodatabase workspace.
+"""
+import os
+
+import arcpy
+import numpy as np
+
+from road_hotspot import ingest
+from road_hotspot.backends.base import Backend
+
+
+class ArcpyBackend(Backend):
+    """Reads and writes feature classes with arcpy.da."""
+
+    name = "arcpy"
+
+    def __init__(self, workspace=None):
+        super().__init__(workspace or arcpy.env.workspace)
+
+    def message(self, text):
+        arcpy.AddMessage(text)
+
+    def warning(self, text):
+        arcpy.AddWarning(text)
+
+    def get_spatial_reference(self, layer):
+        return arcpy.Describe(layer).spatialReference
+
+    def is_projected(self, layer):
+        # The native snapping measures distances in the units of the road coordinate system
+        return self.get_spatial_reference(layer).type == "Projected"
+
+    def get_meters_per_unit(self, layer):
+        return self.get_spatial_reference(layer).metersPerUnit
+
+    def get_path(self, layer):
+        return arcpy.Describe(layer).catalogPath
+
+    def read_road_vertices(self, roads):
+        # Get every vertex of the road segments with its ObjectID, in ObjectID order
+        vertex_array = arcpy.da.FeatureClassToNumPyArray(roads, ["OID@", "SHAPE@XY"], explode_to_points=True)
+        oids, vertices = vertex_array["OID@"], vertex_array["SHAPE@XY"]
+
+        # A NaN vertex separates the parts of the multipart segments, so no piece bridges the gap between them
+        part_counts = {}
+        with arcpy.da.SearchCursor(roads, ["OID@", "SHAPE@"]) as cursor:
+            for oid, shape in cursor:
+                if shape is not None and shape.isMultipart:
+                    part_counts[oid] = [part.count for part in shape]
+        if part_counts:
+            _, first_vertex = np.unique(oids, return_index=True)
+            first_vertex = dict(zip(oids[first_vertex], first_vertex))
+            gaps = np.concatenate([first_vertex[oid] + np.cumsum(counts[:-1], dtype=np.int64)
+                                   for oid, counts in part_counts.items()])
+            oids = np.insert(oids, gaps, oids[gaps])
+            vertices = np.insert(vertices, gaps, np.nan, axis=0)
+        road_oids, vertex_ids = np.unique(oids, return_inverse=True)
+        return road_oids, vertex_ids, vertices
+
+    def read_road_segments(self, roads):
+        # Segment ObjectIDs, midpoints and lengths, in ObjectID order
+        road_array = arcpy.da.FeatureClassToNumPyArray(roads, ["OID@", "SHAPE@XY", "SHAPE@LENGTH"])
+        road_array = road_array[np.argsort(road_array["OID@"], kind="stable")]
+        return road_array["OID@"], road_array["SHAPE@XY"], road_array["SHAPE@LENGTH"]
+
+    def read_road_field(self, roads, field):
+        road_array = arcpy.da.TableToNumPyArray(roads, ["OID@", field], null_value={field: ""})
+        return road_array[field][np.argsort(road_array["OID@"], kind="stable")]
+
+    def get_field_types(self, layer):
+        return {field.name: field.type for field in arcpy.ListFields(layer)}
+
+    def iter_crash_batches(self, crashes, fields, min_oid=None, spatial_reference=None):
+        # Stream the crash table in fixed size batches of structured arrays
+        dtype = ingest.get_dtype(fields, self.get_field_types(crashes))
+        where_clause = None
+        if min_oid is not None:
+            where_clause = "%s > %d" % (arcpy.Describe(crashes).OIDFieldName, min_oid)
+        with arcpy.da.SearchCursor(crashes, fields, where_clause, spatial_reference) as cursor:
+            for batch in ingest.iter_batches(cursor, dtype):
+                yield batch
+
+    def write_road_output(self, roads, output, columns):
+        # Copy the road geometry and add the columns in a single pass
+        road_output = arcpy.management.CopyFeatures(roads, output)
+        oid_field = arcpy.Describe(road_output).OIDFieldName
+        # CopyFeatures keeps the row order, so the sorted ObjectIDs of the copy match the sorted road ObjectIDs
+        copy_oids = np.sort(arcpy.da.FeatureClassToNumPyArray(road_output, "OID@")["OID@"])
+        names = ["OID_JOIN"] + list(columns)
+        array = np.rec.fromarrays([copy_oids] + [np.asarray(columns[name]) for name in columns], names=names)
+        arcpy.da.ExtendTable(road_output, oid_field, array, "OID_JOIN", append_only=False)
+        return road_output
+
+    def write_table(self, output, array, append=False):
+        output_table = os.path.join(self.workspace, output)
+        if append:  # The chunk is converted in memory and appended with the same schema
+            chunk_table = r"memory\table_chunk"
+            arcpy.da.NumPyArrayToTable(array, chunk_table)
+            arcpy.management.Append(chunk_table, output_table, "NO_TEST")
+            arcpy.management.Delete(chunk_table)
+            return output_table
+        if arcpy.Exists(output_table):
+            arcpy.management.Delete(output_table)
+        arcpy.da.NumPyArrayToTable(array, output_table)
+        return output_table
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Geometry and IO backend interface of the hotspot pipeline.
+
+A backend reads the road vertices, segment midpoints and crash batches as NumPy arrays and
+writes the output layers and tables, so the pipeline itself never touches a GIS library.
+Layers are backend specific references: feature class paths or layer names for arcpy,
+"path|layer" strings for GeoPandas.
+"""
+
+
+class Backend:
+    """Reads and writes the layers of one workspace."""
+
+    name = ""
+
+    def __init__(self, workspace):
+        """
+        :param workspace: Working directory, geodatabase or GeoPackage of the outputs and sidecar files
+        """
+        self.workspace = workspace
+
+    def message(self, text):
+        """
+        :param text: Progress message
+        """
+        raise NotImplementedError
+
+    def warning(self, text):
+        """
+        :param text: Warning message
+        """
+        raise NotImplementedError
+
+    def get_spatial_reference(self, layer):
+        """
+        :param layer: Input layer
+        :return: Backend specific spatial reference of the layer
+        """
+        raise NotImplementedError
+
+    def is_projected(self, layer):
+        """
+        :param layer: Input layer
+        :return: True if the layer has a projected coordinate system
+        """
+        raise NotImplementedError
+
+    def get_meters_per_unit(self, layer):
+        """
+        :param layer: Input layer
+        :return: Meters per unit of the layer coordinate system
+        """
+        raise NotImplementedError
+
+    def get_path(self, layer):
+        """
+        :param layer: Input layer
+        :return: Full path of the layer, kept as the geometry reference of the stored tables
+        """
+        raise NotImplementedError
+
+    def read_road_vertices(self, roads):
+        """
+        :param roads: Polyline road layer
+        :return: Sorted road ObjectIDs, segment index of every vertex and (m, 2) array with the vertices, the parts
+                 of a multipart segment being separated by a NaN vertex
+        """
+        raise NotImplementedError
+
+    def read_road_segments(self, roads):
+        """
+        :param roads: Polyline road layer
+        :return: Sorted road ObjectIDs, (n, 2) array with the segment midpoints and the segment lengths,
+                 in the units of the road coordinate system
+        """
+        raise NotImplementedError
+
+    def read_road_field(self, roads, field):
+        """
+        :param roads: Polyline road layer
+        :param field: Attribute field, e.g. the jurisdiction of the segments
+        :return: Values of the field in road ObjectID order
+        """
+        raise NotImplementedError
+
+    def get_field_types(self, layer):
+        """
+        :param layer: Input layer
+        :return: Mapping from field name to its arcpy field type name ("Date", "String", ...)
+        """
+        raise NotImplementedError
+
+    def iter_crash_batches(self, crashes, fields, min_oid=None, spatial_reference=None):
+        """
+        :param crashes: Crash point layer
+        :param fields: Field names and the OID@ and SHAPE@XY tokens to read
+        :param min_oid: Only read the crashes with a larger ObjectID, all of them if None
+        :param spatial_reference: Coordinate system of SHAPE@XY, the layer one if None
+        :return: Generator of structured arrays with the fields, see ingest.get_dtype
+        """
+        raise NotImplementedError
+
+    def write_road_output(self, roads, output, columns):
+        """
+        :param roads: Polyline road layer whose geometry is copied
+        :param output: Output layer name
+        :param columns: Mapping from field name to a column in road ObjectID order
+        :return: Output layer
+        """
+        raise NotImplementedError
+
+    def write_table(self, output, array, append=False):
+        """
+        :param output: Output table name
+        :param array: Structured array with the rows
+        :param append: True to add the rows to the table written by the previous call, for tables written in chunks
+        :return: Output table
+        """
+        raise NotImplementedError
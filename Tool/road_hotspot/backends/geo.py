@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+GeoPandas backend: GeoPackage, GeoParquet and the other formats read by pyogrio.
+
+Layers are given as "path" or "path|layer". The row position of a layer is its ObjectID
+(the feature id for the OGR formats), the outputs are written as layers of the workspace
+GeoPackage. The crash layers are streamed as Arrow record batches, from the row groups of
+GeoParquet files or from the OGR Arrow stream, so only one batch is in memory at a time.
+"""
+import json
+import logging
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyogrio
+import shapely
+from pyproj import CRS, Transformer
+
+from road_hotspot import ingest
+from road_hotspot.backends.base import Backend
+
+logger = logging.getLogger("road_hotspot")
+
+PARQUET_EXTENSIONS = (".parquet", ".geoparquet")
+
+
+def split_layer(layer):
+    """
+    :param layer: "path" or "path|layer"
+    :return: Dataset path and layer name, None for the first layer
+    """
+    path, _, name = str(layer).partition("|")
+    return path, name or None
+
+
+def get_parquet_geometry(schema):
+    """
+    :param schema: Arrow schema of a GeoParquet file
+    :return: Name of the primary geometry column and its CRS, OGC:CRS84 when the metadata has none
+    """
+    geo = json.loads(schema.metadata[b"geo"])
+    return geo["primary_column"], geo["columns"][geo["primary_column"]].get("crs", "OGC:CRS84")
+
+
+class GeoPandasBackend(Backend):
+    """Reads and writes layers with GeoPandas and pyogrio."""
+
+    name = "geopandas"
+
+    def __init__(self, workspace):
+        """
+        :param workspace: Output GeoPackage, the sidecar files are written next to it
+        """
+        super().__init__(workspace)
+
+    def message(self, text):
+        logger.info(text)
+
+    def warning(self, text):
+        logger.warning(text)
+
+    def read_layer(self, layer, columns=None):
+        """
+        :param layer: "path" or "path|layer"
+        :param columns: Attribute columns to read, all of them if None
+        :return: GeoDataFrame indexed by ObjectID
+        """
+        path, name = split_layer(layer)
+        if path.lower().endswith(PARQUET_EXTENSIONS):
+            geometry_column = get_parquet_geometry(pq.read_schema(path))[0]
+            return gpd.read_parquet(path, columns=None if columns is None else list(columns) + [geometry_column])
+        return pyogrio.read_dataframe(path, layer=name, columns=columns, fid_as_index=True)
+
+    def iter_record_batches(self, layer, columns, min_oid=None, read_geometry=True):
+        """
+        :param layer: "path" or "path|layer"
+        :param columns: Attribute columns to read
+        :param min_oid: Only read the rows with a greater ObjectID, all of them if None
+        :param read_geometry: False to skip the geometry column
+        :return: Generator of ObjectIDs, WKB geometry column (None without geometry) and Arrow record batch
+        """
+        path, name = split_layer(layer)
+        if not path.lower().endswith(PARQUET_EXTENSIONS):
+            # The watermark is an attribute filter on the feature ids, evaluated by the OGR driver
+            where = None if min_oid is None else "FID > %d" % min_oid
+            with pyogrio.open_arrow(path, layer=name, columns=columns, read_geometry=read_geometry, where=where,
+                                    return_fids=True, batch_size=ingest.BATCH_SIZE, use_pyarrow=True) as (meta, reader):
+                geometry_column = meta["geometry_name"] or "wkb_geometry"
+                for record_batch in reader:
+                    yield (record_batch.column(meta["fid_column"] or "OGC_FID").to_numpy(),
+                           record_batch.column(geometry_column) if read_geometry else None, record_batch)
+            return
+
+        # The row groups under the watermark are skipped from the file metadata, the first one is sliced
+        parquet = pq.ParquetFile(path)
+        geometry_column = get_parquet_geometry(parquet.schema_arrow)[0]
+        first_row = 0 if min_oid is None else min_oid + 1
+        row_starts = np.cumsum([0] + [parquet.metadata.row_group(index).num_rows
+                                      for index in range(parquet.num_row_groups)])
+        row_groups = [index for index in range(parquet.num_row_groups) if row_starts[index + 1] > first_row]
+        if not row_groups:
+            return
+        start = int(row_starts[row_groups[0]])
+        for record_batch in parquet.iter_batches(ingest.BATCH_SIZE, row_groups=row_groups,
+                                                 columns=list(columns) + ([geometry_column] if read_geometry else [])):
+            skip = min(max(first_row - start, 0), record_batch.num_rows)
+            oids = np.arange(start + skip, start + record_batch.num_rows, dtype=np.int64)
+            start += record_batch.num_rows
+            record_batch = record_batch.slice(skip)
+            yield oids, record_batch.column(geometry_column) if read_geometry else None, record_batch
+
+    def get_spatial_reference(self, layer):
+        path, name = split_layer(layer)
+        if path.lower().endswith(PARQUET_EXTENSIONS):
+            crs = get_parquet_geometry(pq.read_schema(path))[1]
+        else:
+            crs = pyogrio.read_info(path, layer=name)["crs"]
+        return CRS.from_user_input(crs) if crs else None
+
+    def is_projected(self, layer):
+        crs = self.get_spatial_reference(layer)
+        return crs is not None and crs.is_projected
+
+    def get_meters_per_unit(self, layer):
+        return self.get_spatial_reference(layer).axis_info[0].unit_conversion_factor
+
+    def get_path(self, layer):
+        path, name = split_layer(layer)
+        return os.path.abspath(path) + ("|" + name if name else "")
+
+    def read_road_vertices(self, roads):
+        frame = self.read_layer(roads, columns=[]).sort_index(kind="stable")
+        # A NaN vertex separates the parts of the multipart segments, so no piece bridges the gap between them
+        parts, part_ids = shapely.get_parts(frame.geometry.values, return_index=True)
+        vertices, vertex_parts = shapely.get_coordinates(parts, return_index=True)
+        vertex_ids = part_ids[vertex_parts]
+        gaps = np.flatnonzero((vertex_parts[1:] != vertex_parts[:-1]) & (vertex_ids[1:] == vertex_ids[:-1])) + 1
+        return frame.index.to_numpy(), np.insert(vertex_ids, gaps, vertex_ids[gaps]), np.insert(vertices, gaps,
+                                                                                                 np.nan, axis=0)
+
+    def read_road_segments(self, roads):
+        frame = self.read_layer(roads, columns=[]).sort_index(kind="stable")
+        midpoints = shapely.get_coordinates(frame.geometry.centroid.values)
+        return frame.index.to_numpy(), midpoints, frame.geometry.length.to_numpy()
+
+    def read_road_field(self, roads, field):
+        return self.read_layer(roads, columns=[field]).sort_index(kind="stable")[field].to_numpy()
+
+    def get_field_types(self, layer):
+        # Field types from the layer schema, no feature is read
+        path, name = split_layer(layer)
+        if path.lower().endswith(PARQUET_EXTENSIONS):
+            return {field.name: "Date" if pa.types.is_timestamp(field.type) or pa.types.is_date(field.type)
+                    else str(field.type) for field in pq.read_schema(path)}
+        info = pyogrio.read_info(path, layer=name)
+        return {field: "Date" if dtype.startswith("datetime64") else dtype
+                for field, dtype in zip(info["fields"], info["dtypes"])}
+
+    def iter_crash_batches(self, crashes, fields, min_oid=None, spatial_reference=None):
+        # Stream the record batches, only reading the geometry column when the points are needed
+        dtype = ingest.get_dtype(fields, self.get_field_types(crashes))
+        columns = [field for field in fields if field not in ingest.TOKEN_TYPES]
+        read_geometry = "SHAPE@XY" in fields
+        transformer = None
+        if read_geometry and spatial_reference is not None:
+            crash_reference = self.get_spatial_reference(crashes)
+            if crash_reference is None:
+                raise ValueError("The crash layer %s has no coordinate system, define it to match the crash points "
+                                 "with the road network." % crashes)
+            transformer = Transformer.from_crs(crash_reference, spatial_reference, always_xy=True)
+        for oids, geometry, record_batch in self.iter_record_batches(crashes, columns, min_oid, read_geometry):
+            batch = np.zeros(len(oids), dtype=dtype)
+            for field in fields:
+                if field == "OID@":
+                    batch[field] = oids
+                elif field == "SHAPE@XY":
+                    points = shapely.from_wkb(geometry.to_numpy(zero_copy_only=False))
+                    x, y = shapely.get_x(points), shapely.get_y(points)
+                    if transformer is not None:
+                        x, y = transformer.transform(x, y)
+                    batch[field] = np.column_stack([x, y])
+                else:
+                    batch[field] = record_batch.column(field).to_numpy(zero_copy_only=False)
+            yield batch
+
+    def write_road_output(self, roads, output, columns):
+        frame = self.read_layer(roads).sort_index(kind="stable")
+        for name, values in columns.items():
+            frame[name] = np.asarray(values)
+        pyogrio.write_dataframe(frame, self.workspace, layer=output)
+        return "%s|%s" % (self.workspace, output)
+
+    def write_table(self, output, array, append=False):
+        pyogrio.write_dataframe(pd.DataFrame(array), self.workspace, layer=output, append=append)
+        return "%s|%s" % (self.workspace, output)
@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+"""
+Batch runner: many (region, date window, date span) jobs over one road network and crash table.
+
+The road network is read and indexed, and every crash is snapped and assigned to its road
+segment, once for the whole batch. Each region then pays its own setup once (segment
+selection, distance band and Gi* weights, the latter through the weights cache), and the
+date windows of its jobs are boolean filters over the assigned crashes. The regions are
+analyzed in a pool of worker processes, all the jobs of a region sharing one Gi* product,
+and the results of every job are written as one consolidated table.
+
+Manifests are CSV or JSON files with one job per row and the columns:
+
+- name: job name, written in the JOB field of the results
+- region: FIELD=VALUE filter on the road layer, empty for the whole network
+- start, end: first and last day of the date window (YYYY-MM-DD), empty for the data extent. The
+  rates are averaged over the whole window, even where it has no crashes
+- years: rolling window of the last N years before end (or the last crash), instead of start
+- date_span: date span of the averages {year, month, week}, year if empty
+
+Run from the Tool folder, e.g.::
+
+    python -m road_hotspot.batch jobs.csv crashes.gpkg roads.gpkg --date-field CRASH_DATE --output results.gpkg
+"""
+import argparse
+import csv
+import json
+import logging
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from numpy.lib import recfunctions as rfn
+
+from road_hotspot import (attributes, gi_star, incremental, pipeline, profiling, snapping, tiling,
+                          weights_cache)
+from road_hotspot.backends import BACKENDS, get_backend
+
+MANIFEST_FIELDS = ("name", "region", "start", "end", "years", "date_span")
+RESULT_TABLE = "Batch_hotspots"
+SUMMARY_SUFFIX = "_summary"
+NAME_LENGTH = 64
+
+
+def read_manifest(path):
+    """
+    :param path: CSV or JSON manifest, see the module docstring
+    :return: List of job dictionaries with every manifest field
+    """
+    if path.lower().endswith(".json"):
+        with open(path, encoding="utf-8") as manifest:
+            rows = json.load(manifest)
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as manifest:
+            rows = list(csv.DictReader(manifest))
+
+    jobs = []
+    for number, row in enumerate(rows, 1):
+        job = {field: str(row.get(field) or "").strip() for field in MANIFEST_FIELDS}
+        job["name"] = job["name"] or "job_%d" % number
+        job["date_span"] = job["date_span"].lower() or "year"
+        if job["date_span"] not in attributes.DATE_VALUES:
+            raise ValueError("The date %s of the job %s is not valid. The values should be Year, Month, or Week."
+                             % (job["date_span"], job["name"]))
+        if job["start"] and job["years"]:
+            raise ValueError("The job %s has both a start date and a number of years." % job["name"])
+        jobs.append(job)
+    if not jobs:
+        raise ValueError("The manifest %s has no jobs." % path)
+    return jobs
+
+
+def parse_region(region):
+    """
+    :param region: FIELD=VALUE filter, empty for the whole network
+    :return: (field, value) tuple, None for the whole network
+    """
+    if not region:
+        return None
+    if "=" not in region:
+        raise ValueError("The region %s is not valid. It should be given as FIELD=VALUE." % region)
+    field, value = region.split("=", 1)
+    return field.strip(), value.strip().strip("'\"")
+
+
+def get_window(job, min_date, max_date):
+    """
+    :param job: Job dictionary
+    :param min_date: Earliest assigned crash date
+    :param max_date: Latest assigned crash date
+    :return: First and last included instants of the date window, as datetime64[us]
+    """
+    # The end day is included as a whole, a missing end is the last crash
+    if job["end"]:
+        end = np.datetime64(job["end"], "D") + np.timedelta64(1, "D") - np.timedelta64(1, "us")
+    else:
+        end = np.datetime64(max_date, "us")
+    if job["years"]:
+        start = np.datetime64(pd.Timestamp(end) - pd.DateOffset(years=float(job["years"])), "us")
+    elif job["start"]:
+        start = np.datetime64(job["start"], "D")
+    else:
+        start = min_date
+    return np.datetime64(start, "us"), np.datetime64(end, "us")
+
+
+def assign_crashes(backend, crashes, roads, snap_distance, date_field, report_type_field="", fatalities_name="",
+                   workers=1):
+    """
+    :param backend: Geometry/IO backend
+    :param crashes: Crash point layer
+    :param roads: Polyline road layer, in a projected coordinate system
+    :param snap_distance: Linear distance string, e.g. "0.25 Miles"
+    :param date_field: Date field of the crash layer
+    :param report_type_field: Report type field, used with fatalities_name
+    :param fatalities_name: Fatal incident name, empty to skip the fatalities
+    :param workers: Worker processes of the tiled assignment
+    :return: Road ObjectIDs, and the segment index, date and fatal flag of the assigned crashes
+    """
+    spatial_reference = backend.get_spatial_reference(roads)
+    tolerance = snapping.get_tolerance(snap_distance, backend.get_meters_per_unit(roads))
+    road_oids, vertex_ids, vertices = backend.read_road_vertices(roads)
+    road_index = assigner = None
+    if workers <= 1:
+        road_index = snapping.build_index(vertex_ids, vertices, tolerance)
+    else:  # Worker processes started once for every batch
+        assigner = tiling.TiledAssigner(vertex_ids, vertices, tolerance, workers)
+
+    # Only the assigned crashes with a date are kept, as compact columns
+    fields = ["OID@", date_field] + ([report_type_field] if fatalities_name else []) + ["SHAPE@XY"]
+    segments, dates, fatal_flags = [], [], []
+    n_crashes = 0
+    try:
+        for batch in backend.iter_crash_batches(crashes, fields, spatial_reference=spatial_reference):
+            n_crashes += len(batch)
+            if assigner is not None:
+                segment = assigner.nearest(batch["SHAPE@XY"])[0]
+            else:
+                segment = road_index.nearest(batch["SHAPE@XY"], tolerance)[0]
+            batch_dates = batch[date_field].astype("datetime64[us]")
+            keep = (segment >= 0) & ~np.isnat(batch_dates)
+            segments.append(segment[keep].astype(np.int32))
+            dates.append(batch_dates[keep])
+            if fatalities_name:
+                fatal_flags.append(attributes.get_fatal_flag(batch[report_type_field], fatalities_name)[keep])
+    finally:
+        if assigner is not None:
+            assigner.close()
+
+    segment = np.concatenate(segments) if segments else np.zeros(0, dtype=np.int32)
+    backend.message("%d of %d crash points assigned to the road segments." % (len(segment), n_crashes))
+    return (road_oids, segment, np.concatenate(dates) if dates else np.zeros(0, dtype="datetime64[us]"),
+            np.concatenate(fatal_flags) if fatal_flags else None)
+
+
+def get_region_segments(backend, roads, region, n_segments):
+    """
+    :param backend: Geometry/IO backend
+    :param roads: Polyline road layer
+    :param region: (field, value) tuple, None for the whole network
+    :param n_segments: Number of road segments
+    :return: Sorted segment indexes of the region
+    """
+    if region is None:
+        return np.arange(n_segments)
+    field, value = region
+    values = np.asarray(backend.read_road_field(roads, field))
+    return np.flatnonzero(values.astype(str) == value)
+
+
+def get_job_rates(job, segment, dates, fatal_flag, lengths, min_date, max_date):
+    """
+    :param job: Job dictionary
+    :param segment: Region segment index of every crash of the region
+    :param dates: Date of every crash of the region
+    :param fatal_flag: Fatal flag of every crash of the region, None to skip the fatalities
+    :param lengths: Length of the region segments
+    :param min_date: Earliest assigned crash date of the batch
+    :param max_date: Latest assigned crash date of the batch
+    :return: Road attributes of the region segments (see attributes.get_road_attributes), crash count per
+             segment, date window and time span
+    """
+    start, end = get_window(job, min_date, max_date)
+    in_window = (dates >= start) & (dates <= end)
+    crash_count = np.bincount(segment[in_window], minlength=len(lengths))
+    # The span of the window itself, the open bounds of the manifest being the data extent
+    time_span = attributes.get_time_span(start, end, job["date_span"])
+    tot_fata = None
+    if fatal_flag is not None:
+        tot_fata = np.bincount(segment[in_window], weights=fatal_flag[in_window],
+                               minlength=len(lengths)).astype(np.int32)
+    road_attributes = attributes.get_road_attributes(crash_count, lengths, time_span, tot_fata=tot_fata)[0]
+    return road_attributes, crash_count, (start, end), time_span
+
+
+def region_gi_star(points, values, distance_band, source_ids, cache_dir):
+    """
+    :param points: (n, 2) array with the region segment midpoints
+    :param values: (n, k) array with the rates of every job of the region
+    :param distance_band: Distance band of the region
+    :param source_ids: Id of every region segment
+    :param cache_dir: Weights cache folder, None to disable the cache
+    :return: Gi* z-scores, p-values and number of neighbors
+    """
+    # Runs in the worker processes, every job of the region shares the weights and the sparse product
+    return pipeline.get_gi_star(points, values, distance_band, source_ids, cache_dir)
+
+
+def get_result_array(job, window, time_span, source_ids, crash_count, road_attributes, z_scores, p_values, neighbors):
+    """
+    :param job: Job dictionary
+    :param window: First and last instants of the date window
+    :param time_span: Number of date spans of the window
+    :param source_ids: Id of every region segment
+    :param crash_count: Crashes per region segment in the window
+    :param road_attributes: Rate fields of the region segments
+    :param z_scores: (n, 1) crash, or (n, 2) crash and fatality, Gi* z-scores
+    :param p_values: Gi* p-values with the shape of z_scores
+    :param neighbors: Number of neighbors of every region segment
+    :return: Structured array with the job, window and hotspot fields of every region segment
+    """
+    job_dtype = [("JOB", "U%d" % NAME_LENGTH), ("REGION", "U%d" % NAME_LENGTH), ("DATE_SPAN", "U5"),
+                 ("WINDOW_START", "M8[us]"), ("WINDOW_END", "M8[us]"), ("TIME_SPAN", np.float64),
+                 ("Join_Count", np.int32)]
+    job_fields = np.zeros(len(source_ids), dtype=job_dtype)
+    job_fields["JOB"] = job["name"]
+    job_fields["REGION"] = job["region"] or "All"
+    job_fields["DATE_SPAN"] = job["date_span"]
+    job_fields["WINDOW_START"], job_fields["WINDOW_END"] = window
+    job_fields["TIME_SPAN"] = time_span
+    job_fields["Join_Count"] = crash_count
+    arrays = [job_fields, road_attributes,
+              gi_star.get_hotspot_array(z_scores[:, 0], p_values[:, 0], neighbors, source_ids)]
+    if z_scores.shape[1] > 1:  # Fatality hotspots, named like the category hotspot fields
+        fatality_hotspots = gi_star.get_category_array(z_scores[:, 1:], p_values[:, 1:], neighbors, ["fata"],
+                                                       source_ids)
+        arrays.append(rfn.drop_fields(fatality_hotspots, ["SOURCE_ID", "NNeighbors"], usemask=False))
+    return rfn.merge_arrays(arrays, flatten=True, usemask=False)
+
+
+def get_summary_array(summaries):
+    """
+    :param summaries: List of job summary dictionaries
+    :return: Structured array with one row per job
+    """
+    dtype = [("JOB", "U%d" % NAME_LENGTH), ("REGION", "U%d" % NAME_LENGTH), ("DATE_SPAN", "U5"),
+             ("WINDOW_START", "M8[us]"), ("WINDOW_END", "M8[us]"), ("TIME_SPAN", np.float64),
+             ("SEGMENTS", np.int32), ("CRASHES", np.int64), ("HOTSPOTS", np.int32), ("COLDSPOTS", np.int32)]
+    summary = np.zeros(len(summaries), dtype=dtype)
+    for row, values in enumerate(summaries):
+        for field, _ in dtype:
+            summary[field][row] = values[field]
+    return summary
+
+
+def run(backend, manifest, crashes, date_field, roads, output=RESULT_TABLE, report_type_field="",
+        fatalities_name="", max_distance="", units="", workers=1, run_profile=None):
+    """
+    :param backend: Geometry/IO backend
+    :param manifest: CSV or JSON manifest, or a list of job dictionaries
+    :param crashes: Crash point layer
+    :param date_field: Date field of the crash layer
+    :param roads: Polyline road layer, in a projected coordinate system
+    :param output: Consolidated results table name, the job summary is written to output + "_summary"
+    :param report_type_field: Report type field
+    :param fatalities_name: Report type value of the fatal incidents, empty to skip the fatality hotspots
+    :param max_distance: Snap distance, 0.25 miles if empty
+    :param units: Units of the snap distance and of the segment lengths, US miles if empty
+    :param workers: Worker processes of the assignment and of the regions
+    :param run_profile: Optional profiling.RunProfile recording the stages
+    :return: Results table, summary table
+    """
+    jobs = read_manifest(manifest) if isinstance(manifest, str) else manifest
+    if not backend.is_projected(roads):
+        raise ValueError("The batch runner needs a road network in a projected coordinate system.")
+    run_profile = run_profile or profiling.RunProfile()
+    cache_dir = weights_cache.get_cache_dir(backend.workspace)
+
+    ## Shared setup: every crash is snapped and assigned once for all the jobs
+    with run_profile.stage("join") as stage:
+        road_oids, segment, dates, fatal_flag = assign_crashes(
+            backend, crashes, roads, pipeline.get_snap_distance(max_distance, units), date_field,
+            report_type_field, fatalities_name, workers)
+        stage["rows"] = len(segment)
+    if not len(segment):
+        raise ValueError("No crash point was assigned to the road network.")
+    min_date, max_date = dates.min(), dates.max()
+    with run_profile.stage("segments"):
+        segments = pipeline.read_road_segments(backend, roads, units)
+        midpoints = np.column_stack([segments["X"], segments["Y"]])
+        lengths = segments[pipeline.get_length_field(units)]
+
+    ## Setup of every region once, then the date windows of its jobs as filters
+    regions = {}
+    for job in jobs:
+        regions.setdefault(job["region"], []).append(job)
+    tasks = []
+    with run_profile.stage("regions") as stage:
+        for region, region_jobs in regions.items():
+            region_segments = get_region_segments(backend, roads, parse_region(region), len(road_oids))
+            if len(region_segments) <= 8:  # Every segment needs 8 others for the distance band
+                backend.warning("The region %s has less than 9 road segments, its jobs were skipped." %
+                                (region or "All"))
+                continue
+            # Crashes of the region, renumbered to the region segments
+            local_index = np.full(len(road_oids), -1, dtype=np.int64)
+            local_index[region_segments] = np.arange(len(region_segments))
+            in_region = local_index[segment] >= 0
+            region_segment = local_index[segment[in_region]]
+            # Average 8 neighbor distance of the region segment midpoints
+            distance_band = weights_cache.get_distance_band(midpoints[region_segments], road_oids[region_segments],
+                                                            cache_dir)
+
+            values, job_results = [], []
+            for job in region_jobs:
+                job_results.append(get_job_rates(job, region_segment, dates[in_region],
+                                                 None if fatal_flag is None else fatal_flag[in_region],
+                                                 lengths[region_segments], min_date, max_date))
+                road_attributes = job_results[-1][0]
+                if not job_results[-1][1].any():  # Empty window, the rates and z-scores of the job are all 0
+                    backend.warning("The job %s has no crashes in its date window in the region %s." %
+                                    (job["name"], region or "All"))
+                values.append(road_attributes[attributes.CRASH_RATE_FIELD])
+                if fatal_flag is not None:
+                    values.append(road_attributes[attributes.FATALITY_RATE_FIELD])
+            tasks.append((region, region_jobs, job_results, region_segments, distance_band,
+                          np.column_stack(values)))
+        stage["rows"] = sum(len(task[1]) for task in tasks)
+
+    ## Gi* of every region, the regions being spread over the worker pool
+    with run_profile.stage("hotspots") as stage:
+        arguments = [(midpoints[task[3]], task[5], task[4], road_oids[task[3]], cache_dir) for task in tasks]
+        if workers > 1 and len(tasks) > 1:
+            tiling.configure_executable()
+            with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+                gi_results = list(executor.map(region_gi_star, *zip(*arguments)))
+        else:
+            gi_results = [region_gi_star(*task_arguments) for task_arguments in arguments]
+        stage["rows"] = sum(len(task[3]) * task[5].shape[1] for task in tasks)
+
+    ## One consolidated table with every job, and a summary row per job
+    columns = 2 if fatal_flag is not None else 1
+    results, summaries = [], []
+    with run_profile.stage("write") as stage:
+        for (_, region_jobs, job_results, region_segments, _, _), (z_scores, p_values, neighbors) in \
+                zip(tasks, gi_results):
+            for position, (job, (road_attributes, crash_count, window, time_span)) in enumerate(
+                    zip(region_jobs, job_results)):
+                job_columns = slice(position * columns, (position + 1) * columns)
+                job_result = get_result_array(job, window, time_span, road_oids[region_segments],
+                                              crash_count, road_attributes, z_scores[:, job_columns],
+                                              p_values[:, job_columns], neighbors)
+                results.append(job_result)
+                summaries.append({"JOB": job["name"], "REGION": job["region"] or "All",
+                                  "DATE_SPAN": job["date_span"], "WINDOW_START": window[0], "WINDOW_END": window[1],
+                                  "TIME_SPAN": time_span, "SEGMENTS": len(region_segments),
+                                  "CRASHES": int(crash_count.sum()), "HOTSPOTS": int((job_result["Gi_Bin"] > 0).sum()),
+                                  "COLDSPOTS": int((job_result["Gi_Bin"] < 0).sum())})
+                backend.message("%s: %d crashes on %d segments, %d hot and %d cold spots." %
+                                (job["name"], summaries[-1]["CRASHES"], len(region_segments),
+                                 summaries[-1]["HOTSPOTS"], summaries[-1]["COLDSPOTS"]))
+        if not results:
+            raise ValueError("Every job of the manifest was skipped.")
+        results = np.concatenate(results)
+        stage["rows"] = len(results)
+        result_table = backend.write_table(output, results)
+        summary_table = backend.write_table(output + SUMMARY_SUFFIX, get_summary_array(summaries))
+    backend.message("%d jobs of %d regions written to %s." % (len(summaries), len(tasks), result_table))
+    return result_table, summary_table
+
+
+def get_parser():
+    """
+    :return: Argument parser of the batch command line
+    """
+    parser = argparse.ArgumentParser(prog="python -m road_hotspot.batch",
+                                     description="Road accident hotspot analysis of many regions and periods.")
+    parser.add_argument("manifest", help="CSV or JSON manifest with the name, region, start, end, years and "
+                                         "date_span of every job")
+    parser.add_argument("crashes", help='Crash point layer, "path" or "path|layer"')
+    parser.add_argument("roads", help='Polyline road layer in a projected coordinate system, "path" or "path|layer"')
+    parser.add_argument("--date-field", required=True, help="Date field of the crash layer")
+    parser.add_argument("--output", required=True, help="Output GeoPackage, or workspace for the arcpy backend")
+    parser.add_argument("--backend", choices=BACKENDS, default="geopandas", help="Geometry/IO backend")
+    parser.add_argument("--table", default=RESULT_TABLE, help="Consolidated results table name")
+    parser.add_argument("--report-type-field", default="", help="Report type field")
+    parser.add_argument("--fatal-value", default="", help="Report type value of the fatal incidents, "
+                                                          "enables the fatality hotspots")
+    parser.add_argument("--snap-distance", default="", help="Snap distance, 0.25 miles by default")
+    parser.add_argument("--units", default="", help="Units of the snap distance and segment lengths, e.g. Meters")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes of the assignment and regions")
+    return parser
+
+
+def main(argv=None):
+    """
+    :param argv: Command line arguments, sys.argv if None
+    :return: Exit code
+    """
+    args = get_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    backend = get_backend(args.backend, args.output)
+    if args.backend == "arcpy":  # The outputs go to the same workspace
+        import arcpy
+        arcpy.env.workspace = args.output
+        arcpy.env.overwriteOutput = True
+
+    profile_path = incremental.get_sidecar_path(args.output, profiling.PROFILE_NAME)
+    run_profile = profiling.RunProfile()
+    try:
+        run(backend, args.manifest, args.crashes, args.date_field, args.roads, args.table, args.report_type_field,
+            args.fatal_value, args.snap_distance, args.units, args.workers, run_profile)
+    except ValueError as error:
+        logging.getLogger("road_hotspot").error(str(error))
+        return 1
+    finally:
+        if run_profile.stages:
+            backend.message("Run profile written to %s." % run_profile.write(profile_path)[0])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar intermediate store of the road segment attributes.
+
+The non-geometry stages (counts, rates, hotspots and report) exchange their columns as
+tables in a folder next to the workspace instead of scratch feature classes. A table is
+written as an uncompressed Arrow IPC file when pyarrow is installed, or as a structured
+NumPy .npy file otherwise, and both are memory mapped when read, so the stages share the
+columns without a cursor pass or a copy. The road geometry is not stored: every table keeps
+the road layer and its segment ObjectIDs as a reference.
+"""
+import json
+import os
+
+import numpy as np
+
+from road_hotspot import incremental
+
+try:
+    import pyarrow as pa
+except ImportError:  # The NumPy format is used instead
+    pa = None
+
+STORE_NAME = "hotspot_columns"
+SEGMENT_TABLE = "segments"  # Segment ids, midpoints, lengths and incident counts
+RATE_TABLE = "rates"  # Average incidents per segment length and date span
+REFERENCE_SUFFIX = ".json"
+
+
+def get_store_dir(workspace):
+    """
+    :param workspace: Working directory or geodatabase
+    :return: Store folder next to the workspace, created if needed
+    """
+    store_dir = incremental.get_sidecar_path(workspace, STORE_NAME)
+    os.makedirs(store_dir, exist_ok=True)
+    return store_dir
+
+
+def get_table_path(store_dir, name):
+    """
+    :param store_dir: Store folder
+    :param name: Table name
+    :return: Path of the table file in the available format
+    """
+    return os.path.join(store_dir, name + (".arrow" if pa is not None else ".npy"))
+
+
+def write_table(store_dir, name, columns, reference=None):
+    """
+    :param store_dir: Store folder
+    :param name: Table name
+    :param columns: Mapping from column name to a 1D array, every column with the same length
+    :param reference: Optional JSON serializable reference to the geometry, e.g. the road layer path
+    :return: Path of the table file
+    """
+    path = get_table_path(store_dir, name)
+    columns = {column: np.ascontiguousarray(values) for column, values in columns.items()}
+    if pa is not None:
+        table = pa.table({column: pa.array(values) for column, values in columns.items()})
+        with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        length = len(next(iter(columns.values()))) if columns else 0
+        array = np.zeros(length, dtype=[(column, values.dtype) for column, values in columns.items()])
+        for column, values in columns.items():
+            array[column] = values
+        np.save(path, array)
+
+    with open(os.path.join(store_dir, name + REFERENCE_SUFFIX), "w") as reference_file:
+        json.dump(reference, reference_file)
+    return path
+
+
+def read_table(store_dir, name):
+    """
+    :param store_dir: Store folder
+    :param name: Table name
+    :return: Mapping from column name to a read only, memory mapped array, and the geometry reference
+    """
+    path = get_table_path(store_dir, name)
+    if not os.path.exists(path):
+        raise IOError("The table %s is not in the store %s." % (name, store_dir))
+    if pa is not None:
+        table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+        columns = {column: table.column(column).combine_chunks().to_numpy(zero_copy_only=False)
+                   for column in table.column_names}
+    else:
+        array = np.load(path, mmap_mode="r")
+        columns = {column: array[column] for column in array.dtype.names}
+
+    with open(os.path.join(store_dir, name + REFERENCE_SUFFIX)) as reference_file:
+        reference = json.load(reference_file)
+    return columns, reference
+
+
+def to_records(columns, names=None):
+    """
+    :param columns: Mapping from column name to a 1D array
+    :param names: Columns to keep, all of them by default
+    :return: Structured array with the columns, e.g. for arcpy.da.ExtendTable
+    """
+    names = list(columns) if names is None else list(names)
+    return np.rec.fromarrays([np.asarray(columns[name]) for name in names], names=names)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Getis-Ord Gi* hotspot statistic computed with NumPy/SciPy.
+
+Reproduces arcpy.stats.HotSpots with a FIXED_DISTANCE_BAND conceptualization and
+EUCLIDEAN_DISTANCE, so the hotspot step can run (and be profiled) without ArcGIS.
+"""
+import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
+from scipy.special import ndtr
+
+# Gi_Bin levels and their two tailed significance (90, 95 and 99 percent confidence)
+CONFIDENCE_LEVELS = ((1, 0.10), (2, 0.05), (3, 0.01))
+
+# Output fields, named like the fields written by arcpy.stats.HotSpots
+HOTSPOT_DTYPE = [("SOURCE_ID", np.int32), ("GiZScore", np.float64), ("GiPValue", np.float64),
+                 ("NNeighbors", np.int32), ("Gi_Bin", np.int32)]
+
+
+def get_distance_band(points, neighbors=8):
+    """
+    :param points: (n, 2) array with the point coordinates
+    :param neighbors: Number of neighbors every point should have
+    :return: Minimum, average and maximum distance to the k-th neighbor, like arcpy.stats.CalculateDistanceBand
+    """
+    points = np.asarray(points, dtype=float)
+    if len(points) <= neighbors:  # Every point needs at least k other points
+        raise ValueError("At least %d points are needed to calculate the distance band." % (neighbors + 1))
+
+    # Query k + 1 neighbors because every point is its own nearest neighbor
+    distances, _ = cKDTree(points).query(points, k=neighbors + 1)
+    kth_distance = distances[:, -1]
+    return kth_distance.min(), kth_distance.mean(), kth_distance.max()
+
+
+def build_weights(points, distance_band):
+    """
+    :param points: (n, 2) array with the segment midpoints
+    :param distance_band: Fixed distance threshold, in the units of the points
+    :return: Binary (n, n) CSR weights matrix, each feature being its own neighbor as in Gi*
+    """
+    points = np.asarray(points, dtype=float)
+    n = len(points)
+
+    # Every pair of features closer than the distance band (i < j)
+    pairs = cKDTree(points).query_pairs(distance_band, output_type="ndarray")
+    diagonal = np.arange(n)
+    rows = np.concatenate([pairs[:, 0], pairs[:, 1], diagonal])
+    cols = np.concatenate([pairs[:, 1], pairs[:, 0], diagonal])
+
+    weights = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+    weights.sort_indices()  # Keep a deterministic summation order
+    return weights
+
+
+def gi_star(values, weights):
+    """
+    :param values: (n,) array, or (n, k) array to analyze k fields at once
+    :param weights: (n, n) sparse weights matrix including the diagonal
+    :return: Gi* z-scores and two tailed p-values with the shape of values
+    """
+    x = np.asarray(values, dtype=float)
+    if x.shape[0] < 2:
+        raise ValueError("At least 2 features are needed to calculate Gi*.")
+
+    # Sum of the weights and of the squared weights of each feature
+    w_sum = np.asarray(weights.sum(axis=1)).ravel()
+    w_sq_sum = np.asarray(weights.multiply(weights).sum(axis=1)).ravel()
+
+    # Local sums for all features (and fields) in one sparse product
+    local_sum = weights @ x
+    return gi_star_from_sums(local_sum, w_sum, w_sq_sum, x)
+
+
+def gi_star_from_sums(local_sum, w_sum, w_sq_sum, values):
+    """
+    :param local_sum: Weighted sum of the neighbor values of each feature, (m,) or (m, k)
+    :param w_sum: Sum of the weights of each feature, (m,)
+    :param w_sq_sum: Sum of the squared weights of each feature, (m,)
+    :param values: All the (n,) or (n, k) values, for the global mean and standard deviation
+    :return: Gi* z-scores and two tailed p-values of the m features
+    """
+    x = np.asarray(values, dtype=float)
+    n = x.shape[0]
+
+    # Global statistics
+    x_mean = x.mean(axis=0)
+    x_std = np.sqrt((x ** 2).mean(axis=0) - x_mean ** 2)
+    if x.ndim == 2:  # Broadcast over the analysis fields
+        w_sum = w_sum[:, None]
+        w_sq_sum = w_sq_sum[:, None]
+
+    numerator = local_sum - x_mean * w_sum
+    denominator = x_std * np.sqrt((n * w_sq_sum - w_sum ** 2) / (n - 1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z_scores = np.where(denominator > 0, numerator / denominator, 0.0)
+    p_values = 2 * ndtr(-np.abs(z_scores))
+    return z_scores, p_values
+
+
+def get_fdr_threshold(p_values, alpha):
+    """
+    :param p_values: (n,) or (n, k) p-values, one test per row and field
+    :param alpha: False discovery rate
+    :return: Benjamini-Hochberg p-value threshold of every field, 0 where nothing is significant
+    """
+    p_values = np.asarray(p_values, dtype=float)
+    n = p_values.shape[0]
+    ordered = np.sort(p_values.reshape(n, -1), axis=0)
+    # Largest p-value under its rank line i / n * alpha
+    below = ordered <= np.arange(1, n + 1)[:, None] / n * alpha
+    last = n - 1 - np.argmax(below[::-1], axis=0)
+    threshold = np.where(below.any(axis=0), ordered[last, np.arange(ordered.shape[1])], 0.0)
+    return threshold if p_values.ndim > 1 else threshold[0]
+
+
+def get_gi_bin(z_scores, p_values, fdr=False):
+    """
+    :param z_scores: Gi* z-scores
+    :param p_values: Gi* p-values
+    :param fdr: True to apply the False Discovery Rate correction to every confidence level
+    :return: Gi_Bin values, -3 to 3 for cold spots and hot spots at 99, 95 and 90 percent confidence
+    """
+    bins = np.zeros(np.shape(z_scores), dtype=np.int32)
+    for level, alpha in CONFIDENCE_LEVELS:
+        # With the correction the p-value has to be under the Benjamini-Hochberg threshold of the level
+        threshold = get_fdr_threshold(p_values, alpha) if fdr else alpha
+        bins[p_values <= threshold] = level
+    return bins * np.sign(z_scores).astype(np.int32)
+
+
+def get_hotspot_array(z_scores, p_values, neighbors, source_ids, fdr=False):
+    """
+    :param z_scores: Gi* z-scores
+    :param p_values: Gi* p-values, analytic or pseudo p-values of the permutations
+    :param neighbors: Number of neighbors of every feature
+    :param source_ids: Feature ids to write in SOURCE_ID
+    :param fdr: True to apply the False Discovery Rate correction to Gi_Bin
+    :return: Structured array with SOURCE_ID, GiZScore, GiPValue, NNeighbors and Gi_Bin
+    """
+    hotspots = np.zeros(len(z_scores), dtype=HOTSPOT_DTYPE)
+    hotspots["SOURCE_ID"] = source_ids
+    hotspots["GiZScore"] = z_scores
+    hotspots["GiPValue"] = p_values
+    hotspots["NNeighbors"] = neighbors
+    hotspots["Gi_Bin"] = get_gi_bin(z_scores, p_values, fdr)
+    return hotspots
+
+
+def get_category_array(z_scores, p_values, neighbors, names, source_ids, fdr=False):
+    """
+    :param z_scores: (n, k) Gi* z-scores
+    :param p_values: (n, k) Gi* p-values
+    :param neighbors: Number of neighbors of every feature
+    :param names: Name of every column, used in the output field names
+    :param source_ids: Feature ids to write in SOURCE_ID
+    :param fdr: True to apply the False Discovery Rate correction to the Bin_ fields, per column
+    :return: Structured array with SOURCE_ID, NNeighbors and GiZ_, GiP_ and Bin_ fields per column
+    """
+    bins = get_gi_bin(z_scores, p_values, fdr)
+    dtype = [("SOURCE_ID", np.int32), ("NNeighbors", np.int32)]
+    for name in names:
+        dtype += [("GiZ_" + name, np.float64), ("GiP_" + name, np.float64), ("Bin_" + name, np.int32)]
+    hotspots = np.zeros(len(z_scores), dtype=dtype)
+    hotspots["SOURCE_ID"] = source_ids
+    hotspots["NNeighbors"] = neighbors
+    for column, name in enumerate(names):
+        hotspots["GiZ_" + name] = z_scores[:, column]
+        hotspots["GiP_" + name] = p_values[:, column]
+        hotspots["Bin_" + name] = bins[:, column]
+    return hotspots
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Sidecar store for the incremental (append) mode.
+
+The per-segment crash counts, fatality sums, the crash date extent and the crash table
+watermark (largest ObjectID processed) are kept in a SQLite file next to the workspace,
+so a rerun only assigns the crashes added since the previous run. The state is keyed on a
+hash of the road geometry and of the settings that change the counts; when either changes
+the whole network is recomputed.
+"""
+import hashlib
+import os
+import sqlite3
+
+import numpy as np
+
+STORE_NAME = "crash_hotspot_state.sqlite"
+
+
+def get_sidecar_path(workspace, name=STORE_NAME):
+    """
+    :param workspace: Working directory or geodatabase
+    :param name: File or folder name of the sidecar
+    :return: Path of the sidecar, next to the geodatabase or inside the folder
+    """
+    workspace = os.path.normpath(workspace)
+    if workspace.lower().endswith((".gdb", ".sde", ".gpkg")):
+        workspace = os.path.dirname(workspace)
+    return os.path.join(workspace, name)
+
+
+def get_geometry_hash(*arrays):
+    """
+    :param arrays: Arrays describing the geometry, e.g. road ObjectIDs, vertex segment indexes and vertex coordinates
+    :return: Hex digest identifying the road network geometry
+    """
+    digest = hashlib.sha1()
+    for array in arrays:
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def get_state_key(geometry_hash, *settings):
+    """
+    :param geometry_hash: Hash of the road network geometry
+    :param settings: Settings that change the counts (snap tolerance, report type field, fatal value...)
+    :return: Key of the stored state
+    """
+    return hashlib.sha1("|".join([geometry_hash] + [str(setting) for setting in settings]).encode("utf-8")).hexdigest()
+
+
+def open_store(path):
+    """
+    :param path: Path of the SQLite store
+    :return: Connection to the store, with the tables created
+    """
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    connection.execute("CREATE TABLE IF NOT EXISTS segments "
+                       "(segment_oid INTEGER PRIMARY KEY, crash_count INTEGER, fatalities INTEGER)")
+    return connection
+
+
+def load_state(connection, state_key, road_oids):
+    """
+    :param connection: Connection to the store
+    :param state_key: Key of the current road network and settings
+    :param road_oids: Sorted ObjectIDs of the road segments
+    :return: Dictionary with watermark, min_date, max_date, crash_count and fatalities, None if there is no valid state
+    """
+    meta = dict(connection.execute("SELECT key, value FROM meta").fetchall())
+    if meta.get("state_key") != state_key:  # New road network or new settings
+        return None
+
+    rows = np.array(connection.execute("SELECT segment_oid, crash_count, fatalities FROM segments "
+                                       "ORDER BY segment_oid").fetchall(), dtype=np.int64).reshape(-1, 3)
+    if not np.array_equal(rows[:, 0], road_oids):
+        return None
+    return {"watermark": int(meta["watermark"]),
+            "min_date": np.datetime64(meta["min_date"]) if meta.get("min_date") else None,
+            "max_date": np.datetime64(meta["max_date"]) if meta.get("max_date") else None,
+            "crash_count": rows[:, 1],
+            "fatalities": rows[:, 2]}
+
+
+def new_state(n_segments):
+    """
+    :param n_segments: Number of road segments
+    :return: Empty state, every crash is new
+    """
+    return {"watermark": -1, "min_date": None, "max_date": None,
+            "crash_count": np.zeros(n_segments, dtype=np.int64),
+            "fatalities": np.zeros(n_segments, dtype=np.int64)}
+
+
+def update_state(state, max_oid, min_date, max_date, crash_count, fatality_count=None):
+    """
+    :param state: State loaded from the store or created with new_state
+    :param max_oid: Largest ObjectID of the new crashes
+    :param min_date: Earliest date of the new crashes, None if they have no dates
+    :param max_date: Latest date of the new crashes, None if they have no dates
+    :param crash_count: New crashes per segment
+    :param fatality_count: New fatalities per segment, None if fatalities are not analyzed
+    :return: Updated state
+    """
+    state["crash_count"] = state["crash_count"] + crash_count
+    if fatality_count is not None:
+        state["fatalities"] = state["fatalities"] + fatality_count
+    state["watermark"] = max(state["watermark"], int(max_oid))
+    if min_date is not None:
+        state["min_date"] = min_date if state["min_date"] is None else min(state["min_date"], min_date)
+        state["max_date"] = max_date if state["max_date"] is None else max(state["max_date"], max_date)
+    return state
+
+
+def save_state(connection, state_key, road_oids, state):
+    """
+    :param connection: Connection to the store
+    :param state_key: Key of the current road network and settings
+    :param road_oids: Sorted ObjectIDs of the road segments
+    :param state: State to persist
+    """
+    with connection:  # Single transaction
+        connection.execute("DELETE FROM segments")
+        connection.executemany("INSERT INTO segments VALUES (?, ?, ?)",
+                               zip(road_oids.tolist(), state["crash_count"].tolist(), state["fatalities"].tolist()))
+        meta = {"state_key": state_key,
+                "watermark": str(state["watermark"]),
+                "min_date": "" if state["min_date"] is None else str(state["min_date"]),
+                "max_date": "" if state["max_date"] is None else str(state["max_date"])}
+        connection.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", meta.items())
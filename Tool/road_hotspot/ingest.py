@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming crash ingestion with bounded memory.
+
+Crash rows are read from any row iterator (e.g. an arcpy.da.SearchCursor) in fixed size
+batches, and the date extent, the weekday and year tallies and the per-segment counts are
+kept as running aggregates, so the peak memory depends on the batch size and the number of
+road segments, not on the number of crashes.
+"""
+from itertools import islice
+
+import numpy as np
+
+from road_hotspot import attributes
+
+BATCH_SIZE = 500000
+
+# NumPy types of the field types returned by arcpy.ListFields, other fields are read as objects
+FIELD_TYPES = {"Date": "M8[us]", "OID": "i8"}
+TOKEN_TYPES = {"SHAPE@XY": ("f8", (2,)), "OID@": "i8"}
+
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+
+def get_dtype(fields, field_types):
+    """
+    :param fields: Field names and geometry tokens to read
+    :param field_types: Mapping from field name to its arcpy field type
+    :return: Structured dtype for the batches, null values become NaT, NaN or None
+    """
+    dtype = []
+    for field in fields:
+        if field in TOKEN_TYPES:
+            token_type = TOKEN_TYPES[field]
+            dtype.append((field,) + (token_type if isinstance(token_type, tuple) else (token_type,)))
+        else:
+            dtype.append((field, FIELD_TYPES.get(field_types.get(field), "O")))
+    return dtype
+
+
+def iter_batches(rows, dtype, batch_size=BATCH_SIZE):
+    """
+    :param rows: Iterator of row tuples, e.g. an arcpy.da.SearchCursor
+    :param dtype: Structured dtype of the rows
+    :param batch_size: Maximum number of rows per batch
+    :return: Generator of structured arrays with at most batch_size rows
+    """
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield np.array(batch, dtype=dtype)
+
+
+class CrashAggregates:
+    """Running aggregates of the crash table, updated one batch at a time."""
+
+    def __init__(self, n_segments=0, n_categories=0):
+        """
+        :param n_segments: Number of road segments, 0 if the crashes are not assigned in the same pass
+        :param n_categories: Number of incident categories counted per segment
+        """
+        self.n_crashes = 0
+        self.n_fatalities = 0
+        self.max_oid = -1
+        self.min_date = None
+        self.max_date = None
+        self.weekday_crashes = np.zeros(7, dtype=np.int64)
+        self.weekday_fatalities = np.zeros(7, dtype=np.int64)
+        self.year_crashes = {}
+        self.year_fatalities = {}
+        self.crash_count = np.zeros(n_segments, dtype=np.int64)
+        self.fatality_count = np.zeros(n_segments, dtype=np.int64)
+        self.category_count = np.zeros((n_segments, n_categories), dtype=np.int64)
+        self.period_counts = None  # space_time.PeriodCounts of the space-time mode
+
+    def update_ids(self, oids):
+        """
+        :param oids: Crash ObjectIDs of one batch, the largest one is the watermark of the append mode
+        """
+        if len(oids):
+            self.max_oid = max(self.max_oid, int(np.max(oids)))
+
+    def update_dates(self, dates, fatal_flag=None):
+        """
+        :param dates: Crash dates of one batch
+        :param fatal_flag: Optional array with 1 for fatal incidents
+        """
+        dates = np.asarray(dates, dtype="datetime64[us]")
+        self.n_crashes += len(dates)
+        if fatal_flag is not None:
+            self.n_fatalities += int(np.sum(fatal_flag))
+        valid = ~np.isnat(dates)
+        dates = dates[valid]
+        if not len(dates):
+            return
+        fatal = np.zeros(len(dates), dtype=np.int64) if fatal_flag is None else np.asarray(fatal_flag)[valid]
+
+        # Date extent
+        batch_min, batch_max = dates.min(), dates.max()
+        self.min_date = batch_min if self.min_date is None else min(self.min_date, batch_min)
+        self.max_date = batch_max if self.max_date is None else max(self.max_date, batch_max)
+
+        # Weekday tallies, 1970-01-01 was a Thursday
+        weekday = (dates.astype("datetime64[D]").astype(np.int64) + 3) % 7
+        self.weekday_crashes += np.bincount(weekday, minlength=7)
+        self.weekday_fatalities += np.bincount(weekday, weights=fatal, minlength=7).astype(np.int64)
+
+        # Year tallies
+        year = dates.astype("datetime64[Y]").astype(np.int64) + 1970
+        years, year_index = np.unique(year, return_inverse=True)
+        year_crashes = np.bincount(year_index)
+        year_fatalities = np.bincount(year_index, weights=fatal)
+        for position, value in enumerate(years.tolist()):
+            self.year_crashes[value] = self.year_crashes.get(value, 0) + int(year_crashes[position])
+            self.year_fatalities[value] = self.year_fatalities.get(value, 0) + int(year_fatalities[position])
+
+    def update_segments(self, segment, fatal_flag=None, category_flags=None):
+        """
+        :param segment: Segment index of every crash of one batch, -1 if not snapped
+        :param fatal_flag: Optional array with 1 for fatal incidents
+        :param category_flags: Optional (n, k) one-hot array with the category of every crash
+        """
+        snapped = segment >= 0
+        n_segments = len(self.crash_count)
+        self.crash_count += np.bincount(segment[snapped], minlength=n_segments)
+        if fatal_flag is not None:
+            self.fatality_count += np.bincount(segment[snapped], weights=np.asarray(fatal_flag)[snapped],
+                                               minlength=n_segments).astype(np.int64)
+        if category_flags is not None:
+            np.add.at(self.category_count, segment[snapped], np.asarray(category_flags)[snapped])
+
+    def get_time_span(self, date_span):
+        """
+        :param date_span: Date span of choice {year, month, week}
+        :return: Number of date spans covered by the crashes
+        """
+        return attributes.get_time_span(self.min_date, self.max_date, date_span)
+
+    def get_daily(self, fatalities=False):
+        """
+        :param fatalities: True for the mean fatalities per crash, False for the crash counts
+        :return: Day names and the crashes (or mean fatalities) of each weekday
+        """
+        if not fatalities:
+            return DAYS, self.weekday_crashes
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return DAYS, self.weekday_fatalities / self.weekday_crashes
+
+    def get_yearly(self, fatalities=False):
+        """
+        :param fatalities: True for the mean fatalities per crash, False for the crash counts
+        :return: Years and the crashes (or mean fatalities) of each year
+        """
+        years = sorted(self.year_crashes)
+        crashes = np.array([self.year_crashes[year] for year in years], dtype=np.int64)
+        if not fatalities:
+            return years, crashes
+        fatal = np.array([self.year_fatalities[year] for year in years], dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return years, fatal / crashes
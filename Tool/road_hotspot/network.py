@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+Network distance neighborhoods of Gi*: segments linked by the roads instead of by the crow flies.
+
+The road polylines are turned into a topology graph once: the end vertices are quantized to
+NODE_TOLERANCE so the segments sharing an end point share a node, and every segment is an
+edge between its two nodes weighted by its length. The distance between two segments is the
+shortest path between their midpoints along the roads, half of each segment plus the path
+between their nodes, so the two carriageways of a divided highway or the roads crossing at an
+overpass are only neighbors where the network connects them.
+
+The neighborhoods are found with a bounded multi-source label-correcting search: every source
+segment starts from both its nodes at half its length, and the labels (source, node, distance)
+are relaxed along the edges of the frontier, all sources of a chunk at once, until no label
+within the distance band improves. The memory follows the number of labels inside the band of
+the chunk, not the size of the network, and the chunks are spread over worker processes.
+
+The search result is an index: a CSR matrix with the network distance of every pair of segments
+up to INDEX_BAND_FACTOR times the distance band. It is saved in the weights cache folder under
+a key of the road geometry only, and every run keeps the pairs within its own distance band as
+the same binary CSR weights matrix as the Euclidean neighborhoods. The network is only searched
+again when the road geometry changes or a run needs a wider band than the stored one.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import sparse
+
+from road_hotspot import incremental, tiling, weights_cache
+
+NEIGHBORHOODS = ("euclidean", "network")
+NODE_TOLERANCE = 1e-3  # Grid of the end vertex quantization, in the units of the road coordinate system
+SOURCE_CHUNK = 5000  # Source segments searched together
+INDEX_BAND_FACTOR = 2.0  # Reach of the stored index, in distance bands
+
+_graph = None  # Topology graph of the worker processes, set once per process
+
+
+class RoadGraph:
+    """Topology graph of the road segments, the nodes being the quantized end vertices."""
+
+    def __init__(self, vertex_ids, vertices, n_segments, tolerance=NODE_TOLERANCE):
+        """
+        :param vertex_ids: Segment index of every vertex, the vertices of a segment being contiguous
+        :param vertices: (m, 2) array with the vertices
+        :param n_segments: Number of road segments
+        :param tolerance: Distance under which two end vertices are the same node
+        """
+        vertex_ids = np.asarray(vertex_ids, dtype=np.int64)
+        vertices = np.asarray(vertices, dtype=float)
+
+        # Segment lengths from the vertex pieces, the parts of a multipart segment are chained
+        same = vertex_ids[1:] == vertex_ids[:-1]
+        pieces = np.nan_to_num(np.hypot(*(vertices[1:] - vertices[:-1]).T)) * same  # No length across part gaps
+        self.lengths = np.bincount(vertex_ids[1:], weights=pieces, minlength=n_segments)
+
+        # First and last vertex of every segment, quantized to the node grid
+        first = np.flatnonzero(np.concatenate([[True], ~same])) if len(vertex_ids) else np.zeros(0, dtype=np.int64)
+        last = np.concatenate([first[1:] - 1, [len(vertex_ids) - 1]]) if len(first) else first
+        has_vertices = np.zeros(n_segments, dtype=bool)
+        has_vertices[vertex_ids[first]] = True
+        ends = np.concatenate([vertices[first], vertices[last]])
+        _, node = np.unique(np.round(ends / tolerance).astype(np.int64), axis=0, return_inverse=True)
+        node = node.ravel()
+        n_valid = int(has_vertices.sum())
+
+        # Segments without vertices get their own isolated node
+        self.start = np.empty(n_segments, dtype=np.int64)
+        self.end = np.empty(n_segments, dtype=np.int64)
+        n_nodes = int(node.max()) + 1 if len(node) else 0
+        self.start[vertex_ids[first]], self.end[vertex_ids[first]] = node[:n_valid], node[n_valid:]
+        isolated = np.arange(n_nodes, n_nodes + int((~has_vertices).sum()))
+        self.start[~has_vertices] = self.end[~has_vertices] = isolated
+        self.n_nodes = n_nodes + len(isolated)
+
+        # Incident segments of every node (CSR), each edge listed from both of its nodes
+        tail = np.concatenate([self.start, self.end])
+        head = np.concatenate([self.end, self.start])
+        segment = np.tile(np.arange(n_segments), 2)
+        order = np.argsort(tail, kind="stable")
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(tail, minlength=self.n_nodes))])
+        self.heads = head[order]
+        self.segments = segment[order]
+
+    def get_incident(self, nodes):
+        """
+        :param nodes: Node of every label
+        :return: Label index, opposite node and segment of every incident edge of the nodes
+        """
+        counts = self.indptr[nodes + 1] - self.indptr[nodes]
+        label = np.repeat(np.arange(len(nodes)), counts)
+        # Position of every edge: the node offset plus the rank of the edge among the node edges
+        rank = np.arange(len(label)) - np.repeat(np.cumsum(counts) - counts, counts)
+        position = self.indptr[nodes][label] + rank
+        return label, self.heads[position], self.segments[position]
+
+
+def _reduce(keys, distances):
+    # Shortest distance of every key, keys sorted
+    order = np.argsort(keys)
+    keys, distances = keys[order], distances[order]
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    starts = np.flatnonzero(first)
+    return keys[starts], np.minimum.reduceat(distances, starts) if len(starts) else distances
+
+
+def get_chunk_neighbors(graph, sources, distance_band):
+    """
+    :param graph: RoadGraph of the network
+    :param sources: Source segment indexes of the chunk
+    :param distance_band: Network distance threshold between the segment midpoints
+    :return: Source, neighbor segment and network distance of every pair within the band, the segments themselves
+        excluded
+    """
+    n_nodes = graph.n_nodes
+    half = graph.lengths / 2
+
+    # Labels start at both nodes of every source segment, at half its length
+    local = np.arange(len(sources), dtype=np.int64)
+    keys = np.concatenate([local * n_nodes + graph.start[sources], local * n_nodes + graph.end[sources]])
+    distances = np.tile(half[sources], 2)
+    within = distances <= distance_band
+    best_keys, best_distances = _reduce(keys[within], distances[within])
+    frontier_keys, frontier_distances = best_keys, best_distances
+
+    # Label-correcting relaxation of every source at once, until no label inside the band improves
+    while len(frontier_keys):
+        label, heads, segments = graph.get_incident(frontier_keys % n_nodes)
+        distances = frontier_distances[label] + graph.lengths[segments]
+        within = distances <= distance_band
+        keys, distances = _reduce((frontier_keys[label] // n_nodes * n_nodes + heads)[within], distances[within])
+
+        # Only the new labels and the shorter ones are relaxed again
+        position = np.searchsorted(best_keys, keys)
+        clipped = np.minimum(position, len(best_keys) - 1)
+        known = best_keys[clipped] == keys
+        shorter = known & (distances < best_distances[clipped])
+        new = ~known
+        best_distances[clipped[shorter]] = distances[shorter]
+        best_keys = np.insert(best_keys, position[new], keys[new])
+        best_distances = np.insert(best_distances, position[new], distances[new])
+        frontier_keys, frontier_distances = keys[shorter | new], distances[shorter | new]
+
+    # A segment is a neighbor when one of its nodes is reached with room for half of its length
+    label, _, segments = graph.get_incident(best_keys % n_nodes)
+    distances = best_distances[label] + half[segments]
+    near = distances <= distance_band
+    pairs, distances = _reduce((best_keys[label] // n_nodes)[near] * len(graph.lengths) + segments[near],
+                               distances[near])
+    rows, cols = sources[pairs // len(graph.lengths)], pairs % len(graph.lengths)
+    keep = rows != cols
+    return rows[keep], cols[keep], distances[keep]
+
+
+def _set_graph(graph):
+    global _graph
+    _graph = graph
+
+
+def _chunk_neighbors(sources, distance_band):
+    # Worker: neighbor pairs of one chunk of sources with the graph of the process
+    return get_chunk_neighbors(_graph, sources, distance_band)
+
+
+def build_index(graph, max_band, workers=1, chunk_size=SOURCE_CHUNK):
+    """
+    :param graph: RoadGraph of the network
+    :param max_band: Largest network distance kept in the index
+    :param workers: Worker processes searching the chunks of sources
+    :param chunk_size: Source segments searched together
+    :return: (n, n) CSR matrix with the network distance of every pair within max_band, zeros included
+    """
+    n = len(graph.lengths)
+    chunks = [np.arange(start, min(start + chunk_size, n)) for start in range(0, n, chunk_size)]
+    if workers > 1 and len(chunks) > 1:
+        tiling.configure_executable()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_set_graph, initargs=(graph,)) as executor:
+            results = list(executor.map(_chunk_neighbors, chunks, [max_band] * len(chunks)))
+    else:
+        results = [get_chunk_neighbors(graph, sources, max_band) for sources in chunks]
+
+    # The chunks are in source order, the rows only need their columns sorted
+    rows = np.concatenate([rows for rows, _, _ in results]) if results else np.zeros(0, dtype=np.int64)
+    cols = np.concatenate([cols for _, cols, _ in results]) if results else np.zeros(0, dtype=np.int64)
+    distances = np.concatenate([distances for _, _, distances in results]) if results else np.zeros(0)
+    order = np.lexsort((cols, rows))
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=n))])
+    # Built from the CSR arrays, so the pairs at a zero distance are kept as explicit entries
+    return sparse.csr_matrix((distances[order], cols[order], indptr), shape=(n, n))
+
+
+def threshold_index(index, distance_band):
+    """
+    :param index: CSR matrix of the network distances, see build_index
+    :param distance_band: Network distance threshold between the segment midpoints
+    :return: Binary (n, n) CSR weights matrix, each segment being its own neighbor as in Gi*
+    """
+    n = index.shape[0]
+    within = index.data <= distance_band
+    diagonal = np.arange(n)
+    rows = np.concatenate([np.repeat(diagonal, np.diff(index.indptr))[within], diagonal])
+    cols = np.concatenate([index.indices[within], diagonal])
+    weights = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+    weights.sort_indices()  # Keep a deterministic summation order
+    return weights
+
+
+def build_weights(graph, distance_band, workers=1, chunk_size=SOURCE_CHUNK):
+    """
+    :param graph: RoadGraph of the network
+    :param distance_band: Network distance threshold between the segment midpoints
+    :param workers: Worker processes searching the chunks of sources
+    :param chunk_size: Source segments searched together
+    :return: Binary (n, n) CSR weights matrix, each segment being its own neighbor as in Gi*
+    """
+    return threshold_index(build_index(graph, distance_band, workers, chunk_size), distance_band)
+
+
+def load_index(cache_dir, key):
+    """
+    :param cache_dir: Cache folder
+    :param key: Key of the cache entry
+    :return: Cached CSR distance matrix and its maximum band, None if not cached
+    """
+    path = os.path.join(cache_dir, key + ".npz")
+    try:
+        os.utime(path)  # Mark the entry as recently used
+        arrays = np.load(path)
+    except FileNotFoundError:  # Not cached, or evicted by another process
+        return None
+    with arrays:
+        index = sparse.csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]), shape=tuple(arrays["shape"]))
+        return index, float(arrays["max_band"])
+
+
+def save_index(cache_dir, key, index, max_band, max_bytes=weights_cache.MAX_CACHE_BYTES):
+    """
+    :param cache_dir: Cache folder
+    :param key: Key of the cache entry
+    :param index: CSR distance matrix to cache
+    :param max_band: Largest network distance kept in the index
+    :param max_bytes: Maximum size of the cache
+    """
+    weights_cache.write_entry(os.path.join(cache_dir, key + ".npz"), lambda entry_file: np.savez(
+        entry_file, data=index.data, indices=index.indices, indptr=index.indptr, shape=np.array(index.shape),
+        max_band=np.float64(max_band)))
+    weights_cache.evict(cache_dir, max_bytes)
+
+
+def get_weights(source_ids, vertex_ids, vertices, distance_band, cache_dir, workers=1,
+                max_bytes=weights_cache.MAX_CACHE_BYTES):
+    """
+    :param source_ids: Sorted road ObjectIDs
+    :param vertex_ids: Segment index of every vertex
+    :param vertices: (m, 2) array with the vertices
+    :param distance_band: Network distance threshold between the segment midpoints
+    :param cache_dir: Cache folder, None to disable the cache
+    :param workers: Worker processes searching the chunks of sources
+    :param max_bytes: Maximum size of the cache
+    :return: CSR weights matrix of the network neighborhoods, from the cached index when available
+    """
+    if cache_dir is None:
+        return build_weights(RoadGraph(vertex_ids, vertices, len(source_ids)), distance_band, workers)
+
+    # The index is keyed on the road geometry only, a wider band than the stored one rebuilds it
+    geometry_hash = incremental.get_geometry_hash(source_ids, vertex_ids, vertices, np.float64(NODE_TOLERANCE))
+    key = weights_cache.get_cache_key(geometry_hash, NODE_TOLERANCE, method="network_index")
+    cached = load_index(cache_dir, key)
+    if cached is None or cached[1] < distance_band:
+        max_band = distance_band * INDEX_BAND_FACTOR
+        index = build_index(RoadGraph(vertex_ids, vertices, len(source_ids)), max_band, workers)
+        save_index(cache_dir, key, index, max_band, max_bytes)
+    else:
+        index = cached[0]
+    return threshold_index(index, distance_band)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Conditional permutation inference of Gi*: pseudo p-values from random neighborhoods.
+
+For every segment the own value is held fixed and its k - 1 neighbors are replaced by k - 1
+values drawn without replacement from the other segments, as in PySAL's conditional
+randomization. With binary weights the Gi* z-score only depends on the local sum for a given
+number of neighbors, so the simulated local sums are compared to the observed one directly.
+
+The segments are grouped by number of neighbors, and every group shares the random draws of a
+block of permutations (PySAL's trick), shifted past the segment itself. Each block of
+permutations has its own seed (a SeedSequence spawned from the run seed, the number of
+neighbors and the block number), so the results do not depend on the number of workers or
+on the memory ceiling, which only sets how many segments are simulated at once. The blocks
+are spread over a pool of worker processes.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from road_hotspot import tiling
+
+PERMUTATION_BLOCK = 1000  # Permutations sharing one seed and one set of draws
+MAX_BLOCK_BYTES = 256 * 1024 ** 2  # Memory ceiling of the simulated values of one task
+DEFAULT_SEED = 12345
+
+_values = None  # Analysis values of the worker processes, set once per process
+
+
+def _set_values(values):
+    global _values
+    _values = values
+
+
+def get_draws(n_others, size, permutations, seed_sequence):
+    """
+    :param n_others: Number of values to draw from, n - 1
+    :param size: Values drawn per permutation, k - 1
+    :param permutations: Number of permutations of the block
+    :param seed_sequence: numpy.random.SeedSequence of the block
+    :return: (permutations, size) array of distinct indexes per row
+    """
+    rng = np.random.default_rng(seed_sequence)
+    if 2 * size > n_others:  # Dense neighborhoods: partial shuffles of every row
+        return np.argsort(rng.random((permutations, n_others)), axis=1)[:, :size]
+
+    # Sparse neighborhoods: draw with replacement and redraw the rows with repeated indexes
+    draws = rng.integers(0, n_others, (permutations, size))
+    while True:
+        ordered = np.sort(draws, axis=1)
+        repeated = np.flatnonzero((ordered[:, 1:] == ordered[:, :-1]).any(axis=1))
+        if not len(repeated):
+            return draws
+        draws[repeated] = rng.integers(0, n_others, (len(repeated), size))
+
+
+def _block_counts(column, rows, observed, n_neighbors, block, permutations, seed, max_bytes):
+    # Worker: simulated local sums of the rows for one block of permutations, compared to the observed ones
+    values = _values[:, column]
+    n = len(values)
+    draws = get_draws(n - 1, n_neighbors - 1, permutations,
+                      np.random.SeedSequence(seed, spawn_key=(column, n_neighbors, block)))
+    tolerance = 1e-9 * max(float(np.abs(values).max()), 1e-300) * n_neighbors
+    greater = np.zeros(len(rows), dtype=np.int64)
+    less = np.zeros(len(rows), dtype=np.int64)
+
+    # Segments per chunk so the (segments, permutations, draws) arrays stay under the ceiling
+    chunk_rows = max(int(max_bytes // (16 * permutations * max(n_neighbors - 1, 1))), 1)
+    for start in range(0, len(rows), chunk_rows):
+        chunk = rows[start:start + chunk_rows]
+        # Indexes of the other segments skip the segment itself
+        others = draws[None, :, :] + (draws[None, :, :] >= chunk[:, None, None])
+        simulated = values[others].sum(axis=2) + values[chunk][:, None]
+        difference = simulated - observed[start:start + chunk_rows][:, None]
+        greater[start:start + chunk_rows] = (difference > tolerance).sum(axis=1)
+        less[start:start + chunk_rows] = (difference < -tolerance).sum(axis=1)
+    return greater, less
+
+
+def get_pseudo_p_values(values, weights, permutations=999, seed=DEFAULT_SEED, workers=1,
+                        max_bytes=MAX_BLOCK_BYTES):
+    """
+    :param values: (n,) or (n, k) array with the analysis fields
+    :param weights: (n, n) binary sparse weights matrix including the diagonal
+    :param permutations: Permutations per segment
+    :param seed: Seed of the random draws
+    :param workers: Worker processes
+    :param max_bytes: Memory ceiling of the simulated values of one block, per worker
+    :return: Two tailed pseudo p-values with the shape of values
+    """
+    values = np.asarray(values, dtype=float)
+    matrix = values.reshape(len(values), -1)
+    observed = weights @ matrix
+    n_neighbors = np.diff(weights.indptr)
+
+    # Segments with the same number of neighbors share the draws, the segments without neighbors keep p = 1
+    tasks = []
+    for count in np.unique(n_neighbors[n_neighbors > 1]):
+        rows = np.flatnonzero(n_neighbors == count)
+        for column in range(matrix.shape[1]):
+            for block, start in enumerate(range(0, permutations, PERMUTATION_BLOCK)):
+                tasks.append((column, rows, observed[rows, column], int(count), block,
+                              min(PERMUTATION_BLOCK, permutations - start), seed, max_bytes))
+
+    greater = np.zeros(matrix.shape, dtype=np.int64)
+    less = np.zeros(matrix.shape, dtype=np.int64)
+    if workers > 1 and len(tasks) > 1:
+        tiling.configure_executable()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_set_values, initargs=(matrix,)) as executor:
+            results = executor.map(_block_counts, *zip(*tasks))
+            for task, (task_greater, task_less) in zip(tasks, results):
+                greater[task[1], task[0]] += task_greater
+                less[task[1], task[0]] += task_less
+    else:
+        _set_values(matrix)
+        for task in tasks:
+            task_greater, task_less = _block_counts(*task)
+            greater[task[1], task[0]] += task_greater
+            less[task[1], task[0]] += task_less
+        _set_values(None)
+
+    # Folded two tailed pseudo p-value, ties count on both sides
+    extreme = np.minimum(permutations - less, permutations - greater)
+    p_values = np.minimum(2 * (extreme + 1) / (permutations + 1), 1.0)
+    p_values[n_neighbors <= 1] = 1.0
+    return p_values.reshape(values.shape)
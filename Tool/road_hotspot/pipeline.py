@@ -0,0 +1,477 @@
+# -*- coding: utf-8 -*-
+"""
+Hotspot pipeline of the NumPy engine on top of a geometry/IO backend.
+
+The crashes are streamed in batches and assigned to their nearest road segment, the counts
+and rates are kept in the columnar store, Gi* is computed with NumPy/SciPy and the outputs
+and the optional HTML report are written. Every read and write of a layer goes through the
+backend (see road_hotspot.backends), so the same pipeline runs in the ArcGIS script tool and
+headless from ``python -m road_hotspot``.
+"""
+import numpy as np
+from numpy.lib import recfunctions as rfn
+
+from road_hotspot import (attributes, columnar, gi_star, incremental, ingest, network, permutation, profiling,
+                          report, snapping, space_time, tiling, weights_cache)
+
+DEFAULT_SNAP_DISTANCE = "0.25 Miles"
+
+
+def get_snap_distance(dist, units):
+    """
+    :param dist: Snap distance value, empty for the default
+    :param units: Units of the snap distance
+    :return: Linear distance string, e.g. "0.25 Miles"
+    """
+    if dist != "":  # If max_distance was shared
+        return dist + " " + units
+    return DEFAULT_SNAP_DISTANCE  # Else set the max distance to 0.25 miles
+
+
+def get_length_field(units):
+    """
+    :param units: Length units, US miles if empty
+    :return: Name of the segment length field
+    """
+    if units == "":
+        return "Length_mi"
+    return "Length" + "_" + units[:2].lower()
+
+
+def get_crash_fields(report_type_field="", categories=()):
+    """
+    :param report_type_field: Report type field, empty if the fatalities are not analyzed
+    :param categories: List of (field, value, name) tuples
+    :return: Crash fields needed to classify the incidents, without duplicates
+    """
+    fields = [report_type_field] if report_type_field else []
+    for field, _, _ in categories:
+        if field not in fields:
+            fields.append(field)
+    return fields
+
+
+def stream_crashes(backend, crashes, date_field, report_type_field="", fatalities_name="", categories=(),
+                   road_vertices=None, tolerance=None, spatial_reference=None, min_oid=None, workers=1,
+                   period_span=""):
+    """
+    :param backend: Geometry/IO backend
+    :param crashes: Crash point layer
+    :param date_field: Date field of the crash layer
+    :param report_type_field: Report type field, used with fatalities_name
+    :param fatalities_name: Fatal incident name, empty to skip the fatalities
+    :param categories: Incident categories counted per segment
+    :param road_vertices: Road ObjectIDs, vertex segment indexes and vertices to assign the crashes to
+    :param tolerance: Snap tolerance in the road coordinate system
+    :param spatial_reference: Road spatial reference
+    :param min_oid: Only read the crashes with a larger ObjectID, all of them if None
+    :param workers: Worker processes of the tiled assignment
+    :param period_span: Date span of the space-time periods, empty to skip the period counts
+    :return: Crash aggregates
+    """
+    crash_fields = get_crash_fields(report_type_field if fatalities_name else "", categories)
+    fields = ["OID@", date_field] + crash_fields + (["SHAPE@XY"] if road_vertices else [])
+    n_segments = len(road_vertices[0]) if road_vertices else 0
+    crash_aggregates = ingest.CrashAggregates(n_segments, len(categories))
+    if road_vertices and period_span:  # Crashes per segment and period of the space-time mode
+        crash_aggregates.period_counts = space_time.PeriodCounts(n_segments, period_span)
+    road_index = assigner = None
+    if road_vertices and workers <= 1:  # Index the road segments once for every batch
+        road_index = snapping.build_index(road_vertices[1], road_vertices[2], tolerance)
+    elif road_vertices:  # Spatial tiles in worker processes started once for every batch
+        assigner = tiling.TiledAssigner(road_vertices[1], road_vertices[2], tolerance, workers)
+
+    try:
+        for batch in backend.iter_crash_batches(crashes, fields, min_oid, spatial_reference):
+            fatal_flag = None
+            if fatalities_name:  # Classify the crash incidents adding 1 if it has a fatality else 0
+                fatal_flag = attributes.get_fatal_flag(batch[report_type_field], fatalities_name)
+            crash_aggregates.update_ids(batch["OID@"])
+            crash_aggregates.update_dates(batch[date_field], fatal_flag)
+            if road_vertices:  # Assign the batch to the nearest road segments
+                if assigner is not None:
+                    segment = assigner.nearest(batch["SHAPE@XY"])[0]
+                else:
+                    segment = road_index.nearest(batch["SHAPE@XY"], tolerance)[0]
+                category_flags = attributes.get_category_flags(batch, categories) if categories else None
+                crash_aggregates.update_segments(segment, fatal_flag, category_flags)
+                if crash_aggregates.period_counts is not None:
+                    crash_aggregates.period_counts.update(segment, batch[date_field])
+    finally:
+        if assigner is not None:
+            assigner.close()
+    return crash_aggregates
+
+
+def read_road_segments(backend, roads, units):
+    """
+    :param backend: Geometry/IO backend
+    :param roads: Polyline road layer
+    :param units: Length units, US miles if empty
+    :return: Segment ObjectIDs, midpoints and lengths in the length units, in ObjectID order
+    """
+    road_oids, midpoints, lengths = backend.read_road_segments(roads)
+    lengths = lengths * backend.get_meters_per_unit(roads) / snapping.get_meters_per_unit(units)
+    return {"TARGET_FID": road_oids, "X": midpoints[:, 0], "Y": midpoints[:, 1], get_length_field(units): lengths}
+
+
+def get_reference(backend, roads):
+    """
+    :param backend: Geometry/IO backend
+    :param roads: Polyline road layer
+    :return: Reference to the road geometry kept with every stored table
+    """
+    return {"road_lines": backend.get_path(roads), "join_field": "TARGET_FID"}
+
+
+def write_segment_table(backend, store_dir, roads, units, crash_count, fatality_count, fat_field=False,
+                        category_counts=None, categories=()):
+    # Store the counts per segment in the columnar store, the geometry stays in the road layer
+    segments = read_road_segments(backend, roads, units)
+    segments["Join_Count"] = crash_count.astype(np.int32)
+    if fat_field:
+        segments[attributes.FATALITY_COUNT_FIELD] = fatality_count.astype(np.int32)
+    for column, (_, _, name) in enumerate(categories):
+        segments[attributes.get_count_field(name)] = category_counts[:, column].astype(np.int32)
+    columnar.write_table(store_dir, columnar.SEGMENT_TABLE, segments, get_reference(backend, roads))
+    backend.message("Crash data points joined to the road data.")
+
+
+# Snap and join crash points to the road network without intermediate feature classes
+def assign_to_roads(backend, store_dir, crashes, roads, snap_distance, units, date_field, fat_field=False,
+                    report_type_field="", fatalities_name="", categories=(), workers=1, period_span=""):
+    spatial_reference = backend.get_spatial_reference(roads)
+    tolerance = snapping.get_tolerance(snap_distance, backend.get_meters_per_unit(roads))
+
+    # Stream the crash points in the road coordinate system and assign them to the road segments
+    road_vertices = backend.read_road_vertices(roads)
+    crash_aggregates = stream_crashes(backend, crashes, date_field, report_type_field,
+                                      fatalities_name if fat_field else "", categories,
+                                      road_vertices=road_vertices, tolerance=tolerance,
+                                      spatial_reference=spatial_reference, workers=workers,
+                                      period_span=period_span)
+    backend.message("%d of %d crash points assigned to the road segments." % (crash_aggregates.crash_count.sum(),
+                                                                               crash_aggregates.n_crashes))
+    write_segment_table(backend, store_dir, roads, units, crash_aggregates.crash_count,
+                        crash_aggregates.fatality_count, fat_field, crash_aggregates.category_count, categories)
+    return crash_aggregates
+
+
+# Assign only the crashes added since the last run and update the stored counts
+def incremental_assign(backend, store_dir, crashes, roads, snap_distance, units, date_span, date_field,
+                       fat_field=False, report_type_field="", fatalities_name="", workers=1):
+    spatial_reference = backend.get_spatial_reference(roads)
+    tolerance = snapping.get_tolerance(snap_distance, backend.get_meters_per_unit(roads))
+    road_oids, vertex_ids, vertices = backend.read_road_vertices(roads)
+
+    # Load the stored counts, they are only valid for the same road geometry and settings
+    geometry_hash = incremental.get_geometry_hash(road_oids, vertex_ids, vertices)
+    state_key = incremental.get_state_key(geometry_hash, crashes, snap_distance, fat_field, report_type_field,
+                                          fatalities_name)
+    store = incremental.open_store(incremental.get_sidecar_path(backend.workspace))
+    state = incremental.load_state(store, state_key, road_oids)
+    if state is None:
+        backend.message("No stored counts for this road network, all crashes will be processed.")
+        state = incremental.new_state(len(road_oids))
+
+    # Stream and assign the crashes above the watermark only
+    crash_aggregates = stream_crashes(backend, crashes, date_field, report_type_field,
+                                      fatalities_name if fat_field else "",
+                                      road_vertices=(road_oids, vertex_ids, vertices), tolerance=tolerance,
+                                      spatial_reference=spatial_reference, min_oid=state["watermark"],
+                                      workers=workers)
+
+    # Add the new crashes to the stored counts
+    if crash_aggregates.n_crashes:
+        state = incremental.update_state(state, crash_aggregates.max_oid, crash_aggregates.min_date,
+                                         crash_aggregates.max_date, crash_aggregates.crash_count,
+                                         crash_aggregates.fatality_count if fat_field else None)
+        incremental.save_state(store, state_key, road_oids, state)
+    store.close()
+    backend.message("%d new crash points assigned to the road segments." % crash_aggregates.n_crashes)
+
+    write_segment_table(backend, store_dir, roads, units, state["crash_count"], state["fatalities"], fat_field)
+    return attributes.get_time_span(state["min_date"], state["max_date"], date_span)
+
+
+def attribute_stage(backend, store_dir, time_span, date_span, units, fat_field=False, categories=(),
+                    statistics=None):
+    # Rates from the stored counts, written as their own table next to the segment table
+    segments, reference = columnar.read_table(store_dir, columnar.SEGMENT_TABLE)
+    lengths = segments[get_length_field(units)]
+    if statistics is not None:  # Segment statistics of the report from the columns already read
+        statistics.update_segments(segments["Join_Count"], lengths)
+    tot_fata = segments[attributes.FATALITY_COUNT_FIELD] if fat_field else None
+    road_attributes, zero_length = attributes.get_road_attributes(segments["Join_Count"], lengths, time_span,
+                                                                  tot_fata=tot_fata)
+    if zero_length:
+        backend.warning("%d road segments have a zero length, their average incidents were set to 0." % zero_length)
+    rate_fields = [attributes.CRASH_RATE_FIELD] + ([attributes.FATALITY_RATE_FIELD] if fat_field else [])
+    rates = {field: road_attributes[field] for field in rate_fields}
+    if categories:  # Rates of every category as one matrix operation
+        category_counts = np.column_stack([segments[attributes.get_count_field(name)] for _, _, name in categories])
+        category_rates = attributes.get_category_rates(category_counts, lengths, time_span, categories)
+        rates.update((field, category_rates[field]) for field in category_rates.dtype.names)
+    columnar.write_table(store_dir, columnar.RATE_TABLE, rates, reference)
+    if fat_field:
+        backend.message("Average fatal incidents per road segment per %s calculated" % date_span)
+    if categories:
+        backend.message("Average incidents of %d categories per road segment per %s calculated" %
+                        (len(categories), date_span))
+    backend.message("Average crash incidents per road segment per %s calculated" % date_span)
+
+
+def get_gi_star(points, values, distance_band, source_ids, cache_dir=None, workers=1, permutations=0,
+                seed=permutation.DEFAULT_SEED, max_bytes=permutation.MAX_BLOCK_BYTES, weights=None):
+    """
+    :param points: (n, 2) array with the segment midpoints
+    :param values: (n,) or (n, k) array with the analysis fields
+    :param distance_band: Fixed distance threshold, in the units of the points
+    :param source_ids: Id of every segment
+    :param cache_dir: Weights cache folder, None to disable the cache
+    :param workers: Worker processes, above 1 the local sums are computed in spatial tiles
+    :param permutations: Conditional permutations per segment, 0 for the analytic p-values
+    :param seed: Seed of the permutations
+    :param max_bytes: Memory ceiling of a block of permutations, per worker
+    :param weights: Precomputed weights matrix, e.g. the network neighborhoods, None for the Euclidean distance band
+    :return: Gi* z-scores, p-values (pseudo p-values with permutations) and number of neighbors
+    """
+    # Tiles in parallel worker processes, or the cached weights matrix in this process
+    if weights is None and workers > 1 and not permutations:
+        return tiling.parallel_gi_star(points, values, distance_band, workers)
+    if weights is None:
+        weights = weights_cache.get_weights(points, distance_band, source_ids, cache_dir)
+    z_scores, p_values = gi_star.gi_star(values, weights)
+    if permutations:  # The permutation blocks are spread over the workers instead of the tiles
+        p_values = permutation.get_pseudo_p_values(values, weights, permutations, seed, workers, max_bytes)
+    return z_scores, p_values, np.diff(weights.indptr)
+
+
+def read_hotspot_inputs(store_dir, fields):
+    """
+    :param store_dir: Columnar store folder
+    :param fields: Rate fields to analyze
+    :return: Segment ids, (n, 2) array with the midpoints and a mapping from field to rates
+    """
+    segments = columnar.read_table(store_dir, columnar.SEGMENT_TABLE)[0]
+    rates = columnar.read_table(store_dir, columnar.RATE_TABLE)[0]
+    points = np.column_stack([segments["X"], segments["Y"]])
+    return segments["TARGET_FID"], points, {field: rates[field] for field in fields}
+
+
+def get_hotspot_table(output):
+    """
+    :param output: Hotspot output name
+    :return: Name of the stored table with the hotspot fields of the output
+    """
+    return "hotspots_" + output.replace("\\", "/").rsplit("/", 1)[-1]
+
+
+def write_road_output(backend, store_dir, roads, output, hotspots):
+    # Copy the road geometry with the stored counts, rates and the hotspot fields
+    segments = columnar.read_table(store_dir, columnar.SEGMENT_TABLE)[0]
+    rates = columnar.read_table(store_dir, columnar.RATE_TABLE)[0]
+    columns = {name: values for name, values in segments.items() if name not in ("X", "Y")}
+    columns.update(rates)
+    columns.update((name, hotspots[name]) for name in hotspots.dtype.names)
+    return backend.write_road_output(roads, output, columns)
+
+
+def hotspot_analysis(backend, store_dir, roads, distance_band, incident_type, incident_field, output, workers=1,
+                     permutations=0, fdr=False, seed=permutation.DEFAULT_SEED, max_bytes=permutation.MAX_BLOCK_BYTES,
+                     statistics=None, weights=None):
+    source_ids, points, values = read_hotspot_inputs(store_dir, [incident_field])
+
+    # Calculate GiZScore, GiPValue and Gi_Bin
+    z_scores, p_values, neighbors = get_gi_star(points, values[incident_field], distance_band, source_ids,
+                                                weights_cache.get_cache_dir(backend.workspace), workers,
+                                                permutations, seed, max_bytes, weights)
+    hotspots = gi_star.get_hotspot_array(z_scores, p_values, neighbors, source_ids, fdr)
+    if statistics is not None:  # Hot and cold spots of the report
+        statistics.update_hotspots(hotspots["Gi_Bin"])
+
+    # Store the hotspot fields and write the output layer
+    columnar.write_table(store_dir, get_hotspot_table(output), {name: hotspots[name] for name in hotspots.dtype.names},
+                         get_reference(backend, roads))
+    incident_hotspots = write_road_output(backend, store_dir, roads, output, hotspots)
+    backend.message("%s Hotspot calculated." % incident_type)
+    return incident_hotspots
+
+
+def category_hotspot_analysis(backend, store_dir, distance_band, categories, output, workers=1, permutations=0,
+                              fdr=False, seed=permutation.DEFAULT_SEED, max_bytes=permutation.MAX_BLOCK_BYTES,
+                              weights=None):
+    # Get the segment midpoints and the rate of every category
+    rate_fields = [attributes.get_rate_field(name) for _, _, name in categories]
+    source_ids, points, values = read_hotspot_inputs(store_dir, rate_fields)
+
+    # Calculate the z-scores of every category at once with the shared neighborhoods
+    rates = np.column_stack([values[field] for field in rate_fields])
+    z_scores, p_values, neighbors = get_gi_star(points, rates, distance_band, source_ids,
+                                                weights_cache.get_cache_dir(backend.workspace), workers,
+                                                permutations, seed, max_bytes, weights)
+    hotspots = gi_star.get_category_array(z_scores, p_values, neighbors, [name for _, _, name in categories],
+                                          source_ids, fdr)
+    hotspots = rfn.merge_arrays([hotspots, columnar.to_records(values, rate_fields)], flatten=True, usemask=False)
+
+    # Write a single table with the rates and hotspot fields of every category
+    output_table = backend.write_table(output, hotspots)
+    backend.message("Hotspots of %d incident categories calculated." % len(categories))
+    return output_table
+
+
+def space_time_analysis(backend, store_dir, roads, distance_band, period_counts, units, output, fdr=False,
+                        weights=None):
+    # Rates, Gi* and trend of every period, with the weights shared by the other hotspot analyses
+    segments = columnar.read_table(store_dir, columnar.SEGMENT_TABLE)[0]
+    source_ids = segments["TARGET_FID"]
+    if weights is None:
+        points = np.column_stack([segments["X"], segments["Y"]])
+        weights = weights_cache.get_weights(points, distance_band, source_ids,
+                                            weights_cache.get_cache_dir(backend.workspace))
+    patterns, period_chunks = space_time.get_space_time(period_counts.counts, segments[get_length_field(units)],
+                                                      weights, source_ids, period_counts.get_periods(), fdr=fdr)
+
+    # Pattern of every segment on the road geometry, Gi* of every segment and period as a table
+    space_time_output = backend.write_road_output(roads, output, {name: patterns[name]
+                                                                  for name in patterns.dtype.names})
+    for position, period_rows in enumerate(period_chunks):  # Written a chunk of periods at a time
+        backend.write_table(output + space_time.PERIOD_SUFFIX, period_rows, append=position > 0)
+    names, counts = np.unique(patterns["PATTERN"], return_counts=True)
+    backend.message("Space-time hotspots of %d periods calculated: %s." % (
+        period_counts.counts.shape[1], ", ".join("%d %s" % (count, name) for name, count in zip(names, counts))))
+    return space_time_output
+
+
+def get_network_weights(backend, roads, distance_band, workers=1):
+    """
+    :param backend: Geometry/IO backend
+    :param roads: Polyline road layer
+    :param distance_band: Network distance threshold between the segment midpoints
+    :param workers: Worker processes of the neighborhood search
+    :return: CSR weights matrix of the network neighborhoods, in road ObjectID order
+    """
+    # The topology graph is built from the road vertices, the index is reused from the weights cache
+    source_ids, vertex_ids, vertices = backend.read_road_vertices(roads)
+    return network.get_weights(source_ids, vertex_ids, vertices, distance_band,
+                               weights_cache.get_cache_dir(backend.workspace), workers)
+
+
+def run(backend, crashes, date_field, roads, crash_output, date_span="year", fatalities=False, fatalities_output="",
+        report_type_field="", fatalities_name="", max_distance="", units="", categories=(),
+        category_output="Category_hotspots", append_mode=False, workers=1, report_path="", run_profile=None,
+        space_time_output="", permutations=0, fdr=False, seed=permutation.DEFAULT_SEED,
+        permutation_memory=permutation.MAX_BLOCK_BYTES, report_inline=False, report_format="png",
+        neighborhood="euclidean"):
+    """
+    :param backend: Geometry/IO backend
+    :param crashes: Crash point layer
+    :param date_field: Date field of the crash layer
+    :param roads: Polyline road layer, in a projected coordinate system
+    :param crash_output: Crash hotspot output name
+    :param date_span: Date span of the averages {year, month, week}
+    :param fatalities: True to analyze the fatalities too
+    :param fatalities_output: Fatality hotspot output name
+    :param report_type_field: Report type field
+    :param fatalities_name: Report type value of the fatal incidents
+    :param max_distance: Snap distance, 0.25 miles if empty
+    :param units: Units of the snap distance and of the segment lengths, US miles if empty
+    :param categories: List of (field, value, name) tuples, see attributes.parse_categories
+    :param category_output: Category hotspot table name
+    :param append_mode: Only assign the crashes added since the last run
+    :param workers: Worker processes of the tiled assignment and Gi*
+    :param report_path: Folder of the HTML report, empty to skip it
+    :param run_profile: Optional profiling.RunProfile recording the stages
+    :param space_time_output: Space-time hotspot output name, empty to skip the space-time mode
+    :param permutations: Conditional permutations per segment for pseudo p-values, 0 for the analytic ones
+    :param fdr: True to apply the False Discovery Rate correction before assigning Gi_Bin
+    :param seed: Seed of the permutations
+    :param permutation_memory: Memory ceiling in bytes of a block of permutations, per worker
+    :param report_inline: True to embed the report figures in the HTML file
+    :param report_format: Format of the report figures {png, svg}
+    :param neighborhood: Neighborhoods of Gi* {euclidean, network}, by straight line or along the roads
+    :return: Crash hotspot output
+    """
+    if date_span not in attributes.DATE_VALUES:
+        raise ValueError("The date %s is not valid. The values should be Year, Month, or Week." % date_span)
+    if not backend.is_projected(roads):
+        raise ValueError("The NumPy engine needs a road network in a projected coordinate system.")
+    if neighborhood not in network.NEIGHBORHOODS:
+        raise ValueError("The neighborhood %s is not valid. The values should be %s." %
+                         (neighborhood, ", ".join(network.NEIGHBORHOODS)))
+    run_profile = run_profile or profiling.RunProfile()
+    store_dir = columnar.get_store_dir(backend.workspace)
+    snap_distance = get_snap_distance(max_distance, units)
+    if append_mode and categories:
+        backend.warning("The append mode does not store category counts, all crashes will be processed.")
+        append_mode = False
+    if append_mode and space_time_output:
+        backend.warning("The append mode does not store period counts, all crashes will be processed.")
+        append_mode = False
+
+    ## Join the crash data to the road network
+    # The crash table is streamed in batches, keeping the date extent and report tallies as running aggregates
+    crash_aggregates = None
+    if append_mode:
+        with run_profile.stage("join"):
+            time_span = incremental_assign(backend, store_dir, crashes, roads, snap_distance, units, date_span,
+                                           date_field, fat_field=fatalities, report_type_field=report_type_field,
+                                           fatalities_name=fatalities_name, workers=workers)
+    else:
+        with run_profile.stage("join") as stage:
+            crash_aggregates = assign_to_roads(backend, store_dir, crashes, roads, snap_distance, units, date_field,
+                                               fat_field=fatalities, report_type_field=report_type_field,
+                                               fatalities_name=fatalities_name, categories=categories,
+                                               workers=workers, period_span=date_span if space_time_output else "")
+            stage["rows"] = crash_aggregates.n_crashes
+        time_span = crash_aggregates.get_time_span(date_span)  # Get time span
+    if crash_aggregates is None and report_path:
+        # The append mode only streams the new crashes, the report tallies need all of them
+        with run_profile.stage("time_span") as stage:
+            crash_aggregates = stream_crashes(backend, crashes, date_field, report_type_field,
+                                              fatalities_name if fatalities else "")
+            stage["rows"] = crash_aggregates.n_crashes
+    # Report statistics collected by the next stages, the report does not read the outputs again
+    statistics = report.ReportStatistics(crash_aggregates, units) if report_path else None
+
+    with run_profile.stage("distance_band"):
+        # Average 8 neighbor distance of the stored segment midpoints, shared by every hotspot and cached with them
+        segments = columnar.read_table(store_dir, columnar.SEGMENT_TABLE)[0]
+        distance_band = weights_cache.get_distance_band(np.column_stack([segments["X"], segments["Y"]]),
+                                                        segments["TARGET_FID"],
+                                                        weights_cache.get_cache_dir(backend.workspace))
+    weights = None  # Euclidean distance band neighborhoods, built by every analysis from the cache
+    if neighborhood == "network":  # Neighborhoods along the roads, shared by every hotspot analysis
+        with run_profile.stage("network_index") as stage:
+            weights = get_network_weights(backend, roads, distance_band, workers)
+            stage["rows"] = weights.shape[0]
+
+    # Calculate average crashes (and fatalities) per road segment
+    with run_profile.stage("rates"):
+        attribute_stage(backend, store_dir, time_span, date_span, units, fat_field=fatalities, categories=categories,
+                        statistics=statistics)
+    if fatalities:
+        with run_profile.stage("hotspot_fatalities"):
+            hotspot_analysis(backend, store_dir, roads, distance_band, "Fatalities", attributes.FATALITY_RATE_FIELD,
+                             fatalities_output, workers, permutations, fdr, seed, permutation_memory, weights=weights)
+    with run_profile.stage("hotspot_crashes"):
+        crash_hotspots = hotspot_analysis(backend, store_dir, roads, distance_band, "Crashes",
+                                          attributes.CRASH_RATE_FIELD, crash_output, workers, permutations, fdr,
+                                          seed, permutation_memory, statistics, weights)
+    if categories:  # One combined table with the hotspots of every category
+        with run_profile.stage("hotspot_categories"):
+            category_hotspot_analysis(backend, store_dir, distance_band, categories, category_output, workers,
+                                      permutations, fdr, seed, permutation_memory, weights)
+    if space_time_output:  # Gi* of every period and the trend of every segment
+        with run_profile.stage("hotspot_space_time") as stage:
+            space_time_analysis(backend, store_dir, roads, distance_band, crash_aggregates.period_counts, units,
+                                space_time_output, fdr, weights)
+            stage["rows"] = crash_aggregates.period_counts.counts.size
+
+    if report_path:
+        # The figure cache next to the workspace is shared by the reports of every run
+        report.generate_html_report(fatalities, statistics, crashes, roads, date_span, report_path, run_profile,
+                                    workers, report_inline, report_format,
+                                    incremental.get_sidecar_path(backend.workspace, report.FIGURE_CACHE_NAME))
+        backend.message("HTML report generation completed successfully.")
+    return crash_hotspots
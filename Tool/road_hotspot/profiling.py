@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Per stage run profile: wall time, CPU time, peak memory and row counts.
+
+Every pipeline stage is wrapped in RunProfile.stage, which only reads the clocks and the
+process memory counters at the start and the end of the stage, so the profile can be left
+on in production. The profile is written as JSON and CSV files, and a cProfile dump of every
+stage can be requested for a closer look.
+"""
+import cProfile
+import csv
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:  # Peak memory is not recorded on Windows without psutil
+    psutil = None
+
+PROFILE_NAME = "hotspot_run_profile"
+FIELDS = ["stage", "depth", "wall_s", "cpu_s", "peak_rss_mb", "rss_delta_mb", "rows"]
+
+
+def get_peak_rss():
+    """
+    :return: Peak resident memory of the process in MB, None if it can not be read
+    """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Bytes on macOS, kilobytes on Linux
+        return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+    if psutil is not None:
+        # The peak working set on Windows
+        memory = psutil.Process().memory_info()
+        return getattr(memory, "peak_wset", memory.rss) / 1024 ** 2
+    return None
+
+
+class RunProfile:
+    """Timings and memory of the stages of one run."""
+
+    def __init__(self, cprofile_dir=None):
+        """
+        :param cprofile_dir: Folder for a cProfile dump of every stage, None to skip them
+        """
+        self.cprofile_dir = cprofile_dir
+        self.stages = []
+        self._depth = 0  # Nesting level of the running stage, the totals only add the outer stages
+        self._profiling = False  # Only one cProfile profiler can be enabled, nested stages share the outer dump
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """
+        :param name: Stage name
+        :param rows: Rows processed by the stage, can also be set on the yielded record
+        :return: Context manager yielding the stage record
+        """
+        record = {"stage": name, "depth": self._depth, "rows": rows}
+        self._depth += 1
+        profiler = cProfile.Profile() if self.cprofile_dir and not self._profiling else None
+        start_rss = get_peak_rss()
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        if profiler is not None:
+            self._profiling = True
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            self._depth -= 1
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+            record["wall_s"] = round(time.perf_counter() - start_wall, 4)
+            record["cpu_s"] = round(time.process_time() - start_cpu, 4)
+            peak_rss = get_peak_rss()
+            record["peak_rss_mb"] = None if peak_rss is None else round(peak_rss, 1)
+            record["rss_delta_mb"] = None if peak_rss is None else round(peak_rss - start_rss, 1)
+            self.stages.append(record)
+            if profiler is not None:
+                os.makedirs(self.cprofile_dir, exist_ok=True)
+                profiler.dump_stats(os.path.join(self.cprofile_dir, "%02d_%s.prof" % (len(self.stages), name)))
+
+    def get_total(self):
+        """
+        :return: Total wall and CPU time of the outer stages
+        """
+        outer = [record for record in self.stages if record["depth"] == 0]
+        return sum(record["wall_s"] for record in outer), sum(record["cpu_s"] for record in outer)
+
+    def write(self, path):
+        """
+        :param path: Profile path without extension, a .json and a .csv file are written
+        :return: Paths of the JSON and CSV files
+        """
+        wall, cpu = self.get_total()
+        json_path, csv_path = path + ".json", path + ".csv"
+        with open(json_path, "w") as json_file:
+            json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "wall_s": round(wall, 4),
+                       "cpu_s": round(cpu, 4), "stages": self.stages}, json_file, indent=2)
+        with open(csv_path, "w", newline="") as csv_file:
+            writer = csv.DictWriter(csv_file, FIELDS)
+            writer.writeheader()
+            writer.writerows(self.stages)
+        return json_path, csv_path
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+HTML report of the hotspot analysis: crash trends, hot and cold spots and segment statistics.
+
+Every statistic of the report is a by-product of the pipeline: the totals and the weekday
+and year trends come from the running aggregates of the crash table (ingest.CrashAggregates),
+the segment counts and lengths from the rates stage and the hot and cold spots from the Gi_Bin
+of the crash hotspots, collected in a ReportStatistics, so the report never reads the layers.
+
+matplotlib is only imported when a figure is drawn, and the figures are drawn on Agg canvases
+without pyplot, so the report never changes the matplotlib backend of the host application.
+The figures are rendered in worker processes and cached on disk under a hash of their input
+series, so the figures of an unchanged region or period are copied instead of re-plotted.
+The template is compiled once per process into its literal parts and {placeholder} names.
+"""
+import base64
+import hashlib
+import html
+import json
+import os
+import re
+import shutil
+import tempfile
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from road_hotspot import profiling, tiling, weights_cache
+
+# The template is kept in the Tool folder, next to the script tool
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "report_template.html")
+REPORT_NAME = "Crash_Analysis_Report.html"
+FIGURE_CACHE_NAME = "hotspot_figure_cache"
+MAX_FIGURE_CACHE_BYTES = 256 * 1024 ** 2
+FIGURE_FORMATS = ("png", "svg")
+FIGURE_DPI = 300
+FIGURE_VERSION = 2  # Part of the cache key, increase it when the figure style changes
+PLACEHOLDER = re.compile(r"\{(\w+)\}")
+SVG_UNUSED = re.compile(r"<!--.*?-->|<metadata>.*?</metadata>", re.DOTALL)  # Comments and metadata of the SVG
+SVG_INDENT = re.compile(r">\s+<")
+
+_templates = {}  # Compiled templates by path, reloaded when the file changes
+
+
+class ReportStatistics:
+    """Statistics of the HTML report, collected while the pipeline runs."""
+
+    def __init__(self, crash_aggregates, units=""):
+        """
+        :param crash_aggregates: Running aggregates of the crash table
+        :param units: Length units of the road segments, US miles if empty
+        """
+        self.crash_aggregates = crash_aggregates
+        self.units = units or "Miles (US)"
+        self.total_roads = 0
+        self.segments_with_crashes = 0
+        self.road_length = 0.0
+        self.hot_spots = 0
+        self.cold_spots = 0
+
+    def update_segments(self, crash_count, lengths):
+        """
+        :param crash_count: Crashes of every road segment
+        :param lengths: Length of every road segment, in the units of the run
+        """
+        self.total_roads = len(crash_count)
+        self.segments_with_crashes = int(np.count_nonzero(np.asarray(crash_count) > 0))
+        self.road_length = float(np.sum(lengths))
+
+    def update_hotspots(self, gi_bin):
+        """
+        :param gi_bin: Gi_Bin of every road segment of the crash hotspots
+        """
+        gi_bin = np.asarray(gi_bin)
+        self.hot_spots = int(np.count_nonzero(gi_bin > 0))
+        self.cold_spots = int(np.count_nonzero(gi_bin < 0))
+
+    def get_involvement_rate(self):
+        """
+        :return: Percentage of the road segments with crashes
+        """
+        if not self.total_roads:
+            return 0.0
+        return self.segments_with_crashes / self.total_roads * 100
+
+    def get_mean_incidents(self, fatalities=False):
+        """
+        :param fatalities: True for the mean fatalities per crash, False for the crash counts
+        :return: (labels, values) of the weekday series and of the year series
+        """
+        days, daily_values = self.crash_aggregates.get_daily(fatalities)
+        years, yearly_values = self.crash_aggregates.get_yearly(fatalities)
+        return ([str(day) for day in days], np.asarray(daily_values, dtype=float).tolist()), \
+            ([str(year) for year in years], np.asarray(yearly_values, dtype=float).tolist())
+
+
+def get_figure_key(labels, values, time_step, plot_type, dpi, figure_format):
+    """
+    :param labels: Time steps of the x axis
+    :param values: Mean incidents of every time step
+    :param time_step: Time step of the series
+    :param plot_type: Either "Fatalities" or "Crashes"
+    :param dpi: Resolution of the PNG figures
+    :param figure_format: Figure format {png, svg}
+    :return: Hash of the series and of the figure settings, the cache key of the figure
+    """
+    content = {"labels": list(labels), "values": list(values), "time_step": time_step, "plot_type": plot_type,
+               "dpi": dpi, "format": figure_format, "version": FIGURE_VERSION}
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def render_figure(labels, values, time_step, plot_type, path, dpi=FIGURE_DPI, figure_format="png"):
+    """
+    :param labels: Time steps of the x axis
+    :param values: Mean incidents of every time step
+    :param time_step: Time step of the series
+    :param plot_type: Either "Fatalities" or "Crashes"
+    :param path: Output figure path
+    :param dpi: Resolution of the PNG figures
+    :param figure_format: Figure format {png, svg}
+    :return: Output figure path
+    """
+    # Agg canvas without pyplot, safe in worker processes and inside ArcGIS Pro
+    import matplotlib
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from matplotlib.ticker import MaxNLocator
+
+    figure = Figure(figsize=(8, 6))
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    # Years are plotted as numbers with integer ticks, the weekday names as categories
+    numeric = all(str(label).lstrip("-").isdigit() for label in labels)
+    axes.plot([int(label) for label in labels] if numeric else list(labels), values, color="green", linewidth=3)
+    if numeric:
+        axes.xaxis.set_major_locator(MaxNLocator(integer=True))
+    axes.set_title(plot_type + " by " + time_step)
+    axes.set_ylabel("Mean " + plot_type.lower())
+    axes.set_xlabel("Time step")
+    if figure_format == "svg":  # Text kept as text, much smaller than glyph paths
+        with matplotlib.rc_context({"svg.fonttype": "none"}):
+            figure.savefig(path, format="svg", bbox_inches="tight")
+    else:
+        figure.savefig(path, format="png", dpi=dpi, bbox_inches="tight", pil_kwargs={"optimize": True})
+    return path
+
+
+def get_data_uri(path, figure_format):
+    """
+    :param path: Figure path
+    :param figure_format: Figure format {png, svg}
+    :return: Data URI embedding the figure, minified and URL encoded SVG text or base64 PNG
+    """
+    if figure_format == "svg":
+        with open(path, encoding="utf-8") as figure:
+            text = SVG_INDENT.sub("><", SVG_UNUSED.sub("", figure.read())).strip()
+        return "data:image/svg+xml;charset=utf-8," + urllib.parse.quote(text, safe=" =:/;,'")
+    with open(path, "rb") as figure:
+        return "data:image/png;base64," + base64.b64encode(figure.read()).decode("ascii")
+
+
+def render_figures(figures, report_output, cache_dir=None, workers=1, inline=False, figure_format="png",
+                   dpi=FIGURE_DPI):
+    """
+    :param figures: List of (placeholder, (labels, values), time_step, plot_type) tuples
+    :param report_output: Report folder
+    :param cache_dir: Figure cache folder, None to disable the cache
+    :param workers: Worker processes rendering the missing figures
+    :param inline: True to return data URIs instead of the figure file names
+    :param figure_format: Figure format {png, svg}
+    :param dpi: Resolution of the PNG figures
+    :return: Mapping from placeholder to the figure file name or data URI
+    """
+    if figure_format not in FIGURE_FORMATS:
+        raise ValueError("The figure format %s is not valid. The values should be %s." %
+                         (figure_format, ", ".join(FIGURE_FORMATS)))
+    if inline and cache_dir is None:
+        # Embedded figures without a cache are drawn in a throwaway cache, the report folder only gets the HTML
+        with tempfile.TemporaryDirectory() as render_dir:
+            return render_figures(figures, report_output, render_dir, workers, inline, figure_format, dpi)
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # Figures found in the cache are not rendered again
+    sources, missing = {}, []
+    for placeholder, (labels, values), time_step, plot_type in figures:
+        name = "%s_%s.%s" % (plot_type, time_step, figure_format)
+        if cache_dir is None:
+            source = os.path.join(report_output, name)
+        else:
+            source = os.path.join(cache_dir, get_figure_key(labels, values, time_step, plot_type, dpi,
+                                                            figure_format) + "." + figure_format)
+        sources[placeholder] = (name, source)
+        if cache_dir is None or not os.path.exists(source):
+            missing.append((labels, values, time_step, plot_type, source, dpi, figure_format))
+
+    if workers > 1 and len(missing) > 1:
+        tiling.configure_executable()
+        with ProcessPoolExecutor(max_workers=min(workers, len(missing))) as executor:
+            list(executor.map(render_figure, *zip(*missing)))
+    else:
+        for arguments in missing:
+            render_figure(*arguments)
+
+    plots = {}
+    for placeholder, (name, source) in sources.items():
+        if inline:
+            plots[placeholder] = get_data_uri(source, figure_format)
+            continue
+        if cache_dir is not None:
+            os.utime(source)  # Mark the entry as recently used
+            shutil.copyfile(source, os.path.join(report_output, name))
+        plots[placeholder] = name
+    if cache_dir is not None:
+        weights_cache.evict(cache_dir, MAX_FIGURE_CACHE_BYTES)
+    return plots
+
+
+def compile_template(path=TEMPLATE_PATH):
+    """
+    :param path: HTML template with {placeholder} fields
+    :return: Literal parts and placeholder names, alternating, parsed once per process and file version
+    """
+    version = os.path.getmtime(path)
+    cached = _templates.get(path)
+    if cached is None or cached[0] != version:
+        with open(path, "r", encoding="utf-8") as file:
+            parts = PLACEHOLDER.split(file.read())
+        _templates[path] = cached = (version, parts)
+    return cached[1]
+
+
+def render_template(values, path=TEMPLATE_PATH):
+    """
+    :param values: Mapping from placeholder name to its text, unknown placeholders are kept as they are
+    :param path: HTML template with {placeholder} fields
+    :return: Rendered HTML
+    """
+    parts = compile_template(path)
+    # Odd parts are the placeholder names
+    return "".join(part if position % 2 == 0 else values.get(part, "{%s}" % part)
+                   for position, part in enumerate(parts))
+
+
+def generate_html_report(fatalities, statistics, crash_data_layer, road_data_layer, date_span, report_output,
+                         run_profile=None, workers=1, inline=False, figure_format="png", cache_dir=None):
+    """
+    :param fatalities: True to add the fatality statistics and plots
+    :param statistics: ReportStatistics collected by the pipeline
+    :param crash_data_layer: Crash layer name shown in the report
+    :param road_data_layer: Road layer name shown in the report
+    :param date_span: Date span of the averages
+    :param report_output: Report folder
+    :param run_profile: Optional profiling.RunProfile recording the report stages
+    :param workers: Worker processes rendering the figures
+    :param inline: True to embed the figures in the HTML file as data URIs
+    :param figure_format: Figure format {png, svg}
+    :param cache_dir: Figure cache folder shared by the reports, a folder of the report folder if None
+    :return: Path of the HTML report
+    """
+    run_profile = run_profile or profiling.RunProfile()
+    cache_dir = cache_dir or os.path.join(report_output, FIGURE_CACHE_NAME)
+
+    ## Create plots
+    # Get mean crashes (and fatalities) values, the figures are rendered together
+    with run_profile.stage("report_plots"):
+        daily_crashes, yearly_crashes = statistics.get_mean_incidents()
+        figures = [("crash_by_day", daily_crashes, "Daily", "Crashes"),
+                   ("crash_by_year", yearly_crashes, "Yearly", "Crashes")]
+        if fatalities:
+            total_fatalities = statistics.crash_aggregates.n_fatalities
+            daily_fatalities, yearly_fatalities = statistics.get_mean_incidents(fatalities=True)
+            figures += [("fatalities_by_day", daily_fatalities, "Daily", "Fatalities"),
+                        ("fatalities_by_year", yearly_fatalities, "Yearly", "Fatalities")]
+        else:
+            total_fatalities = "Not analyzed"
+        plots = render_figures(figures, report_output, cache_dir, workers, inline, figure_format)
+
+    with run_profile.stage("report_html"):
+        # Create substitution dictionary, the text values are escaped for HTML
+        substitutions = {
+            'crash_data_name': html.escape(str(crash_data_layer)),
+            'road_data_name': html.escape(str(road_data_layer)),
+            'crash_length': str(statistics.crash_aggregates.n_crashes),
+            'fatalities': str(total_fatalities),
+            'hotspots': str(statistics.hot_spots),
+            'coldspots': str(statistics.cold_spots),
+            'segments_with_crashes': str(statistics.segments_with_crashes),
+            'crash_involvement_rate': "%.2f %%" % statistics.get_involvement_rate(),
+            'road_length': html.escape("%.2f %s" % (statistics.road_length, statistics.units)),
+            'analysis_period': date_span.title(),
+            'fatalities_by_day': "",
+            'fatalities_by_year': "",
+        }
+        substitutions.update(plots)
+
+        # Write the updated HTML file
+        output_html_path = os.path.join(report_output, REPORT_NAME)
+        with open(output_html_path, 'w', encoding='utf-8') as file:
+            file.write(render_template(substitutions))
+    return output_html_path
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Nearest road segment assignment for crash points.
+
+Replaces the CopyFeatures + Snap + SpatialJoin sequence: the road segments are split in
+straight pieces, indexed once in a uniform grid, and every crash is assigned to the
+segment with the closest piece within the snap tolerance, in vectorized batches.
+"""
+import numpy as np
+
+# Meters per unit of the linear units accepted by the snap distance
+LINEAR_UNITS = {"meter": 1.0, "kilometer": 1000.0, "feet": 0.3048, "foot": 0.3048, "yard": 0.9144,
+                "mile": 1609.344, "nautical": 1852.0, "inch": 0.0254, "centimeter": 0.01}
+
+
+def get_meters_per_unit(unit):
+    """
+    :param unit: Linear unit name, e.g. "Miles" or "MILES_US", miles when empty
+    :return: Meters per unit
+    """
+    unit = unit.strip().lower().replace("_us", "").replace("_int", "") or "mile"
+    for unit_name, meters in LINEAR_UNITS.items():
+        if unit.startswith(unit_name):
+            return meters
+    raise ValueError("The distance unit %s is not supported." % unit)
+
+
+def get_tolerance(distance, meters_per_unit):
+    """
+    :param distance: Linear distance string, e.g. "0.25 Miles" as returned by get_snap_distance
+    :param meters_per_unit: Meters per unit of the data coordinate system
+    :return: The distance in the units of the data coordinate system
+    """
+    value, unit = distance.split(" ", 1)
+    # The snap distance is in miles when no units were provided
+    return float(value) * get_meters_per_unit(unit) / meters_per_unit
+
+
+def get_pieces(vertex_ids, vertices):
+    """
+    :param vertex_ids: Segment index of every vertex, vertices of a segment being consecutive and the parts of a
+        multipart segment separated by a NaN vertex
+    :param vertices: (m, 2) array with the vertex coordinates
+    :return: Start points, end points and segment index of every straight piece of the segments
+    """
+    vertex_ids = np.asarray(vertex_ids)
+    vertices = np.asarray(vertices, dtype=float)
+    # Consecutive vertices of the same segment make a piece, no piece bridges the gap between two parts
+    finite = np.isfinite(vertices).all(axis=1)
+    same_segment = (vertex_ids[1:] == vertex_ids[:-1]) & finite[1:] & finite[:-1]
+    return vertices[:-1][same_segment], vertices[1:][same_segment], vertex_ids[:-1][same_segment]
+
+
+def point_segment_distance(points, starts, ends):
+    """
+    :param points: (n, 2) array with the points
+    :param starts: (n, 2) array with the start of the piece paired with each point
+    :param ends: (n, 2) array with the end of the piece paired with each point
+    :return: Euclidean distance from every point to its piece
+    """
+    direction = ends - starts
+    length_sq = np.einsum("ij,ij->i", direction, direction)
+    # Position of the projection along the piece, clamped to the piece ends
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = np.einsum("ij,ij->i", points - starts, direction) / length_sq
+    t = np.clip(np.nan_to_num(t), 0.0, 1.0)
+    closest = starts + t[:, None] * direction
+    return np.hypot(points[:, 0] - closest[:, 0], points[:, 1] - closest[:, 1])
+
+
+class SegmentIndex:
+    """Uniform grid index over the straight pieces of a road network."""
+
+    def __init__(self, starts, ends, segment_ids, cell_size):
+        """
+        :param starts: (m, 2) array with the start point of every piece
+        :param ends: (m, 2) array with the end point of every piece
+        :param segment_ids: Segment index of every piece
+        :param cell_size: Grid cell size, at least the snap tolerance
+        """
+        starts = np.asarray(starts, dtype=float)
+        ends = np.asarray(ends, dtype=float)
+        self.cell_size = float(cell_size)
+
+        # Pieces longer than a cell are split in equal parts of at most one cell, so every indexed piece covers
+        # at most 2 x 2 cells and a long diagonal piece only adds the cells along its path
+        n_parts = np.maximum(np.ceil(np.hypot(*(ends - starts).T) / self.cell_size), 1).astype(np.int64)
+        piece = np.repeat(np.arange(len(starts)), n_parts)
+        step = (np.arange(len(piece)) - np.repeat(np.cumsum(n_parts) - n_parts, n_parts))[:, None]
+        direction = ends - starts
+        self.starts = starts[piece] + direction[piece] * (step / n_parts[piece, None])
+        self.ends = np.where(step + 1 == n_parts[piece, None], ends[piece],
+                             starts[piece] + direction[piece] * ((step + 1) / n_parts[piece, None]))
+        self.segment_ids = np.asarray(segment_ids)[piece]
+
+        # Grid cells covered by the bounding box of every piece
+        self.origin = np.minimum(self.starts, self.ends).min(axis=0)
+        low = self._cell(np.minimum(self.starts, self.ends))
+        high = self._cell(np.maximum(self.starts, self.ends))
+        self.n_rows = int(high[:, 1].max()) + 1
+        span = high - low + 1
+        n_cells = span[:, 0] * span[:, 1]
+
+        # One (cell, piece) entry per covered cell
+        piece = np.repeat(np.arange(len(n_cells)), n_cells)
+        position = np.arange(n_cells.sum()) - np.repeat(np.cumsum(n_cells) - n_cells, n_cells)
+        cell_x = low[piece, 0] + position % span[piece, 0]
+        cell_y = low[piece, 1] + position // span[piece, 0]
+        keys = cell_x * self.n_rows + cell_y
+
+        # Group the pieces by cell (CSR layout)
+        order = np.argsort(keys, kind="stable")
+        self.cell_keys, first = np.unique(keys[order], return_index=True)
+        self.cell_start = np.append(first, len(order))
+        self.cell_pieces = piece[order]
+
+    def _cell(self, points):
+        return np.floor((points - self.origin) / self.cell_size).astype(np.int64)
+
+    def nearest(self, points, tolerance, batch_size=100000):
+        """
+        :param points: (n, 2) array with the crash points
+        :param tolerance: Maximum snap distance, at most the cell size
+        :param batch_size: Number of points processed at once
+        :return: Segment index of the nearest segment of every point (-1 if none within tolerance) and the distance
+        """
+        if tolerance > self.cell_size:
+            raise ValueError("The snap tolerance cannot be larger than the index cell size.")
+        points = np.asarray(points, dtype=float)
+        segment = np.full(len(points), -1, dtype=np.int64)
+        distance = np.full(len(points), np.inf)
+        offsets = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+
+        for batch_start in range(0, len(points), batch_size):
+            batch = points[batch_start:batch_start + batch_size]
+
+            # The 3 x 3 cells around each point hold every piece within the tolerance
+            cells = self._cell(batch)[:, None, :] + offsets[None, :, :]
+            keys = cells[..., 0] * self.n_rows + cells[..., 1]
+            valid = (cells[..., 0] >= 0) & (cells[..., 1] >= 0) & (cells[..., 1] < self.n_rows)
+            position = np.minimum(np.searchsorted(self.cell_keys, keys), len(self.cell_keys) - 1)
+            found = valid & (self.cell_keys[position] == keys)
+            point_index = np.broadcast_to(np.arange(len(batch))[:, None], keys.shape)[found]
+            start = self.cell_start[position[found]]
+            count = self.cell_start[position[found] + 1] - start
+
+            # Expand every (point, cell) pair to its (point, piece) candidates
+            candidate_point = np.repeat(point_index, count)
+            candidate_piece = self.cell_pieces[np.repeat(start, count)
+                                               + np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)]
+            candidate_distance = point_segment_distance(batch[candidate_point], self.starts[candidate_piece],
+                                                        self.ends[candidate_piece])
+            within = candidate_distance <= tolerance
+            candidate_point = candidate_point[within]
+            candidate_piece = candidate_piece[within]
+            candidate_distance = candidate_distance[within]
+
+            # Keep the closest candidate of every point
+            order = np.lexsort((candidate_piece, candidate_distance, candidate_point))
+            closest_point, first = np.unique(candidate_point[order], return_index=True)
+            closest = order[first]
+            segment[batch_start + closest_point] = self.segment_ids[candidate_piece[closest]]
+            distance[batch_start + closest_point] = candidate_distance[closest]
+        return segment, distance
+
+
+def build_index(vertex_ids, vertices, tolerance):
+    """
+    :param vertex_ids: Segment index of every vertex, vertices of a segment being consecutive
+    :param vertices: (m, 2) array with the vertex coordinates
+    :param tolerance: Maximum snap distance
+    :return: SegmentIndex over the road pieces
+    """
+    starts, ends, segment_ids = get_pieces(vertex_ids, vertices)
+    # Cells about one piece long keep the number of (cell, piece) entries low
+    piece_length = np.hypot(*(ends - starts).T)
+    cell_size = max(tolerance, float(np.median(piece_length)) if len(piece_length) else 0.0)
+    return SegmentIndex(starts, ends, segment_ids, cell_size if cell_size > 0 else 1.0)
+
+
+def assign_crashes(index, points, tolerance, n_segments, fatal_flag=None, batch_size=100000):
+    """
+    :param index: SegmentIndex over the road pieces
+    :param points: (n, 2) array with the crash points
+    :param tolerance: Maximum snap distance
+    :param n_segments: Number of road segments
+    :param fatal_flag: Optional array with 1 for fatal incidents
+    :param batch_size: Number of points processed at once
+    :return: Segment index of every crash (-1 if not snapped), crashes per segment and fatalities per segment
+    """
+    segment, _ = index.nearest(points, tolerance, batch_size=batch_size)
+    snapped = segment >= 0
+    crash_count = np.bincount(segment[snapped], minlength=n_segments)
+    fatality_count = None
+    if fatal_flag is not None:
+        fatality_count = np.bincount(segment[snapped], weights=np.asarray(fatal_flag)[snapped],
+                                     minlength=n_segments).astype(np.int64)
+    return segment, crash_count, fatality_count
+
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Space-time hotspots: Gi* of every period and the trend of every segment.
+
+The crashes are binned per segment and per period (year, month or week from the date span)
+into a dense segments x periods count array while the crash table is streamed, so the table
+is still read once. Gi* of every period is then one sparse x dense product per chunk of
+periods with the weights of the whole run, and the z-score series of every segment is
+tested with a vectorized Mann-Kendall trend test. The patterns follow the categories of
+ArcGIS Emerging Hot Spot Analysis (new, consecutive, intensifying, persistent, diminishing,
+sporadic, oscillating and historical hot and cold spots).
+"""
+import numpy as np
+from scipy.special import ndtr
+
+from road_hotspot import gi_star
+
+# NumPy datetime unit of every date span
+PERIOD_UNITS = {"year": "Y", "month": "M", "week": "W"}
+PERIOD_CHUNK = 64  # Periods per sparse product, bounds the memory of the z-score chunks
+TREND_ALPHA = 0.10  # Significance of the Mann-Kendall trend, like the Gi_Bin 90 percent level
+PERSISTENT_SHARE = 0.9  # Share of significant periods of the persistent, intensifying and diminishing patterns
+NO_PATTERN = "No Pattern Detected"
+PERIOD_SUFFIX = "_periods"  # Table with the Gi* of every segment and period
+
+PATTERN_DTYPE = [("SOURCE_ID", np.int32), ("N_PERIODS", np.int32), ("HOT_PERIODS", np.int32),
+                 ("COLD_PERIODS", np.int32), ("LAST_BIN", np.int32), ("TREND_Z", np.float64),
+                 ("TREND_P", np.float64), ("PATTERN", "U32")]
+PERIOD_DTYPE = [("SOURCE_ID", np.int32), ("PERIOD", "M8[us]"), ("Join_Count", np.int32),
+                ("Avg_crash", np.float64), ("GiZScore", np.float64), ("GiPValue", np.float64),
+                ("Gi_Bin", np.int32)]
+
+
+class PeriodCounts:
+    """Dense segments x periods crash counts, updated one batch at a time."""
+
+    def __init__(self, n_segments, date_span):
+        """
+        :param n_segments: Number of road segments
+        :param date_span: Date span of the periods {year, month, week}
+        """
+        self.unit = PERIOD_UNITS[date_span]
+        self.first_period = None  # Period number of the first column, in units since 1970
+        self.counts = np.zeros((n_segments, 0), dtype=np.int32)
+
+    def update(self, segment, dates):
+        """
+        :param segment: Segment index of every crash of one batch, -1 if not snapped
+        :param dates: Crash dates of the batch
+        """
+        dates = np.asarray(dates, dtype="datetime64[us]")
+        valid = (segment >= 0) & ~np.isnat(dates)
+        if not valid.any():
+            return
+        period = dates[valid].astype("datetime64[%s]" % self.unit).astype(np.int64)
+
+        # Widen the array when the batch has periods before or after the current ones
+        low, high = int(period.min()), int(period.max())
+        if self.first_period is None:
+            self.first_period = low
+        before = max(self.first_period - low, 0)
+        after = max(high - (self.first_period + self.counts.shape[1] - 1), 0) if self.counts.shape[1] else \
+            high - low + 1
+        if before or after:
+            self.counts = np.pad(self.counts, ((0, 0), (before, after)))
+            self.first_period -= before
+
+        # Only the segment x period cells present in the batch are counted and added
+        n_periods = self.counts.shape[1]
+        flat = segment[valid].astype(np.int64) * n_periods + (period - self.first_period)
+        cells, counts = np.unique(flat, return_counts=True)
+        rows, columns = np.divmod(cells, n_periods)
+        self.counts[rows, columns] += counts.astype(np.int32)
+
+    def get_periods(self):
+        """
+        :return: Start of every period, as datetime64[us]
+        """
+        if self.first_period is None:
+            return np.zeros(0, dtype="datetime64[us]")
+        periods = np.arange(self.first_period, self.first_period + self.counts.shape[1])
+        return periods.astype("datetime64[%s]" % self.unit).astype("datetime64[us]")
+
+
+def period_gi_star(values, weights, chunk_size=PERIOD_CHUNK):
+    """
+    :param values: (n, t) array with the rates of every segment and period
+    :param weights: (n, n) sparse weights matrix including the diagonal, shared by every period
+    :param chunk_size: Periods per sparse product
+    :return: (n, t) Gi* z-scores and p-values
+    """
+    values = np.asarray(values, dtype=float)
+    if values.shape[0] < 2:
+        raise ValueError("At least 2 features are needed to calculate Gi*.")
+    # The weight sums are shared by every period, only the local sums change
+    w_sum = np.asarray(weights.sum(axis=1)).ravel()
+    w_sq_sum = np.asarray(weights.multiply(weights).sum(axis=1)).ravel()
+    z_scores = np.zeros(values.shape)
+    p_values = np.ones(values.shape)
+    for start in range(0, values.shape[1], chunk_size):
+        chunk = values[:, start:start + chunk_size]
+        z_scores[:, start:start + chunk_size], p_values[:, start:start + chunk_size] = \
+            gi_star.gi_star_from_sums(weights @ chunk, w_sum, w_sq_sum, chunk)
+    return z_scores, p_values
+
+
+def mann_kendall(series):
+    """
+    :param series: (n, t) array with one time series per row
+    :return: Mann-Kendall trend z-scores and two tailed p-values of every row, with the tie correction
+    """
+    series = np.asarray(series, dtype=float)
+    n, t = series.shape
+    if t < 2:
+        return np.zeros(n), np.ones(n)
+
+    # S statistic, one lag at a time over every row
+    s = np.zeros(n)
+    for lag in range(1, t):
+        s += np.sign(series[:, lag:] - series[:, :-lag]).sum(axis=1)
+
+    # Variance with the tie correction: sizes of the groups of equal values of every row
+    ordered = np.sort(series, axis=1)
+    new_group = np.ones((n, t), dtype=bool)
+    new_group[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    group = np.cumsum(new_group.ravel()) - 1
+    sizes = np.bincount(group).astype(float)
+    group_rows = np.flatnonzero(new_group.ravel()) // t
+    ties = np.bincount(group_rows, weights=sizes * (sizes - 1) * (2 * sizes + 5), minlength=n)
+    variance = (t * (t - 1) * (2 * t + 5) - ties) / 18
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z_scores = np.where(variance > 0, (s - np.sign(s)) / np.sqrt(variance), 0.0)
+    return z_scores, 2 * ndtr(-np.abs(z_scores))
+
+
+def get_patterns(bins, trend_z, trend_p):
+    """
+    :param bins: (n, t) Gi_Bin of every segment and period
+    :param trend_z: Mann-Kendall z-score of the Gi* z-scores of every segment
+    :param trend_p: Mann-Kendall p-value of every segment
+    :return: Pattern name of every segment
+    """
+    n, t = bins.shape
+    patterns = np.full(n, NO_PATTERN, dtype="U32")
+    if not t:
+        return patterns
+    trend_up = (trend_p <= TREND_ALPHA) & (trend_z > 0)
+    trend_down = (trend_p <= TREND_ALPHA) & (trend_z < 0)
+    for sign, kind in ((1, "Hot"), (-1, "Cold")):
+        significant = bins * sign > 0
+        opposite = bins * sign < 0
+        n_significant = significant.sum(axis=1)
+        last = significant[:, -1]
+        # Length of the run of significant periods ending with the last one
+        run = t - np.where(~significant, np.arange(t), -1).max(axis=1) - 1
+        mostly = n_significant >= PERSISTENT_SHARE * t
+        # Growing in the direction of the spot: rising z-scores for hot spots, falling ones for cold spots
+        growing, fading = (trend_up, trend_down) if sign > 0 else (trend_down, trend_up)
+
+        rules = [
+            (~last & mostly, "Historical"),
+            (last & opposite.any(axis=1), "Oscillating"),
+            (last & ~mostly & (run < n_significant) & ~opposite.any(axis=1), "Sporadic"),
+            (last & (run == n_significant) & (n_significant > 1) & ~mostly, "Consecutive"),
+            (last & (n_significant == 1), "New"),
+            (last & mostly & ~growing & ~fading, "Persistent"),
+            (last & mostly & growing, "Intensifying"),
+            (last & mostly & fading, "Diminishing"),
+        ]
+        for mask, name in rules:
+            patterns[mask & (patterns == NO_PATTERN)] = "%s %s Spot" % (name, kind)
+    return patterns
+
+
+def get_space_time(counts, lengths, weights, source_ids, periods, chunk_size=PERIOD_CHUNK, fdr=False):
+    """
+    :param counts: (n, t) crashes of every segment and period
+    :param lengths: Road segment lengths
+    :param weights: (n, n) sparse weights matrix including the diagonal
+    :param source_ids: Id of every segment
+    :param periods: Start of every period
+    :param chunk_size: Periods per sparse product
+    :param fdr: True to apply the False Discovery Rate correction to the bins of every period
+    :return: Structured array with the pattern of every segment, generator of the chunks of the table with
+             one row per segment and period (see iter_period_rows)
+    """
+    # Crashes per unit length in every period, zero length segments get a rate of 0
+    lengths = np.asarray(lengths, dtype=float)[:, None]
+    rates = np.divide(counts, lengths, out=np.zeros(counts.shape), where=lengths > 0)
+    z_scores, p_values = period_gi_star(rates, weights, chunk_size)
+    bins = gi_star.get_gi_bin(z_scores, p_values, fdr)
+    trend_z, trend_p = mann_kendall(z_scores)
+
+    patterns = np.zeros(len(source_ids), dtype=PATTERN_DTYPE)
+    patterns["SOURCE_ID"] = source_ids
+    patterns["N_PERIODS"] = counts.shape[1]
+    patterns["HOT_PERIODS"] = (bins > 0).sum(axis=1)
+    patterns["COLD_PERIODS"] = (bins < 0).sum(axis=1)
+    patterns["LAST_BIN"] = bins[:, -1] if counts.shape[1] else 0
+    patterns["TREND_Z"] = trend_z
+    patterns["TREND_P"] = trend_p
+    patterns["PATTERN"] = get_patterns(bins, trend_z, trend_p)
+
+    return patterns, iter_period_rows(counts, rates, z_scores, p_values, bins, source_ids, periods, chunk_size)
+
+
+def iter_period_rows(counts, rates, z_scores, p_values, bins, source_ids, periods, chunk_size=PERIOD_CHUNK):
+    """
+    :param counts: (n, t) crashes of every segment and period
+    :param rates: (n, t) crashes per unit length of every segment and period
+    :param z_scores: (n, t) Gi* z-scores
+    :param p_values: (n, t) Gi* p-values
+    :param bins: (n, t) Gi_Bin
+    :param source_ids: Id of every segment
+    :param periods: Start of every period
+    :param chunk_size: Periods per chunk of rows
+    :return: Generator of structured arrays with one row per segment and period, a chunk of periods at a
+             time (a single empty chunk without periods), so the long table is never built as a whole
+    """
+    n, t = counts.shape
+    for start in range(0, max(t, 1), chunk_size):
+        columns = slice(start, start + chunk_size)
+        n_periods = len(periods[columns])
+        # Period major chunk, segment major inside every period
+        period_rows = np.zeros(n * n_periods, dtype=PERIOD_DTYPE)
+        period_rows["SOURCE_ID"] = np.tile(source_ids, n_periods)
+        period_rows["PERIOD"] = np.repeat(periods[columns], n)
+        period_rows["Join_Count"] = counts[:, columns].T.ravel()
+        period_rows["Avg_crash"] = rates[:, columns].T.ravel()
+        period_rows["GiZScore"] = z_scores[:, columns].T.ravel()
+        period_rows["GiPValue"] = p_values[:, columns].T.ravel()
+        period_rows["Gi_Bin"] = bins[:, columns].T.ravel()
+        yield period_rows
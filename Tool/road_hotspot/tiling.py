@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Tiled, process parallel snapping and Gi* local sums for very large road networks.
+
+The network is split in a grid of square tiles. Each worker gets the features of one tile
+plus a halo as wide as the search distance (the snap tolerance for the assignment, the
+distance band for Gi*), so every neighbor of a tile feature is available in the worker and
+the tile results are the ones a single process would produce. The global statistics of Gi*
+(mean and standard deviation) are computed once in the parent process. The assignment workers
+start once for all the crash batches and keep the road pieces and tile indexes between them.
+
+Run ``python -m road_hotspot.tiling`` from the Tool folder to check that the tiled and the
+untiled results match on a synthetic network.
+"""
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+from road_hotspot import gi_star, snapping
+
+TILES_PER_WORKER = 4  # More tiles than workers keeps the workers busy when the tiles are uneven
+
+
+def configure_executable():
+    # Inside ArcGIS Pro sys.executable is ArcGISPro.exe, the workers must be started with the Python interpreter
+    if sys.platform == "win32" and not os.path.basename(sys.executable).lower().startswith("python"):
+        import multiprocessing
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, "pythonw.exe"))
+
+
+def get_tile_size(points, workers, halo):
+    """
+    :param points: (n, 2) array with the feature locations
+    :param workers: Number of worker processes
+    :param halo: Halo width, the tiles are never smaller than it
+    :return: Side of the square tiles
+    """
+    extent = np.ptp(points, axis=0) if len(points) else np.zeros(2)
+    tile_size = np.sqrt(extent[0] * extent[1] / (workers * TILES_PER_WORKER)) if extent.all() else extent.max()
+    return max(float(tile_size), float(halo), 1e-9)
+
+
+def get_tile_ids(points, origin, tile_size):
+    """
+    :param points: (n, 2) array with the feature locations
+    :param origin: Lower left corner of the tile grid
+    :param tile_size: Side of the square tiles
+    :return: (n, 2) array with the column and row of the tile of every point
+    """
+    return np.floor((np.asarray(points) - origin) / tile_size).astype(np.int64)
+
+
+def _halo_mask(low, high, tile, origin, tile_size, halo):
+    # Features whose bounding box intersects the tile grown by the halo
+    tile_low = origin + tile * tile_size - halo
+    tile_high = origin + (tile + 1) * tile_size + halo
+    return np.all((high >= tile_low) & (low <= tile_high), axis=1)
+
+
+def _group_by_tile(tile_ids):
+    # Unique tiles and the indexes of the features in each one
+    tiles, inverse = np.unique(tile_ids, axis=0, return_inverse=True)
+    order = np.argsort(inverse.ravel(), kind="stable")
+    bounds = np.cumsum(np.bincount(inverse.ravel(), minlength=len(tiles)))[:-1]
+    return tiles, np.split(order, bounds)
+
+
+_worker_pieces = None  # Road pieces and tile grid of a worker process of TiledAssigner
+_worker_indexes = {}  # Segment index of every tile a worker has searched, built on its first batch
+
+
+def _init_assign_worker(starts, ends, segment_ids, origin, tile_size, cell_size, tolerance):
+    # Worker: keep the road pieces once for every batch, the pieces are not sent again with the crashes
+    global _worker_pieces
+    _worker_pieces = (starts, ends, segment_ids, origin, tile_size, cell_size, tolerance)
+    _worker_indexes.clear()
+
+
+def _tile_assign(tile, points):
+    # Worker: nearest segment of the crashes of one tile, the pieces keep the global order for the same ties
+    starts, ends, segment_ids, origin, tile_size, cell_size, tolerance = _worker_pieces
+    if tile not in _worker_indexes:
+        low, high = np.minimum(starts, ends), np.maximum(starts, ends)
+        pieces = np.flatnonzero(_halo_mask(low, high, np.array(tile), origin, tile_size, tolerance))
+        _worker_indexes[tile] = snapping.SegmentIndex(starts[pieces], ends[pieces], segment_ids[pieces],
+                                                      cell_size) if len(pieces) else None
+    index = _worker_indexes[tile]
+    if index is None:  # No road piece within the tolerance of the tile
+        return np.full(len(points), -1, dtype=np.int64), np.full(len(points), np.inf)
+    return index.nearest(points, tolerance)
+
+
+class TiledAssigner:
+    """
+    Crash assignment in spatial tiles of the road network, with worker processes started once for every batch.
+    The tile grid covers the road pieces, each worker receives the pieces when it starts and builds the index of
+    a tile the first time it gets crashes in it, so the batches only send the crash coordinates.
+    """
+
+    def __init__(self, vertex_ids, vertices, tolerance, workers):
+        """
+        :param vertex_ids: Segment index of every vertex, vertices of a segment being consecutive
+        :param vertices: (m, 2) array with the vertex coordinates
+        :param tolerance: Maximum snap distance
+        :param workers: Number of worker processes
+        """
+        starts, ends, segment_ids = snapping.get_pieces(vertex_ids, vertices)
+        # Same cell size as snapping.build_index
+        piece_length = np.hypot(*(ends - starts).T)
+        cell_size = max(tolerance, float(np.median(piece_length)) if len(piece_length) else 0.0) or 1.0
+        piece_points = np.concatenate([starts, ends])
+        self.origin = piece_points.min(axis=0) if len(piece_points) else np.zeros(2)
+        self.tile_size = get_tile_size(piece_points, workers, tolerance)
+        configure_executable()
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_assign_worker,
+                                            initargs=(starts, ends, segment_ids, self.origin, self.tile_size,
+                                                      cell_size, tolerance))
+
+    def nearest(self, points):
+        """
+        :param points: (n, 2) array with the crash points
+        :return: Segment index of the nearest segment of every point (-1 if none within tolerance) and the distance
+        """
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        segment = np.full(len(points), -1, dtype=np.int64)
+        distance = np.full(len(points), np.inf)
+        if len(points) == 0:
+            return segment, distance
+        tiles, members = _group_by_tile(get_tile_ids(points, self.origin, self.tile_size))
+        futures = [(member, self.executor.submit(_tile_assign, tuple(int(i) for i in tile), points[member]))
+                   for tile, member in zip(tiles, members)]
+        for member, future in futures:
+            segment[member], distance[member] = future.result()
+        return segment, distance
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def parallel_assign(vertex_ids, vertices, points, tolerance, n_segments, workers, fatal_flag=None):
+    """
+    :param vertex_ids: Segment index of every vertex, vertices of a segment being consecutive
+    :param vertices: (m, 2) array with the vertex coordinates
+    :param points: (n, 2) array with the crash points
+    :param tolerance: Maximum snap distance
+    :param n_segments: Number of road segments
+    :param workers: Number of worker processes
+    :param fatal_flag: Optional array with 1 for fatal incidents
+    :return: Same as snapping.assign_crashes
+    """
+    with TiledAssigner(vertex_ids, vertices, tolerance, workers) as assigner:
+        segment = assigner.nearest(points)[0]
+
+    snapped = segment >= 0
+    crash_count = np.bincount(segment[snapped], minlength=n_segments)
+    fatality_count = None
+    if fatal_flag is not None:
+        fatality_count = np.bincount(segment[snapped], weights=np.asarray(fatal_flag)[snapped],
+                                     minlength=n_segments).astype(np.int64)
+    return segment, crash_count, fatality_count
+
+
+def _tile_local_sums(core, halo, halo_points, halo_values, distance_band):
+    # Worker: Gi* local sums of the core features of one tile, from the core and halo features
+    tree = cKDTree(halo_points)
+    core_local = np.searchsorted(halo, core)
+    neighbors = tree.query_ball_point(halo_points[core_local], distance_band, return_sorted=True)
+    counts = np.array([len(row) for row in neighbors], dtype=np.int64)
+    indptr = np.concatenate([[0], np.cumsum(counts)])
+    indices = np.concatenate(neighbors).astype(np.int64) if len(neighbors) else np.zeros(0, dtype=np.int64)
+    # The halo is sorted by global index, so the rows sum the values in the same order as gi_star.build_weights
+    weights = sparse.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(len(core), len(halo)))
+    weights.sort_indices()
+    w_sum = np.asarray(weights.sum(axis=1)).ravel()
+    w_sq_sum = np.asarray(weights.multiply(weights).sum(axis=1)).ravel()
+    return weights @ halo_values, w_sum, w_sq_sum
+
+
+def parallel_gi_star(points, values, distance_band, workers):
+    """
+    :param points: (n, 2) array with the segment midpoints
+    :param values: (n,) or (n, k) array with the analysis fields
+    :param distance_band: Fixed distance threshold, in the units of the points
+    :param workers: Number of worker processes
+    :return: Gi* z-scores, p-values and number of neighbors, as gi_star.gi_star on the whole network
+    """
+    points = np.asarray(points, dtype=float)
+    values = np.asarray(values, dtype=float)
+    origin = points.min(axis=0)
+    tile_size = get_tile_size(points, workers, distance_band)
+    tiles, members = _group_by_tile(get_tile_ids(points, origin, tile_size))
+
+    local_sum = np.zeros(values.shape)
+    w_sum = np.zeros(len(points))
+    w_sq_sum = np.zeros(len(points))
+    configure_executable()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for tile, core in zip(tiles, members):
+            # Core features plus every feature within the distance band of the tile
+            halo = np.flatnonzero(_halo_mask(points, points, tile, origin, tile_size, distance_band))
+            futures.append((core, executor.submit(_tile_local_sums, core, halo, points[halo], values[halo],
+                                                  distance_band)))
+        for core, future in futures:
+            local_sum[core], w_sum[core], w_sq_sum[core] = future.result()
+
+    z_scores, p_values = gi_star.gi_star_from_sums(local_sum, w_sum, w_sq_sum, values)
+    return z_scores, p_values, w_sum.astype(np.int64)
+
+
+def check_tiled(points, values, distance_band, workers):
+    """
+    :param points: (n, 2) array with the segment midpoints
+    :param values: (n,) or (n, k) array with the analysis fields
+    :param distance_band: Fixed distance threshold
+    :param workers: Number of worker processes
+    :return: True if the tiled z-scores and p-values are identical to the single process ones
+    """
+    weights = gi_star.build_weights(points, distance_band)
+    z_scores, p_values = gi_star.gi_star(values, weights)
+    tiled_z, tiled_p, neighbors = parallel_gi_star(points, values, distance_band, workers)
+    return (np.array_equal(z_scores, tiled_z) and np.array_equal(p_values, tiled_p)
+            and np.array_equal(np.diff(weights.indptr), neighbors))
+
+
+def check_tiled_assign(vertex_ids, vertices, points, tolerance, n_segments, workers):
+    """
+    :return: True if the tiled crash assignment is identical to the single process one
+    """
+    index = snapping.build_index(vertex_ids, vertices, tolerance)
+    segment = snapping.assign_crashes(index, points, tolerance, n_segments)[0]
+    tiled_segment = parallel_assign(vertex_ids, vertices, points, tolerance, n_segments, workers)[0]
+    return np.array_equal(segment, tiled_segment)
+
+
+if __name__ == "__main__":
+    # Compare the tiled and untiled results on a random road grid
+    rng = np.random.default_rng(0)
+    n_side = 60
+    grid = np.arange(n_side, dtype=float) * 100
+    x, y = np.meshgrid(grid, grid)
+    # Horizontal road segments with a middle vertex
+    road_starts = np.column_stack([x[:, :-1].ravel(), y[:, :-1].ravel()])
+    road_vertices = np.stack([road_starts, road_starts + [50, rng.normal(0, 5)], road_starts + [100, 0]], axis=1)
+    road_ids = np.repeat(np.arange(len(road_starts)), 3)
+    crash_points = rng.random((50000, 2)) * grid.max()
+    midpoints = road_vertices[:, 1, :]
+    rates = rng.poisson(1.5, (len(midpoints), 2)).astype(float)
+
+    assign_ok = check_tiled_assign(road_ids, road_vertices.reshape(-1, 2), crash_points, 25.0, len(road_starts), 4)
+    gi_ok = check_tiled(midpoints, rates, 350.0, 4)
+    print("Tiled assignment identical: %s" % assign_ok)
+    print("Tiled Gi* identical: %s" % gi_ok)
+    sys.exit(0 if assign_ok and gi_ok else 1)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+On disk cache of the Gi* spatial weights.
+
+The fixed distance band neighborhoods only depend on the segment locations and the
+distance band, so the sparse weights matrix is built once, saved as a SciPy .npz file keyed
+on a hash of both, and reused by every analysis field and by later runs on the same road
+network. The distance band is itself derived from the segment locations and cached under the
+geometry hash, so the keys only change with the road network, not with the crash data.
+The least recently used entries are evicted when the cache grows over its size limit. The
+cache can be shared by concurrent processes: the entries are written to a temporary file and
+renamed, and an entry evicted by another process is a cache miss.
+"""
+import glob
+import hashlib
+import json
+import os
+import tempfile
+
+from scipy import sparse
+
+from road_hotspot import gi_star, incremental
+
+CACHE_NAME = "hotspot_weights_cache"
+MAX_CACHE_BYTES = 1024 ** 3  # 1 GB
+TEMP_SUFFIX = ".tmp"  # Entries being written, never evicted
+
+
+def get_cache_key(geometry_hash, distance_band, method="euclidean"):
+    """
+    :param geometry_hash: Hash of the segment locations and ids
+    :param distance_band: Distance band of the neighborhoods
+    :param method: Neighborhood method
+    :return: Key of the cache entry
+    """
+    return hashlib.sha1(("%s|%r|%s" % (geometry_hash, float(distance_band), method)).encode("utf-8")).hexdigest()
+
+
+def get_cache_dir(workspace):
+    """
+    :param workspace: Working directory or geodatabase
+    :return: Cache folder next to the workspace, created if needed
+    """
+    cache_dir = incremental.get_sidecar_path(workspace, CACHE_NAME)
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def evict(cache_dir, max_bytes=MAX_CACHE_BYTES):
+    """
+    :param cache_dir: Cache folder
+    :param max_bytes: Maximum size of the cache
+    :return: Number of entries removed, least recently used first
+    """
+    entries = []
+    for path in glob.glob(os.path.join(cache_dir, "*")):
+        if path.endswith(TEMP_SUFFIX) or not os.path.isfile(path):
+            continue
+        try:
+            entries.append((os.path.getmtime(path), os.path.getsize(path), path))
+        except FileNotFoundError:  # Evicted by another process
+            continue
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:  # Evicted by another process
+            pass
+        total -= size
+    return removed
+
+
+def write_entry(path, write):
+    """
+    :param path: Path of the cache entry
+    :param write: Function writing the entry to an open binary file
+    :return: Path of the cache entry
+    """
+    # Written next to the entry and renamed, other processes never read a partial entry
+    handle, temp_path = tempfile.mkstemp(suffix=TEMP_SUFFIX, dir=os.path.dirname(path))
+    try:
+        with os.fdopen(handle, "wb") as entry_file:
+            write(entry_file)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return path
+
+
+def load_weights(cache_dir, key):
+    """
+    :param cache_dir: Cache folder
+    :param key: Key of the cache entry
+    :return: Cached CSR weights matrix, None if not cached
+    """
+    path = os.path.join(cache_dir, key + ".npz")
+    try:
+        os.utime(path)  # Mark the entry as recently used
+        return sparse.load_npz(path).tocsr()
+    except FileNotFoundError:  # Not cached, or evicted by another process
+        return None
+
+
+def save_weights(cache_dir, key, weights, max_bytes=MAX_CACHE_BYTES):
+    """
+    :param cache_dir: Cache folder
+    :param key: Key of the cache entry
+    :param weights: Sparse weights matrix to cache
+    :param max_bytes: Maximum size of the cache
+    """
+    write_entry(os.path.join(cache_dir, key + ".npz"), lambda entry_file: sparse.save_npz(entry_file, weights))
+    evict(cache_dir, max_bytes)
+
+
+def get_distance_band(points, source_ids, cache_dir, neighbors=8):
+    """
+    :param points: (n, 2) array with the segment midpoints
+    :param source_ids: Id of every segment
+    :param cache_dir: Cache folder, None to disable the cache
+    :param neighbors: Number of neighbors every segment should have
+    :return: Average distance of the segments to their k-th neighbor, from the cache when available
+    """
+    if cache_dir is None:
+        return gi_star.get_distance_band(points, neighbors)[1]
+
+    key = get_cache_key(incremental.get_geometry_hash(source_ids, points), neighbors, method="distance_band")
+    path = os.path.join(cache_dir, key + ".json")
+    try:
+        os.utime(path)  # Mark the entry as recently used
+        with open(path) as band_file:
+            return json.load(band_file)["distance_band"]
+    except FileNotFoundError:  # Not cached, or evicted by another process
+        pass
+    distance_band = float(gi_star.get_distance_band(points, neighbors)[1])
+    entry = json.dumps({"distance_band": distance_band, "neighbors": neighbors}).encode("utf-8")
+    write_entry(path, lambda band_file: band_file.write(entry))
+    return distance_band
+
+
+def get_weights(points, distance_band, source_ids, cache_dir, max_bytes=MAX_CACHE_BYTES):
+    """
+    :param points: (n, 2) array with the segment midpoints
+    :param distance_band: Fixed distance threshold, in the units of the points
+    :param source_ids: Id of every segment
+    :param cache_dir: Cache folder, None to disable the cache
+    :param max_bytes: Maximum size of the cache
+    :return: CSR weights matrix, from the cache when available
+    """
+    if cache_dir is None:
+        return gi_star.build_weights(points, distance_band)
+
+    key = get_cache_key(incremental.get_geometry_hash(source_ids, points), distance_band)
+    weights = load_weights(cache_dir, key)
+    if weights is None:
+        weights = gi_star.build_weights(points, distance_band)
+        save_weights(cache_dir, key, weights, max_bytes)
+    return weights
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the road_hotspot package, run with ``python -m pytest Tool/tests`` from the repository root.
+"""
+import os
+import sys
+
+# The package lives in the Tool folder, next to the script tool, the synthetic data in the benchmarks folder
+TOOL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOOL_DIR)
+sys.path.insert(0, os.path.join(os.path.dirname(TOOL_DIR), "benchmarks"))
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Time span, rates and crash categories of the attribute stage.
+"""
+import numpy as np
+import pytest
+
+from road_hotspot import attributes
+
+
+def test_time_span_is_fractional():
+    # Four months of crashes with a yearly span are a third of a year, not 0 years
+    span = attributes.get_time_span(np.datetime64("2024-01-01"), np.datetime64("2024-05-01"), "year")
+    assert span == pytest.approx(121 / 365)
+    assert attributes.get_time_span("2020-01-01", "2022-01-01", "month") == pytest.approx(731 / 30)
+
+
+def test_time_span_is_at_least_one_day():
+    assert attributes.get_time_span("2024-03-01T08:00", "2024-03-01T09:00", "week") == pytest.approx(1 / 7)
+
+
+def test_time_span_without_dates():
+    with pytest.raises(ValueError):
+        attributes.get_time_span(None, None, "year")
+    with pytest.raises(ValueError):
+        attributes.get_time_span(np.datetime64("NaT"), np.datetime64("2024-01-01"), "year")
+
+
+def test_short_extent_keeps_the_rates():
+    span = attributes.get_time_span("2024-01-01", "2024-02-01", "year")
+    rates, zero_length = attributes.get_rates(np.array([3, 0, 6]), np.array([2.0, 1.0, 0.0]), span)
+    assert zero_length == 1
+    np.testing.assert_allclose(rates, [1.5 / span, 0.0, 0.0])
+
+
+def test_parse_categories():
+    categories = attributes.parse_categories(["'Property Damage'", "SEVERITY=1", " ", "\"A-B\""], "REPORT")
+    assert categories == [("REPORT", "Property Damage", "Property_Damage"), ("SEVERITY", "1", "1"),
+                          ("REPORT", "A-B", "A_B")]
+
+
+def test_numeric_categories_match_as_numbers():
+    # Float and integer fields hold 1.0 and 1, the category is written as 1
+    columns = {"SEVERITY": np.array([1.0, 2.0, 1.0, np.nan]), "CODE": np.array([1, 2, 3])}
+    categories = attributes.parse_categories(["SEVERITY=1", "SEVERITY=Minor"], "REPORT")
+    flags = attributes.get_category_flags(columns, categories)
+    np.testing.assert_array_equal(flags, [[1, 0], [0, 0], [1, 0], [0, 0]])
+    np.testing.assert_array_equal(attributes.get_value_flag(columns["CODE"], "3.0"), [False, False, True])
+
+    # Cursor columns of a numeric field are objects with None for the nulls
+    cursor = np.array([1.0, None, 2, 1], dtype=object)
+    np.testing.assert_array_equal(attributes.get_value_flag(cursor, "1"), [True, False, False, True])
+
+
+def test_text_categories_skip_nulls():
+    report_types = np.array(["Fatal", None, "None", "01", np.nan], dtype=object)
+    np.testing.assert_array_equal(attributes.get_value_flag(report_types, "None"), [0, 0, 1, 0, 0])
+    np.testing.assert_array_equal(attributes.get_value_flag(report_types, "1"), [0, 0, 0, 0, 0])
+    np.testing.assert_array_equal(attributes.get_value_flag(report_types, "Fatal"), [1, 0, 0, 0, 0])
+
+
+def test_category_rates():
+    categories = attributes.parse_categories(["Fatal", "Injury"], "REPORT")
+    counts = np.array([[2, 1], [0, 4], [1, 1]])
+    rates = attributes.get_category_rates(counts, np.array([2.0, 4.0, 0.0]), 2.0, categories)
+    assert rates.dtype.names == ("Avg_Fatal_yr", "Avg_Injury_yr")
+    np.testing.assert_allclose(rates["Avg_Fatal_yr"], [0.5, 0.0, 0.0])
+    np.testing.assert_allclose(rates["Avg_Injury_yr"], [0.25, 0.5, 0.0])
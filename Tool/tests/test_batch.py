@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Batch runner: manifests, date windows, and jobs identical to standalone pipeline runs on their own data.
+"""
+import json
+
+import numpy as np
+import pytest
+
+import synthetic
+from road_hotspot import attributes, batch, pipeline, snapping
+
+N_CRASHES = 6000
+SNAP_DISTANCE = "30"
+JOBS = [{"name": "all_3y", "region": "", "start": "", "end": "", "years": "3", "date_span": ""},
+        {"name": "west_2018", "region": "COUNTY=West", "start": "2018-01-01", "end": "2018-12-31", "years": "",
+         "date_span": "Month"},
+        {"name": "east", "region": "COUNTY='East'", "start": "", "end": "", "years": "", "date_span": "week"}]
+
+
+class RegionBackend(synthetic.SyntheticBackend):
+    """Synthetic backend with a COUNTY road field, West and East of the network middle."""
+
+    def read_road_field(self, roads, field):
+        centroids = self.network.get_centroids()
+        return np.where(centroids[:, 0] < np.median(centroids[:, 0]), "West", "East").astype(object)
+
+
+class TableBackend(synthetic.SyntheticBackend):
+    """Synthetic backend serving a fixed set of crashes, e.g. the crashes of one job."""
+
+    def __init__(self, workspace, network, crashes):
+        super().__init__(workspace, network, None)
+        self.table = crashes
+
+    def iter_crash_batches(self, crashes, fields, min_oid=None, spatial_reference=None):
+        oids, points, dates, report_types = self.table
+        batch_array = np.zeros(len(oids), dtype=[("OID@", "i8"), ("SHAPE@XY", "f8", (2,)), (self.DATE_FIELD, "M8[us]"),
+                                                 (self.REPORT_TYPE_FIELD, "O")])
+        batch_array["OID@"], batch_array["SHAPE@XY"] = oids, points
+        batch_array[self.DATE_FIELD], batch_array[self.REPORT_TYPE_FIELD] = dates, report_types
+        yield batch_array[list(fields)]
+
+
+def write_manifests(folder):
+    csv_path = folder / "jobs.csv"
+    csv_path.write_text("name,region,start,end,years,date_span\n" + "\n".join(
+        ",".join('"%s"' % job[field] if "'" in job[field] else job[field] for field in batch.MANIFEST_FIELDS)
+        for job in JOBS) + "\n", encoding="utf-8")
+    json_path = folder / "jobs.json"
+    json_path.write_text(json.dumps(JOBS), encoding="utf-8")
+    return str(csv_path), str(json_path)
+
+
+def test_manifest_formats(tmp_path):
+    csv_path, json_path = write_manifests(tmp_path)
+    jobs = batch.read_manifest(csv_path)
+    assert jobs == batch.read_manifest(json_path)
+    assert [job["date_span"] for job in jobs] == ["year", "month", "week"]
+    assert batch.parse_region(jobs[2]["region"]) == ("COUNTY", "East")
+    assert batch.parse_region(jobs[0]["region"]) is None
+
+    (tmp_path / "unnamed.json").write_text(json.dumps([{"years": 1}]), encoding="utf-8")
+    assert batch.read_manifest(str(tmp_path / "unnamed.json"))[0]["name"] == "job_1"
+
+
+@pytest.mark.parametrize("job, message", [({"start": "2018-01-01", "years": "2"}, "both"),
+                                          ({"date_span": "decade"}, "not valid")])
+def test_invalid_manifests(tmp_path, job, message):
+    (tmp_path / "jobs.json").write_text(json.dumps([job]), encoding="utf-8")
+    with pytest.raises(ValueError, match=message):
+        batch.read_manifest(str(tmp_path / "jobs.json"))
+    with pytest.raises(ValueError):
+        batch.parse_region("COUNTY")
+
+
+def test_windows():
+    min_date, max_date = np.datetime64("2015-01-03T10:00", "us"), np.datetime64("2022-12-30T08:00", "us")
+    assert batch.get_window(JOBS[0], min_date, max_date) == (np.datetime64("2019-12-30T08:00", "us"), max_date)
+    assert batch.get_window(JOBS[1], min_date, max_date) == (
+        np.datetime64("2018-01-01", "us"), np.datetime64("2019-01-01", "us") - np.timedelta64(1, "us"))
+    assert batch.get_window(JOBS[2], min_date, max_date) == (min_date, max_date)
+
+
+def test_time_span_covers_the_window():
+    # Crashes only in the first month of a yearly window: the rates are averaged over the whole window
+    job = {"start": "2020-01-01", "end": "2020-12-31", "years": "", "date_span": "year"}
+    dates = np.array(["2020-01-05", "2020-01-20"], dtype="M8[us]")
+    road_attributes, crash_count, _, time_span = batch.get_job_rates(
+        job, np.array([0, 0]), dates, None, np.array([2.0, 1.0]), dates.min(), dates.max())
+    assert time_span == pytest.approx(366 / 365, abs=1e-9)
+    np.testing.assert_array_equal(crash_count, [2, 0])
+    np.testing.assert_allclose(road_attributes["Avg_crash_yr"], [1.0 / time_span, 0.0])
+
+
+@pytest.fixture(scope="module")
+def batch_run(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("batch")
+    network = synthetic.get_network("grid", 1200, seed=4)
+    backend = RegionBackend(str(folder / "ws"), network,
+                            synthetic.CrashGenerator(network, N_CRASHES, "clustered", seed=4))
+    batch.run(backend, write_manifests(folder)[0], "crashes", backend.DATE_FIELD, "roads", report_type_field=backend.REPORT_TYPE_FIELD,
+              fatalities_name="Fatal", max_distance=SNAP_DISTANCE, units="Meters")
+    return backend
+
+
+def test_consolidated_tables(batch_run):
+    results = batch_run.outputs[batch.RESULT_TABLE]
+    summary = batch_run.outputs[batch.RESULT_TABLE + batch.SUMMARY_SUFFIX]
+    assert summary["JOB"].tolist() == ["all_3y", "west_2018", "east"]
+    assert summary["REGION"].tolist() == ["All", "COUNTY=West", "COUNTY='East'"]
+    counties = batch_run.read_road_field("roads", "COUNTY")
+    assert summary["SEGMENTS"].tolist() == [batch_run.network.n_segments, np.sum(counties == "West"),
+                                            np.sum(counties == "East")]
+    for row in summary:
+        job_rows = results[results["JOB"] == row["JOB"]]
+        assert len(job_rows) == row["SEGMENTS"]
+        assert job_rows["Join_Count"].sum() == row["CRASHES"]
+        assert (job_rows["Gi_Bin"] > 0).sum() == row["HOTSPOTS"]
+        assert (job_rows["WINDOW_START"] == row["WINDOW_START"]).all()
+        assert (job_rows["TIME_SPAN"] == row["TIME_SPAN"]).all()
+    assert "Bin_fata" in results.dtype.names
+
+
+@pytest.mark.parametrize("position", range(len(JOBS)))
+def test_jobs_match_standalone_runs(batch_run, tmp_path, position):
+    job = dict(JOBS[position], date_span=JOBS[position]["date_span"].lower() or "year")
+    network = batch_run.network
+    oids, points, dates, report_types = batch_run.crashes.get_batch(0, N_CRASHES)
+
+    # The crashes of the job: nearest segment of the whole network in the region, date in the window
+    segment = snapping.assign_crashes(snapping.build_index(network.vertex_ids, network.vertices, 30.0), points, 30.0,
+                                      network.n_segments)[0]
+    region = batch.parse_region(job["region"])
+    region_segments = batch.get_region_segments(batch_run, "roads", region, network.n_segments)
+    assigned = segment >= 0
+    start, end = batch.get_window(job, dates[assigned].min(), dates[assigned].max())
+    keep = np.isin(segment, region_segments) & (dates >= start) & (dates <= end)
+
+    region_vertices = np.isin(network.vertex_ids, region_segments)
+    region_network = synthetic.RoadNetwork(np.searchsorted(region_segments, network.vertex_ids[region_vertices]),
+                                           network.vertices[region_vertices])
+    standalone = TableBackend(str(tmp_path / "ws"), region_network,
+                              (oids[keep], points[keep], dates[keep], report_types[keep]))
+    pipeline.run(standalone, "crashes", standalone.DATE_FIELD, "roads", "Crash_hotspots", job["date_span"],
+                 max_distance=SNAP_DISTANCE, units="Meters")
+    expected = standalone.outputs["Crash_hotspots"]
+    crash_time_span = attributes.get_time_span(dates[keep].min(), dates[keep].max(), job["date_span"])
+
+    results = batch_run.outputs[batch.RESULT_TABLE]
+    job_rows = results[results["JOB"] == job["name"]]
+    np.testing.assert_array_equal(job_rows["SOURCE_ID"], network.oids[region_segments])
+    np.testing.assert_array_equal(job_rows["Join_Count"], expected["Join_Count"])
+    # The rates differ by the time span only, window against crash extent, and Gi* does not depend on it
+    np.testing.assert_allclose(job_rows["Avg_crash_yr"] * job_rows["TIME_SPAN"],
+                               expected["Avg_crash_yr"] * crash_time_span, rtol=1e-9)
+    np.testing.assert_allclose(job_rows["GiZScore"], expected["GiZScore"], rtol=1e-9, atol=1e-9)
+    np.testing.assert_array_equal(job_rows["Gi_Bin"], expected["Gi_Bin"])
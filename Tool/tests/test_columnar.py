@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar store: the Arrow and NumPy tables give back the columns with their dtypes.
+"""
+import numpy as np
+import pytest
+
+from road_hotspot import columnar
+
+REFERENCE = {"road_lines": "roads.gpkg|roads", "join_field": "TARGET_FID"}
+
+
+def get_columns():
+    rng = np.random.default_rng(9)
+    return {"TARGET_FID": np.arange(1, 101, dtype=np.int64), "Join_Count": rng.poisson(2, 100).astype(np.int32),
+            "Avg_crash_yr": rng.random(100), "Gi_Bin": rng.integers(-3, 4, 100).astype(np.int8)}
+
+
+def check_round_trip(store_dir, extension):
+    columns = get_columns()
+    path = columnar.write_table(store_dir, columnar.SEGMENT_TABLE, columns, REFERENCE)
+    assert path.endswith(extension)
+    stored, reference = columnar.read_table(store_dir, columnar.SEGMENT_TABLE)
+    assert reference == REFERENCE
+    assert list(stored) == list(columns)
+    for name, values in columns.items():
+        assert stored[name].dtype == values.dtype
+        np.testing.assert_array_equal(stored[name], values)
+    records = columnar.to_records(stored, ["TARGET_FID", "Gi_Bin"])
+    assert records.dtype.names == ("TARGET_FID", "Gi_Bin")
+
+
+def test_arrow_round_trip(tmp_path):
+    pytest.importorskip("pyarrow")
+    check_round_trip(str(tmp_path), ".arrow")
+
+
+def test_numpy_fallback(tmp_path, monkeypatch):
+    # Without pyarrow the tables are memory mapped .npy files
+    monkeypatch.setattr(columnar, "pa", None)
+    check_round_trip(str(tmp_path), ".npy")
+    stored = columnar.read_table(str(tmp_path), columnar.SEGMENT_TABLE)[0]
+    assert isinstance(stored["Avg_crash_yr"].base, np.memmap)
+
+
+def test_missing_table(tmp_path):
+    with pytest.raises(IOError):
+        columnar.read_table(str(tmp_path), columnar.RATE_TABLE)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+GeoPandas backend: the crash layers are streamed in batches, filtered on the watermark and keep their nulls.
+"""
+import numpy as np
+import pytest
+
+gpd = pytest.importorskip("geopandas")
+pytest.importorskip("pyogrio")
+
+from road_hotspot import attributes, ingest  # noqa: E402
+from road_hotspot.backends import geo  # noqa: E402
+
+N_CRASHES = 2500
+FIELDS = ["OID@", "CRASH_DATE", "REPORT", "SHAPE@XY"]
+
+
+@pytest.fixture(scope="module")
+def layers(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("layers")
+    rng = np.random.default_rng(11)
+    frame = gpd.GeoDataFrame({
+        "CRASH_DATE": np.datetime64("2020-01-01") + rng.integers(0, 1000, N_CRASHES).astype("timedelta64[D]"),
+        "REPORT": np.where(rng.random(N_CRASHES) < 0.1, "Fatal", "Injury"),
+    }, geometry=gpd.points_from_xy(rng.random(N_CRASHES) * 1000, rng.random(N_CRASHES) * 1000), crs="EPSG:26915")
+    parquet = str(folder / "crashes.parquet")
+    frame.to_parquet(parquet, row_group_size=600)
+    geopackage = str(folder / "crashes.gpkg")
+    frame.to_file(geopackage, layer="crashes")
+    return frame, {"parquet": parquet, "gpkg": geopackage + "|crashes"}
+
+
+def read_crashes(layer, min_oid=None, spatial_reference=None):
+    backend = geo.GeoPandasBackend("unused.gpkg")
+    batches = list(backend.iter_crash_batches(layer, FIELDS, min_oid, spatial_reference))
+    return np.concatenate(batches) if batches else np.zeros(0, ingest.get_dtype(FIELDS, backend.get_field_types(layer)))
+
+
+@pytest.mark.parametrize("kind", ["parquet", "gpkg"])
+def test_field_types_from_schema(layers, kind):
+    field_types = geo.GeoPandasBackend("unused.gpkg").get_field_types(layers[1][kind])
+    assert field_types["CRASH_DATE"] == "Date"
+    assert field_types["REPORT"] != "Date"
+
+
+@pytest.mark.parametrize("kind", ["parquet", "gpkg"])
+@pytest.mark.parametrize("batch_size", [ingest.BATCH_SIZE, 500])
+def test_batches_match_the_layer(layers, kind, batch_size, monkeypatch):
+    monkeypatch.setattr(ingest, "BATCH_SIZE", batch_size)
+    frame, paths = layers
+    crashes = read_crashes(paths[kind])
+    first_oid = 0 if kind == "parquet" else 1  # Row position or feature id
+    np.testing.assert_array_equal(crashes["OID@"], np.arange(N_CRASHES) + first_oid)
+    np.testing.assert_array_equal(crashes["CRASH_DATE"], frame["CRASH_DATE"].to_numpy())
+    np.testing.assert_array_equal(crashes["REPORT"], frame["REPORT"].to_numpy())
+    np.testing.assert_allclose(crashes["SHAPE@XY"], np.column_stack([frame.geometry.x, frame.geometry.y]))
+
+
+@pytest.mark.parametrize("kind", ["parquet", "gpkg"])
+@pytest.mark.parametrize("min_oid", [0, 599, 600, 1234, N_CRASHES])
+def test_watermark(layers, kind, min_oid, monkeypatch):
+    monkeypatch.setattr(ingest, "BATCH_SIZE", 500)
+    crashes = read_crashes(layers[1][kind])
+    new_crashes = read_crashes(layers[1][kind], min_oid)
+    expected = crashes[crashes["OID@"] > min_oid]
+    for field in FIELDS:
+        np.testing.assert_array_equal(new_crashes[field], expected[field])
+
+
+def test_points_in_the_road_coordinate_system(layers):
+    frame, paths = layers
+    crashes = read_crashes(paths["parquet"], spatial_reference=geo.CRS("EPSG:3857"))
+    projected = frame.to_crs("EPSG:3857").geometry
+    np.testing.assert_allclose(crashes["SHAPE@XY"], np.column_stack([projected.x, projected.y]))
+
+
+def test_multipart_roads_are_split_at_the_parts(tmp_path):
+    shapely = pytest.importorskip("shapely")
+    roads = gpd.GeoDataFrame(geometry=[shapely.LineString([(0, 0), (10, 0)]),
+                                       shapely.MultiLineString([[(0, 5), (3, 5)], [(7, 5), (10, 5), (10, 8)]])],
+                             crs="EPSG:26915")
+    path = str(tmp_path / "roads.gpkg")
+    roads.to_file(path, layer="roads")
+    road_oids, vertex_ids, vertices = geo.GeoPandasBackend("unused.gpkg").read_road_vertices(path + "|roads")
+    np.testing.assert_array_equal(road_oids, [1, 2])
+    np.testing.assert_array_equal(vertex_ids, [0, 0, 1, 1, 1, 1, 1, 1])
+    assert np.isnan(vertices[4]).all() and np.isfinite(np.delete(vertices, 4, axis=0)).all()
+
+
+def test_crash_layer_without_coordinate_system(layers, tmp_path):
+    path = str(tmp_path / "crashes.parquet")
+    layers[0].set_crs(None, allow_override=True).to_parquet(path)
+    with pytest.raises(ValueError, match="no coordinate system"):
+        read_crashes(path, spatial_reference=geo.CRS("EPSG:26915"))
+
+
+@pytest.mark.parametrize("extension", [".parquet", ".gpkg"])
+def test_null_report_types_stay_null(layers, tmp_path, extension):
+    frame = layers[0].head(4).copy()
+    frame["REPORT"] = ["Fatal", None, "None", None]
+    path = str(tmp_path / ("crashes" + extension))
+    if extension == ".parquet":
+        frame.to_parquet(path)
+    else:
+        frame.to_file(path, layer="crashes")
+        path += "|crashes"
+    report_types = read_crashes(path)["REPORT"]
+    assert report_types[1] is None and report_types[3] is None
+    np.testing.assert_array_equal(attributes.get_fatal_flag(report_types, "None"), [0, 0, 1, 0])
+    categories = attributes.parse_categories(["None", "Fatal"], "REPORT")
+    np.testing.assert_array_equal(attributes.get_category_flags({"REPORT": report_types}, categories),
+                                  [[0, 1], [0, 0], [1, 0], [0, 0]])
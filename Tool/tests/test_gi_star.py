@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Gi* of the NumPy engine against stored reference values.
+
+The reference z-scores and p-values come from PySAL esda G_Local(star=True) with binary
+distance band weights (libpysal DistanceBand, threshold 1.5, transform "B"), the same
+statistic as arcpy.stats.HotSpots with FIXED_DISTANCE_BAND; the p-values are two tailed.
+"""
+import numpy as np
+from scipy import stats
+
+from road_hotspot import gi_star
+
+# 6 x 6 grid with a small deterministic offset, a cluster of high values in the middle
+INDEX = np.arange(36)
+POINTS = np.column_stack([INDEX % 6 + 0.1 * np.sin(INDEX), INDEX // 6 + 0.1 * np.cos(3 * INDEX)])
+VALUES = np.array([3, 0, 1, 4, 2, 0, 1, 5, 7, 2, 0, 1, 0, 6, 9, 8, 1, 0,
+                   2, 4, 7, 3, 0, 0, 1, 0, 2, 1, 0, 1, 0, 0, 1, 0, 2, 0], dtype=float)
+DISTANCE_BAND = 1.5
+
+REFERENCE_Z = np.array([
+    0.1609447548, 0.1609447548, 1.1633188635, 0.6398253749, -0.5816594317, -1.0806290683, 0.8879875023,
+    2.4332559780, 3.9974919638, 2.3278492021, -0.0750919097, -1.4541485794, 0.1609447548, 3.3791359385,
+    4.8655615063, 2.7784006605, -0.5256433682, -1.8031442384, 0.5118986778, 1.2506227512, 4.0439845165,
+    0.8690199921, -0.6758271877, -1.8031442384, -0.6163677957, -1.0497928203, 0.2433255978, -1.1644867895,
+    -1.7271139241, -1.6286464089, -1.4944870093, -1.4944870093, -1.4541485794, -1.1051529203, -1.4541485794,
+    -1.0806290683])
+REFERENCE_P = np.array([
+    8.7213691249e-01, 8.7213691249e-01, 2.4470015502e-01, 5.2228613378e-01, 5.6079610246e-01, 2.7986214683e-01,
+    3.7454747400e-01, 1.4963717942e-02, 6.4017163637e-05, 1.9920112404e-02, 9.4014158474e-01, 1.4590511758e-01,
+    8.7213691249e-01, 7.2714043698e-04, 1.1413230942e-06, 5.4627213871e-03, 5.9913601845e-01, 7.1365565089e-02,
+    6.0872192359e-01, 2.1107214601e-01, 5.2550391201e-05, 3.8483619588e-01, 4.9915037092e-01, 7.1365565089e-02,
+    5.3765180308e-01, 2.9381337693e-01, 8.0775317601e-01, 2.4422679391e-01, 8.4147205392e-02, 1.0338789375e-01,
+    1.3504837482e-01, 1.3504837482e-01, 1.4590511758e-01, 2.6909333296e-01, 1.4590511758e-01, 2.7986214683e-01])
+
+
+def test_gi_star_matches_reference():
+    weights = gi_star.build_weights(POINTS, DISTANCE_BAND)
+    z_scores, p_values = gi_star.gi_star(VALUES, weights)
+    np.testing.assert_allclose(z_scores, REFERENCE_Z, atol=1e-9)
+    np.testing.assert_allclose(p_values, REFERENCE_P, rtol=1e-8, atol=1e-12)
+
+
+def test_gi_star_fields_at_once():
+    # Every column of a (n, k) array gives the z-scores of that field alone
+    weights = gi_star.build_weights(POINTS, DISTANCE_BAND)
+    values = np.column_stack([VALUES, VALUES[::-1], VALUES ** 2])
+    z_scores, p_values = gi_star.gi_star(values, weights)
+    for column in range(values.shape[1]):
+        z_column, p_column = gi_star.gi_star(values[:, column], weights)
+        np.testing.assert_allclose(z_scores[:, column], z_column)
+        np.testing.assert_allclose(p_values[:, column], p_column)
+
+
+def test_fdr_threshold_matches_benjamini_hochberg():
+    p_values = np.random.default_rng(7).uniform(0, 0.2, 200) ** 2
+    for alpha in (0.10, 0.05, 0.01):
+        threshold = gi_star.get_fdr_threshold(p_values, alpha)
+        significant = stats.false_discovery_control(p_values, method="bh") <= alpha
+        np.testing.assert_array_equal(p_values <= threshold, significant)
+
+
+def test_fdr_threshold_shapes():
+    assert gi_star.get_fdr_threshold(np.array([0.5, 0.9]), 0.05) == 0.0
+    p_values = np.column_stack([REFERENCE_P, np.full(36, 0.5)])
+    threshold = gi_star.get_fdr_threshold(p_values, 0.05)
+    assert threshold.shape == (2,)
+    assert threshold[0] == gi_star.get_fdr_threshold(REFERENCE_P, 0.05)
+    assert threshold[1] == 0.0
+
+
+def test_gi_bin_levels():
+    z_scores = np.array([3.0, 2.0, 1.7, 0.5, -1.7, -2.0, -3.0])
+    p_values = np.array([0.001, 0.04, 0.09, 0.6, 0.09, 0.04, 0.001])
+    np.testing.assert_array_equal(gi_star.get_gi_bin(z_scores, p_values), [3, 2, 1, 0, -1, -2, -3])
+
+
+def test_gi_bin_fdr_is_stricter():
+    bins = gi_star.get_gi_bin(REFERENCE_Z, REFERENCE_P)
+    fdr_bins = gi_star.get_gi_bin(REFERENCE_Z, REFERENCE_P, fdr=True)
+    assert np.all(np.abs(fdr_bins) <= np.abs(bins))
+    assert np.all(fdr_bins * bins >= 0)
+    # The two strongest hot spots stay significant at 99 percent
+    assert fdr_bins[14] == 3 and fdr_bins[20] == 3
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Append mode: a run over the crashes added since the last run gives the results of a full run.
+"""
+import numpy as np
+
+import synthetic
+from road_hotspot import pipeline
+
+N_CRASHES = 6000
+OUTPUT = "Crash_hotspots"
+
+
+class GrowingBackend(synthetic.SyntheticBackend):
+    """Synthetic backend that only shows the first crashes, like a crash table between two nightly loads."""
+
+    n_visible = N_CRASHES
+
+    def iter_crash_batches(self, crashes, fields, min_oid=None, spatial_reference=None):
+        for batch in super().iter_crash_batches(crashes, fields, min_oid, spatial_reference):
+            yield batch[batch["OID@"] <= self.n_visible]
+
+
+def get_backend(workspace):
+    network = synthetic.get_network("grid", 800, seed=3)
+    return GrowingBackend(str(workspace), network, synthetic.CrashGenerator(network, N_CRASHES, "clustered", seed=3))
+
+
+def run(backend, append_mode):
+    pipeline.run(backend, "crashes", backend.DATE_FIELD, "roads", OUTPUT, "month", fatalities=True,
+                 fatalities_output="Fatalities_hotspots", report_type_field=backend.REPORT_TYPE_FIELD,
+                 fatalities_name="Fatal", max_distance="30", units="Meters", append_mode=append_mode)
+    return backend.outputs[OUTPUT]
+
+
+def test_append_matches_full_run(tmp_path):
+    full = run(get_backend(tmp_path / "full" / "ws"), append_mode=False)
+
+    backend = get_backend(tmp_path / "append" / "ws")
+    backend.n_visible = 4000
+    first = run(backend, append_mode=True)
+    assert first["Join_Count"].sum() < full["Join_Count"].sum()
+    backend.n_visible = N_CRASHES
+    appended = run(backend, append_mode=True)
+
+    assert "2000 new crash points assigned to the road segments." in backend.messages
+    for field in ("Join_Count", "tot_fata"):
+        np.testing.assert_array_equal(appended[field], full[field])
+    for field in ("Avg_crash_yr", "Avg_fata_yr", "GiZScore", "GiPValue"):
+        np.testing.assert_allclose(appended[field], full[field], rtol=1e-12, atol=1e-12)
+    np.testing.assert_array_equal(appended["Gi_Bin"], full["Gi_Bin"])
+
+
+def test_append_without_new_crashes(tmp_path):
+    backend = get_backend(tmp_path / "ws")
+    first = run(backend, append_mode=True)
+    again = run(backend, append_mode=True)
+    assert "0 new crash points assigned to the road segments." in backend.messages
+    np.testing.assert_array_equal(again["Join_Count"], first["Join_Count"])
+    np.testing.assert_allclose(again["GiZScore"], first["GiZScore"])
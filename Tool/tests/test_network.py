@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Network neighborhoods: the distances of the index are the shortest paths along the roads.
+"""
+import os
+
+import numpy as np
+import pytest
+from scipy import sparse
+from scipy.sparse import csgraph
+
+import synthetic
+from road_hotspot import network
+
+BAND = 350.0
+
+
+@pytest.fixture(scope="module")
+def roads():
+    return synthetic.get_network("organic", 1500, seed=1)
+
+
+@pytest.fixture(scope="module")
+def graph(roads):
+    return network.RoadGraph(roads.vertex_ids, roads.vertices, roads.n_segments)
+
+
+def get_brute_force(graph):
+    # Dijkstra between all the nodes, then half of each segment from its nearest end
+    # Shortest of the parallel edges, a sparse matrix would sum them
+    edges = np.full((graph.n_nodes, graph.n_nodes), np.inf)
+    for start, end, length in zip(graph.start, graph.end, graph.lengths):
+        edges[start, end] = edges[end, start] = min(edges[start, end], length)
+    nodes = csgraph.dijkstra(sparse.csr_matrix(np.where(np.isinf(edges), 0.0, edges)), directed=False)
+    half = graph.lengths / 2
+    distances = np.full((len(half), len(half)), np.inf)
+    for source_end in (graph.start, graph.end):
+        for target_end in (graph.start, graph.end):
+            distances = np.minimum(distances, half[:, None] + nodes[source_end][:, target_end] + half[None, :])
+    np.fill_diagonal(distances, np.inf)
+    return distances
+
+
+def test_index_matches_dijkstra(graph):
+    index = network.build_index(graph, BAND, chunk_size=400)
+    distances = get_brute_force(graph)
+    expected = distances <= BAND
+    assert index.nnz == expected.sum()
+    rows = np.repeat(np.arange(index.shape[0]), np.diff(index.indptr))
+    assert expected[rows, index.indices].all()
+    np.testing.assert_allclose(index.data, distances[rows, index.indices], rtol=1e-12)
+
+
+def test_threshold_matches_a_smaller_search(graph):
+    index = network.build_index(graph, 2 * BAND)
+    weights = network.threshold_index(index, BAND)
+    assert (weights != network.build_weights(graph, BAND)).nnz == 0
+    np.testing.assert_array_equal(weights.diagonal(), 1.0)
+
+
+def test_workers_build_the_same_index(graph):
+    index = network.build_index(graph, BAND, chunk_size=300)
+    parallel = network.build_index(graph, BAND, workers=3, chunk_size=300)
+    np.testing.assert_array_equal(index.indptr, parallel.indptr)
+    np.testing.assert_array_equal(index.indices, parallel.indices)
+    np.testing.assert_array_equal(index.data, parallel.data)
+
+
+def test_index_is_reused_for_smaller_bands(roads, tmp_path):
+    arguments = (roads.oids, roads.vertex_ids, roads.vertices)
+    weights = network.get_weights(*arguments, BAND, str(tmp_path))
+    entries = os.listdir(str(tmp_path))
+    assert len(entries) == 1
+
+    # A smaller band is thresholded from the stored index, a wider one than the index rebuilds it
+    graph = network.RoadGraph(*arguments[1:], roads.n_segments)
+    smaller = network.get_weights(*arguments, BAND / 2, str(tmp_path))
+    assert (smaller != network.build_weights(graph, BAND / 2)).nnz == 0
+    assert (network.get_weights(*arguments, BAND, str(tmp_path)) != weights).nnz == 0
+    wider = network.get_weights(*arguments, BAND * network.INDEX_BAND_FACTOR * 1.5, str(tmp_path))
+    assert os.listdir(str(tmp_path)) == entries
+    assert network.load_index(str(tmp_path), entries[0][:-4])[1] > BAND * network.INDEX_BAND_FACTOR
+    assert wider.nnz > weights.nnz
+
+
+def test_multipart_length_skips_the_gap():
+    vertices = np.array([[0.0, 0.0], [3.0, 0.0], [np.nan, np.nan], [7.0, 0.0], [10.0, 0.0], [10.0, 4.0]])
+    graph = network.RoadGraph([0, 0, 0, 0, 0, 1], vertices, 2)
+    np.testing.assert_allclose(graph.lengths, [6.0, 0.0])
+    assert graph.start[0] != graph.end[0]
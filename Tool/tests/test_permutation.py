@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Permutation inference: pseudo p-values of a brute-force simulation, independent of the workers and memory ceiling.
+"""
+import numpy as np
+import pytest
+
+from road_hotspot import gi_star, permutation
+
+N_SEGMENTS = 80
+
+
+@pytest.fixture(scope="module")
+def inputs():
+    rng = np.random.default_rng(21)
+    points = rng.random((N_SEGMENTS, 2)) * 1000
+    points[-1] = [5000.0, 5000.0]  # A segment without neighbors
+    values = rng.gamma(1.0, 2.0, (N_SEGMENTS, 2))
+    values[np.argsort(np.hypot(*(points - 500).T))[:8], 0] += 6.0  # A cluster of high values
+    return values, gi_star.build_weights(points, 220.0)
+
+
+def brute_force_p_values(values, weights, permutations, seed):
+    # Conditional randomization one segment at a time: own value fixed, k - 1 others drawn without replacement
+    rng = np.random.default_rng(seed)
+    p_values = np.ones(len(values))
+    for row in range(len(values)):
+        neighbors = weights.indices[weights.indptr[row]:weights.indptr[row + 1]]
+        if len(neighbors) <= 1:
+            continue
+        others = np.delete(values, row)
+        draws = np.argsort(rng.random((permutations, len(others))), axis=1)[:, :len(neighbors) - 1]
+        simulated = others[draws].sum(axis=1) + values[row]
+        observed = values[neighbors].sum()
+        extreme = min(np.sum(simulated >= observed), np.sum(simulated <= observed))
+        p_values[row] = min(2 * (extreme + 1) / (permutations + 1), 1.0)
+    return p_values
+
+
+def test_pseudo_p_values_match_a_simulation(inputs):
+    values, weights = inputs
+    permutations = 2999
+    p_values = permutation.get_pseudo_p_values(values[:, 0], weights, permutations=permutations)
+    expected = brute_force_p_values(values[:, 0], weights, permutations, seed=3)
+    # Two Monte Carlo estimates of the same p-value, within 4 standard errors of their difference
+    tail = (p_values + expected) / 4
+    standard_error = 2 * np.sqrt(2 * tail * (1 - tail) / permutations)
+    assert (np.abs(p_values - expected) <= 4 * standard_error + 2 / (permutations + 1)).all()
+    assert np.sum(p_values < 0.05) == pytest.approx(np.sum(expected < 0.05), abs=2)
+
+
+def test_same_results_for_any_workers_and_memory_ceiling(inputs):
+    values, weights = inputs
+    single = permutation.get_pseudo_p_values(values, weights, permutations=1500, seed=8)
+    assert single.shape == values.shape
+    for workers, max_bytes in ((2, permutation.MAX_BLOCK_BYTES), (1, 4096), (3, 4096)):
+        other = permutation.get_pseudo_p_values(values, weights, permutations=1500, seed=8, workers=workers,
+                                                max_bytes=max_bytes)
+        np.testing.assert_array_equal(other, single)
+
+
+@pytest.mark.parametrize("permutations", [9, 99, 999])
+def test_p_values_are_bounded(inputs, permutations):
+    values, weights = inputs
+    p_values = permutation.get_pseudo_p_values(values, weights, permutations=permutations)
+    assert (p_values >= 1 / (permutations + 1)).all() and (p_values <= 1).all()
+    assert (p_values[-1] == 1).all()  # No neighbors
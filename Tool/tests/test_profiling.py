@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Run profile: stage records, JSON and CSV files, and the optional cProfile dumps.
+"""
+import csv
+import json
+import os
+
+from road_hotspot import profiling
+
+
+def run_stages(run_profile):
+    with run_profile.stage("join") as record:
+        with run_profile.stage("snap", rows=10):
+            sum(range(1000))
+        record["rows"] = 25
+    with run_profile.stage("hotspot_crashes"):
+        pass
+
+
+def test_stage_records(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    run_profile = profiling.RunProfile()
+    run_stages(run_profile)
+    # The inner stages end first
+    assert [(record["stage"], record["depth"], record["rows"]) for record in run_profile.stages] == [
+        ("snap", 1, 10), ("join", 0, 25), ("hotspot_crashes", 0, None)]
+    for record in run_profile.stages:
+        assert set(record) == set(profiling.FIELDS)
+        assert record["wall_s"] >= 0 and record["cpu_s"] >= 0
+    wall, cpu = run_profile.get_total()
+    assert wall == sum(record["wall_s"] for record in run_profile.stages[1:])
+    assert cpu == sum(record["cpu_s"] for record in run_profile.stages[1:])
+    assert not os.listdir(str(tmp_path))  # No cProfile dumps unless they are requested
+
+
+def test_profile_files(tmp_path):
+    run_profile = profiling.RunProfile()
+    run_stages(run_profile)
+    json_path, csv_path = run_profile.write(str(tmp_path / profiling.PROFILE_NAME))
+
+    with open(json_path) as json_file:
+        profile = json.load(json_file)
+    assert profile["stages"] == run_profile.stages
+    assert profile["wall_s"] == round(run_profile.get_total()[0], 4)
+    with open(csv_path, newline="") as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    assert list(rows[0]) == profiling.FIELDS
+    assert [row["stage"] for row in rows] == ["snap", "join", "hotspot_crashes"]
+    assert [row["rows"] for row in rows] == ["10", "25", ""]
+
+
+def test_cprofile_dumps(tmp_path):
+    cprofile_dir = tmp_path / "cprofile"
+    run_profile = profiling.RunProfile(str(cprofile_dir))
+    run_stages(run_profile)
+    # The nested stage shares the dump of its outer stage
+    assert sorted(os.listdir(str(cprofile_dir))) == ["02_join.prof", "03_hotspot_crashes.prof"]
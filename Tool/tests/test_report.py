@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Report figures: cached, copied next to the report, or embedded without writing any file, and the report statistics.
+"""
+import os
+import urllib.parse
+
+import numpy as np
+import pytest
+
+pytest.importorskip("matplotlib")
+
+import synthetic  # noqa: E402
+from road_hotspot import pipeline, report  # noqa: E402
+
+FIGURES = [("crash_by_day", (["Monday", "Tuesday", "Wednesday"], [1.5, 2.0, 0.5]), "Daily", "Crashes"),
+           ("crash_by_year", (["2020", "2021"], [10.0, 12.5]), "Yearly", "Crashes")]
+
+
+def test_inline_without_cache_writes_nothing(tmp_path):
+    plots = report.render_figures(FIGURES, str(tmp_path), inline=True)
+    assert sorted(plots) == ["crash_by_day", "crash_by_year"]
+    assert all(uri.startswith("data:image/png;base64,") for uri in plots.values())
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_files_are_copied_from_the_cache(tmp_path):
+    cache_dir = tmp_path / "cache"
+    plots = report.render_figures(FIGURES, str(tmp_path), str(cache_dir), figure_format="svg")
+    assert plots == {"crash_by_day": "Crashes_Daily.svg", "crash_by_year": "Crashes_Yearly.svg"}
+    assert len(os.listdir(str(cache_dir))) == 2
+    assert (tmp_path / "Crashes_Daily.svg").exists() and (tmp_path / "Crashes_Yearly.svg").exists()
+
+    # Inline figures are read from the cache, without copies in the report folder
+    (tmp_path / "Crashes_Daily.svg").unlink()
+    plots = report.render_figures(FIGURES, str(tmp_path), str(cache_dir), inline=True, figure_format="svg")
+    assert plots["crash_by_day"].startswith("data:image/svg+xml")
+    assert not (tmp_path / "Crashes_Daily.svg").exists()
+
+
+def test_statistics_match_pandas(tmp_path, monkeypatch):
+    pd = pytest.importorskip("pandas")
+
+    collected = []
+
+    class CollectedStatistics(report.ReportStatistics):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            collected.append(self)
+
+    monkeypatch.setattr(report, "ReportStatistics", CollectedStatistics)
+    network = synthetic.get_network("grid", 400, seed=5)
+    crashes = synthetic.CrashGenerator(network, 3000, "clustered", seed=5)
+    backend = synthetic.SyntheticBackend(str(tmp_path / "ws"), network, crashes)
+    (tmp_path / "report").mkdir()
+    pipeline.run(backend, "crashes", backend.DATE_FIELD, "roads", "Crash_hotspots", "year", fatalities=True,
+                 fatalities_output="Fatalities_hotspots", report_type_field=backend.REPORT_TYPE_FIELD,
+                 fatalities_name="Fatal", max_distance="30", units="Kilometers", report_path=str(tmp_path / "report"))
+    statistics = collected[0]
+
+    _, _, dates, report_types = crashes.get_batch(0, 3000)
+    frame = pd.DataFrame({"date": pd.to_datetime(dates), "fatal": (report_types == "Fatal").astype(int)})
+    weekday = frame.groupby(frame["date"].dt.day_name())
+    year = frame.groupby(frame["date"].dt.year)
+    (days, daily), (years, yearly) = statistics.get_mean_incidents()
+    assert daily == weekday.size().reindex(days).astype(float).tolist()
+    assert years == [str(value) for value in year.size().index]
+    assert yearly == year.size().astype(float).tolist()
+    (_, daily_fatal), (_, yearly_fatal) = statistics.get_mean_incidents(fatalities=True)
+    np.testing.assert_allclose(daily_fatal, weekday["fatal"].mean().reindex(days))
+    np.testing.assert_allclose(yearly_fatal, year["fatal"].mean())
+
+    assert statistics.units == "Kilometers"
+    assert statistics.road_length == pytest.approx(network.lengths.sum() / 1000)
+    assert statistics.total_roads == network.n_segments
+    hotspots = backend.outputs["Crash_hotspots"]
+    assert statistics.segments_with_crashes == np.count_nonzero(hotspots["Join_Count"])
+    assert statistics.hot_spots == np.count_nonzero(hotspots["Gi_Bin"] > 0)
+
+
+def test_year_axis_is_numeric(tmp_path, caplog):
+    caplog.set_level("INFO", logger="matplotlib")
+    report.render_figure(["2019", "2020", "2021", "2022"], [3.0, 4.5, 4.0, 6.0], "Yearly", "Crashes",
+                         str(tmp_path / "yearly.svg"), figure_format="svg")
+    assert not [record for record in caplog.records if "categorical units" in record.getMessage()]
+    text = (tmp_path / "yearly.svg").read_text(encoding="utf-8")
+    assert ">2020<" in text and "2020.5" not in text  # Integer ticks only
+
+
+def test_inline_svg_is_minified(tmp_path):
+    report.render_figure(*FIGURES[0][1], "Daily", "Crashes", str(tmp_path / "daily.svg"), figure_format="svg")
+    uri = report.get_data_uri(str(tmp_path / "daily.svg"), "svg")
+    text = urllib.parse.unquote(uri.split(",", 1)[1])
+    assert text.startswith("<?xml") and text.endswith("</svg>")
+    assert "<metadata>" not in text and ">\n" not in text
+    assert "Crashes by Daily" in text
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Crash assignment: the grid index finds the nearest segment of a brute-force search over every piece.
+"""
+import numpy as np
+import pytest
+
+from road_hotspot import snapping
+
+TOLERANCE = 20.0
+
+
+def get_roads():
+    # Short pieces on a jittered grid, one long diagonal piece and a multipart segment with a gap
+    rng = np.random.default_rng(4)
+    vertex_ids, vertices = [], []
+    for segment in range(300):
+        start = rng.random(2) * 2000
+        vertex_ids += [segment] * 3
+        vertices += [start, start + rng.normal(0, 25, 2), start + rng.normal(0, 50, 2)]
+    vertex_ids += [300, 300]
+    vertices += [[0.0, 0.0], [2000.0, 1900.0]]
+    vertex_ids += [301] * 5
+    vertices += [[100.0, 1000.0], [300.0, 1000.0], [np.nan, np.nan], [700.0, 1000.0], [900.0, 1000.0]]
+    return np.array(vertex_ids), np.array(vertices)
+
+
+def brute_force(vertex_ids, vertices, points):
+    starts, ends, segment_ids = snapping.get_pieces(vertex_ids, vertices)
+    distances = np.stack([snapping.point_segment_distance(points, np.broadcast_to(start, points.shape),
+                                                          np.broadcast_to(end, points.shape))
+                          for start, end in zip(starts, ends)], axis=1)
+    nearest = distances.argmin(axis=1)
+    distance = distances[np.arange(len(points)), nearest]
+    return np.where(distance <= TOLERANCE, segment_ids[nearest], -1), distance
+
+
+def test_pieces_stop_at_the_part_gaps():
+    vertex_ids, vertices = get_roads()
+    starts, ends, segment_ids = snapping.get_pieces(vertex_ids, vertices)
+    assert (segment_ids == 301).sum() == 2
+    assert np.isfinite(starts).all() and np.isfinite(ends).all()
+
+
+def test_nearest_matches_brute_force():
+    vertex_ids, vertices = get_roads()
+    rng = np.random.default_rng(5)
+    # Random points, points near the long diagonal and points in the gap of the multipart segment
+    along = rng.random(2000)[:, None]
+    points = np.concatenate([rng.random((5000, 2)) * 2000,
+                             along * [2000.0, 1900.0] + rng.normal(0, 10, (2000, 2)),
+                             np.column_stack([rng.uniform(320, 680, 500), 1000 + rng.normal(0, 5, 500)])])
+    index = snapping.build_index(vertex_ids, vertices, TOLERANCE)
+    segment, distance = index.nearest(points, TOLERANCE)
+    expected, expected_distance = brute_force(vertex_ids, vertices, points)
+
+    np.testing.assert_array_equal(segment >= 0, expected >= 0)
+    np.testing.assert_allclose(distance[segment >= 0], expected_distance[segment >= 0], atol=1e-9)
+    np.testing.assert_array_equal(segment, expected)
+    assert not (segment[-500:] == 301).any()  # Nothing snaps to the gap between the parts
+
+
+@pytest.mark.parametrize("cell_size", [1.0, 25.0])
+def test_long_pieces_only_cover_their_path(cell_size):
+    index = snapping.SegmentIndex([[0.0, 0.0]], [[10000.0, 10000.0]], [0], cell_size)
+    n_steps = int(np.ceil(np.hypot(10000.0, 10000.0) / cell_size))
+    # Every part of the piece covers at most 2 x 2 cells, not the 10000 / cell_size squared of its bounding box
+    assert len(index.cell_pieces) <= 4 * n_steps
+    segment, _ = index.nearest(np.array([[5000.0, 5000.5], [9999.0, 9999.0], [5000.0, 7000.0]]), cell_size)
+    np.testing.assert_array_equal(segment, [0, 0, -1])
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Space-time mode: the period counts of the batches add up to the counts of all the crashes at once, the period
+table is written in chunks, and the Mann-Kendall trends and patterns match their references.
+"""
+import numpy as np
+import pytest
+from scipy import stats
+from scipy.special import ndtr
+
+from road_hotspot import gi_star, space_time
+
+N_SEGMENTS = 50
+
+
+def get_crashes(n_crashes, seed):
+    rng = np.random.default_rng(seed)
+    segment = rng.integers(-1, N_SEGMENTS, n_crashes)
+    dates = np.datetime64("2019-01-01") + rng.integers(0, 1500, n_crashes).astype("timedelta64[D]")
+    dates[rng.random(n_crashes) < 0.05] = np.datetime64("NaT")
+    return segment, dates
+
+
+def get_expected(segment, dates):
+    # Dense segments x months table of the valid crashes
+    valid = (segment >= 0) & ~np.isnat(dates)
+    months = dates[valid].astype("datetime64[M]").astype(np.int64)
+    expected = np.zeros((N_SEGMENTS, months.max() - months.min() + 1), dtype=np.int32)
+    np.add.at(expected, (segment[valid], months - months.min()), 1)
+    return expected, months.min()
+
+
+def test_batches_match_one_pass():
+    segment, dates = get_crashes(5000, seed=2)
+    # Later batches widen the table on both sides
+    order = np.argsort(np.abs(dates.astype("datetime64[D]").astype(np.int64) - 18600))
+    period_counts = space_time.PeriodCounts(N_SEGMENTS, "month")
+    for batch in np.array_split(order, 7):
+        period_counts.update(segment[batch], dates[batch])
+
+    expected, first_month = get_expected(segment, dates)
+    np.testing.assert_array_equal(period_counts.counts, expected)
+    assert period_counts.get_periods()[0] == np.datetime64(int(first_month), "M").astype("datetime64[us]")
+
+
+def test_batch_without_valid_crashes():
+    period_counts = space_time.PeriodCounts(N_SEGMENTS, "week")
+    period_counts.update(np.array([-1, 3]), np.array(["2020-01-01", "NaT"], dtype="datetime64[us]"))
+    assert period_counts.counts.shape == (N_SEGMENTS, 0)
+    assert len(period_counts.get_periods()) == 0
+
+
+def test_period_table_is_written_in_chunks():
+    rng = np.random.default_rng(4)
+    points = rng.random((N_SEGMENTS, 2)) * 1000
+    counts = rng.poisson(1.0, (N_SEGMENTS, 8)).astype(np.int32)
+    lengths = rng.random(N_SEGMENTS) + 0.5
+    source_ids = np.arange(1, N_SEGMENTS + 1)
+    periods = np.arange(np.datetime64("2020-01"), np.datetime64("2020-09")).astype("datetime64[us]")
+    weights = gi_star.build_weights(points, 300.0)
+    patterns, period_chunks = space_time.get_space_time(counts, lengths, weights, source_ids, periods, chunk_size=3)
+    chunks = list(period_chunks)
+    assert [len(chunk) for chunk in chunks] == [N_SEGMENTS * 3, N_SEGMENTS * 3, N_SEGMENTS * 2]
+
+    period_rows = np.concatenate(chunks)
+    rates = counts / lengths[:, None]
+    z_scores, p_values = space_time.period_gi_star(rates, weights)
+    row = np.searchsorted(source_ids, period_rows["SOURCE_ID"])
+    column = np.searchsorted(periods, period_rows["PERIOD"])
+    assert len(np.unique(row * 8 + column)) == counts.size
+    np.testing.assert_array_equal(period_rows["Join_Count"], counts[row, column])
+    np.testing.assert_allclose(period_rows["Avg_crash"], rates[row, column])
+    np.testing.assert_allclose(period_rows["GiZScore"], z_scores[row, column])
+    np.testing.assert_array_equal(period_rows["Gi_Bin"], gi_star.get_gi_bin(z_scores, p_values)[row, column])
+    assert (patterns["N_PERIODS"] == 8).all()
+
+
+def test_period_table_without_periods():
+    weights = gi_star.build_weights(np.random.default_rng(4).random((N_SEGMENTS, 2)), 0.3)
+    period_chunks = space_time.get_space_time(np.zeros((N_SEGMENTS, 0), dtype=np.int32), np.ones(N_SEGMENTS), weights,
+                                              np.arange(N_SEGMENTS), np.zeros(0, dtype="datetime64[us]"))[1]
+    assert [len(chunk) for chunk in period_chunks] == [0]
+
+
+def test_mann_kendall_matches_the_reference():
+    # A rising series: S = 10, variance 5 * 4 * 15 / 18, with the continuity correction
+    z_scores, p_values = space_time.mann_kendall(np.array([[1.0, 2.0, 3.0, 4.0, 5.0]]))
+    assert z_scores[0] == pytest.approx(9 / np.sqrt(50 / 3))
+    assert p_values[0] == pytest.approx(2 * ndtr(-9 / np.sqrt(50 / 3)))
+
+    rng = np.random.default_rng(6)
+    series = np.concatenate([rng.normal(0, 1, (20, 12)) + np.arange(12) * rng.normal(0, 0.3, (20, 1)),
+                             rng.integers(0, 3, (20, 12)).astype(float)])  # With ties
+    z_scores, p_values = space_time.mann_kendall(series)
+    t = series.shape[1]
+    for row, values in enumerate(series):
+        s = sum(np.sign(values[j] - values[i]) for i in range(t) for j in range(i + 1, t))
+        _, sizes = np.unique(values, return_counts=True)
+        variance = (t * (t - 1) * (2 * t + 5) - np.sum(sizes * (sizes - 1) * (2 * sizes + 5))) / 18
+        expected = (s - np.sign(s)) / np.sqrt(variance) if variance > 0 else 0.0
+        assert z_scores[row] == pytest.approx(expected)
+        assert p_values[row] == pytest.approx(2 * ndtr(-abs(expected)))
+        # Same S and tie corrected variance as Kendall's tau against the period index, without the correction
+        if s:
+            assert stats.kendalltau(np.arange(t), values, method="asymptotic").pvalue == \
+                pytest.approx(2 * ndtr(-abs(s) / np.sqrt(variance)))
+
+
+def test_one_series_per_pattern():
+    quiet = [0] * 7
+    examples = [
+        ([3] * 9 + [0], 0.0, 1.0, "Historical Hot Spot"),
+        ([-2] + quiet + [2, 3], 0.0, 1.0, "Oscillating Hot Spot"),
+        ([0, 2] + quiet + [2], 0.0, 1.0, "Sporadic Hot Spot"),
+        (quiet + [1, 2, 3], 0.0, 1.0, "Consecutive Hot Spot"),
+        (quiet + [0, 0, 3], 0.0, 1.0, "New Hot Spot"),
+        ([3] * 10, 0.5, 0.6, "Persistent Hot Spot"),
+        ([3] * 10, 2.5, 0.01, "Intensifying Hot Spot"),
+        ([3] * 10, -2.5, 0.01, "Diminishing Hot Spot"),
+        ([-3] * 9 + [0], 0.0, 1.0, "Historical Cold Spot"),
+        ([2] + quiet + [-2, -3], 0.0, 1.0, "Oscillating Cold Spot"),
+        ([0, -2] + quiet + [-2], 0.0, 1.0, "Sporadic Cold Spot"),
+        (quiet + [-1, -2, -3], 0.0, 1.0, "Consecutive Cold Spot"),
+        (quiet + [0, 0, -3], 0.0, 1.0, "New Cold Spot"),
+        ([-3] * 10, -0.5, 0.6, "Persistent Cold Spot"),
+        ([-3] * 10, -2.5, 0.01, "Intensifying Cold Spot"),
+        ([-3] * 10, 2.5, 0.01, "Diminishing Cold Spot"),
+        ([0] * 10, 0.0, 1.0, space_time.NO_PATTERN),
+    ]
+    bins = np.array([example[0] for example in examples])
+    trend_z = np.array([example[1] for example in examples])
+    trend_p = np.array([example[2] for example in examples])
+    patterns = space_time.get_patterns(bins, trend_z, trend_p)
+    assert patterns.tolist() == [example[3] for example in examples]
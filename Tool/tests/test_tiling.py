@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Tiled runs: the crash assignment and Gi* of the worker processes are identical to a single process run.
+"""
+import numpy as np
+import pytest
+
+import synthetic
+from road_hotspot import batch, pipeline, tiling
+
+BATCH_ROWS = 1500
+
+
+@pytest.fixture(scope="module")
+def network():
+    return synthetic.get_network("grid", 3000, seed=7)
+
+
+@pytest.mark.parametrize("workers", [2, 4])
+def test_tiled_gi_star_is_identical(network, workers):
+    rng = np.random.default_rng(7)
+    rates = rng.poisson(1.5, (network.n_segments, 2)).astype(float)
+    assert tiling.check_tiled(network.get_centroids(), rates, 350.0, workers)
+
+
+@pytest.mark.parametrize("workers", [2, 4])
+def test_tiled_assignment_is_identical(network, workers):
+    _, points, _, _ = synthetic.CrashGenerator(network, 20000, "clustered", seed=7).get_batch(0, 20000)
+    assert tiling.check_tiled_assign(network.vertex_ids, network.vertices, points, 25.0, network.n_segments,
+                                     workers)
+
+
+class SmallBatchBackend(synthetic.SyntheticBackend):
+    """Synthetic backend that reads the crashes in several small batches."""
+
+    def iter_crash_batches(self, crashes, fields, min_oid=None, spatial_reference=None):
+        for crash_batch in super().iter_crash_batches(crashes, fields, min_oid, spatial_reference):
+            for start in range(0, len(crash_batch), BATCH_ROWS):
+                yield crash_batch[start:start + BATCH_ROWS]
+
+
+class CountingExecutor(tiling.ProcessPoolExecutor):
+    started = 0
+
+    def __init__(self, *args, **kwargs):
+        CountingExecutor.started += 1
+        super().__init__(*args, **kwargs)
+
+
+def test_tiled_batches_share_the_workers(network, tmp_path, monkeypatch):
+    monkeypatch.setattr(tiling, "ProcessPoolExecutor", CountingExecutor)
+    backend = SmallBatchBackend(str(tmp_path), network, synthetic.CrashGenerator(network, 8000, "clustered", seed=7))
+    road_vertices = backend.read_road_vertices("roads")
+    single = pipeline.stream_crashes(backend, "crashes", backend.DATE_FIELD, road_vertices=road_vertices,
+                                     tolerance=25.0)
+    tiled = pipeline.stream_crashes(backend, "crashes", backend.DATE_FIELD, road_vertices=road_vertices,
+                                    tolerance=25.0, workers=2)
+    assert CountingExecutor.started == 1
+    assert tiled.crash_count.sum() > 0
+    np.testing.assert_array_equal(tiled.crash_count, single.crash_count)
+
+    segment = batch.assign_crashes(backend, "crashes", "roads", "25 Meters", backend.DATE_FIELD)[1]
+    tiled_segment = batch.assign_crashes(backend, "crashes", "roads", "25 Meters", backend.DATE_FIELD, workers=2)[1]
+    assert CountingExecutor.started == 2
+    np.testing.assert_array_equal(tiled_segment, segment)
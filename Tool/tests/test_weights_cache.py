@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Weights cache: the distance band and the weights are keyed on the road network only.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import synthetic
+from road_hotspot import gi_star, pipeline, weights_cache
+
+
+def run(workspace, network, n_crashes, seed):
+    backend = synthetic.SyntheticBackend(str(workspace), network,
+                                         synthetic.CrashGenerator(network, n_crashes, "clustered", seed=seed))
+    pipeline.run(backend, "crashes", backend.DATE_FIELD, "roads", "Crash_hotspots", "month", max_distance="30",
+                 units="Meters")
+    return sorted(os.listdir(weights_cache.get_cache_dir(str(workspace))))
+
+
+def test_distance_band_is_cached(tmp_path):
+    network = synthetic.get_network("grid", 800, seed=5)
+    points = network.get_centroids()
+    distance_band = weights_cache.get_distance_band(points, network.oids, str(tmp_path))
+    assert distance_band == gi_star.get_distance_band(points, 8)[1]
+    assert weights_cache.get_distance_band(points, network.oids, str(tmp_path)) == distance_band
+    assert weights_cache.get_distance_band(points, network.oids, None) == distance_band
+    assert len(os.listdir(str(tmp_path))) == 1
+
+
+def test_new_crashes_reuse_the_weights(tmp_path):
+    network = synthetic.get_network("grid", 800, seed=5)
+    entries = run(tmp_path / "ws", network, 3000, seed=1)
+    assert len(entries) == 2  # The distance band and the weights matrix
+    assert run(tmp_path / "ws", network, 5000, seed=2) == entries
+
+    moved = synthetic.RoadNetwork(network.vertex_ids, network.vertices + np.array([1.0, 0.0]))
+    assert len(run(tmp_path / "ws", moved, 5000, seed=2)) == 4
+
+
+def test_shared_cache_with_eviction(tmp_path):
+    # Concurrent analyses of a cache that evicts every entry: an evicted entry is a miss, never an error
+    network = synthetic.get_network("grid", 400, seed=5)
+    points = network.get_centroids()
+    bands = [150.0, 200.0, 250.0, 300.0] * 4
+
+    def get_weights(distance_band):
+        return weights_cache.get_weights(points, distance_band, network.oids, str(tmp_path), max_bytes=1)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(get_weights, bands))
+    for distance_band, weights in zip(bands, results):
+        assert (weights != gi_star.build_weights(points, distance_band)).nnz == 0
+    assert not [name for name in os.listdir(str(tmp_path)) if name.endswith(weights_cache.TEMP_SUFFIX)]
+
+
+def test_eviction_skips_the_entries_being_written(tmp_path):
+    (tmp_path / ("partial" + weights_cache.TEMP_SUFFIX)).write_bytes(b"0" * 100)
+    (tmp_path / "old.npz").write_bytes(b"0" * 100)
+    assert weights_cache.evict(str(tmp_path), max_bytes=10) == 1
+    assert os.listdir(str(tmp_path)) == ["partial" + weights_cache.TEMP_SUFFIX]
+    assert weights_cache.load_weights(str(tmp_path), "old") is None
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the hotspot pipeline on synthetic road networks and crashes.
+
+Every run times the pipeline stages with profiling.RunProfile and appends one line to
+benchmarks/results/history.jsonl with the git commit, the stage timings, the crash
+throughput and the peak memory, so runs of different commits can be compared with
+--history. The Gi* stability check (--check) runs a fixed scenario serially and in tiles and
+compares the z-scores and bins with the stored reference.
+
+    python benchmarks/run.py --scale small
+    python benchmarks/run.py --network organic --crashes clustered --segments 200000 --n-crashes 10000000
+    python benchmarks/run.py --check
+    python benchmarks/run.py --history
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARK_DIR), "Tool"))
+
+from road_hotspot import ingest, pipeline, profiling  # noqa: E402
+import synthetic  # noqa: E402
+
+HISTORY_PATH = os.path.join(BENCHMARK_DIR, "results", "history.jsonl")
+REFERENCE_PATH = os.path.join(BENCHMARK_DIR, "reference", "gi_star_reference.npz")
+CRASH_OUTPUT = "Crash_hotspots"
+
+# Segments and crashes of the preset scales
+SCALES = {
+    "tiny": (2000, 10000),
+    "small": (20000, 200000),
+    "medium": (100000, 2000000),
+    "large": (250000, 10000000),
+    "xlarge": (500000, 30000000),
+}
+
+# Pipeline stages of the ArcGIS tool steps, for reading the results next to the script tool
+STAGES = {
+    "join": "snap_points + prep_roads (snap, spatial join, segment lengths)",
+    "distance_band": "get_distance_band",
+    "rates": "get_avg_crash",
+    "hotspot_fatalities": "hotspot_analysis (fatalities)",
+    "hotspot_crashes": "hotspot_analysis (crashes)",
+    "report_plots": "generate_html_report (plots)",
+    "report_html": "generate_html_report (html)",
+}
+
+# Fixed scenario of the stability check, small enough to run in a few seconds
+CHECK_SCENARIO = {"network": "organic", "crashes": "clustered", "segments": 3000, "n_crashes": 30000, "seed": 42}
+CHECK_RTOL = 1e-9
+CHECK_ATOL = 1e-9
+
+
+def get_commit():
+    """
+    :return: Short hash of the checked out commit, with a + when the tree has changes, None outside of git
+    """
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARK_DIR,
+                                         stderr=subprocess.DEVNULL, text=True).strip()
+        status = subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"],
+                                         cwd=BENCHMARK_DIR, stderr=subprocess.DEVNULL, text=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("+" if status.strip() else "")
+
+
+def get_backend(workspace, network, crashes, segments, n_crashes, seed):
+    """
+    :param workspace: Folder of the sidecar files
+    :param network: Network kind {grid, organic}
+    :param crashes: Crash model {poisson, clustered}
+    :param segments: Approximate number of road segments
+    :param n_crashes: Number of crashes
+    :param seed: Random seed
+    :return: synthetic.SyntheticBackend serving the scenario
+    """
+    road_network = synthetic.get_network(network, segments, seed=seed)
+    generator = synthetic.CrashGenerator(road_network, n_crashes, crashes, seed=seed)
+    return synthetic.SyntheticBackend(workspace, road_network, generator)
+
+
+def run_pipeline(backend, workers=1, report_path="", run_profile=None):
+    """
+    :param backend: synthetic.SyntheticBackend
+    :param workers: Worker processes of the tiled assignment and Gi*
+    :param report_path: Folder of the HTML report, empty to skip it
+    :param run_profile: profiling.RunProfile recording the stages
+    :return: Crash hotspot columns written by the pipeline
+    """
+    pipeline.run(backend, "crashes", backend.DATE_FIELD, "roads", CRASH_OUTPUT, "year", fatalities=True,
+                 fatalities_output="Fatalities_hotspots", report_type_field=backend.REPORT_TYPE_FIELD,
+                 fatalities_name="Fatal", max_distance="30", units="Meters", workers=workers,
+                 report_path=report_path, run_profile=run_profile)
+    return backend.outputs[CRASH_OUTPUT]
+
+
+def benchmark(args):
+    workspace = tempfile.mkdtemp(prefix="hotspot_benchmark_")
+    try:
+        start = time.perf_counter()
+        backend = get_backend(workspace, args.network, args.crashes, args.segments, args.n_crashes, args.seed)
+        setup_s = time.perf_counter() - start
+        report_path = "" if args.no_report else os.path.join(workspace, "report")
+        if report_path:
+            os.makedirs(report_path)
+        run_profile = profiling.RunProfile()
+        hotspots = run_pipeline(backend, args.workers, report_path, run_profile)
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    wall, cpu = run_profile.get_total()
+    n_segments = backend.network.n_segments
+    record = {
+        "commit": get_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scenario": {"network": args.network, "crashes": args.crashes, "segments": n_segments,
+                     "n_crashes": args.n_crashes, "seed": args.seed, "workers": args.workers,
+                     "batch_size": ingest.BATCH_SIZE, "report": not args.no_report},
+        "setup_s": round(setup_s, 4),
+        "wall_s": round(wall, 4),
+        "cpu_s": round(cpu, 4),
+        "crashes_per_s": round(args.n_crashes / wall, 1) if wall else None,
+        "peak_rss_mb": max((stage["peak_rss_mb"] or 0) for stage in run_profile.stages),
+        "hotspots": int((hotspots["Gi_Bin"] > 0).sum()),
+        "coldspots": int((hotspots["Gi_Bin"] < 0).sum()),
+        "stages": run_profile.stages,
+    }
+    if not args.no_history:
+        os.makedirs(os.path.dirname(HISTORY_PATH), exist_ok=True)
+        with open(HISTORY_PATH, "a") as history:
+            history.write(json.dumps(record) + "\n")
+
+    print("%s network, %d segments, %d %s crashes, %d worker(s), commit %s" %
+          (args.network, n_segments, args.n_crashes, args.crashes, args.workers, record["commit"]))
+    for stage in run_profile.stages:
+        rows = stage["rows"]
+        print("  %s%-20s %9.3f s  %9.1f MB  %s" % ("  " * stage["depth"], stage["stage"], stage["wall_s"],
+                                                   stage["peak_rss_mb"] or 0,
+                                                   "" if not rows else "%.0f rows/s" % (rows / max(stage["wall_s"], 1e-9))))
+    print("  %-20s %9.3f s  %9.1f MB  %.0f crashes/s" % ("total", wall, record["peak_rss_mb"],
+                                                        record["crashes_per_s"] or 0))
+    return record
+
+
+def get_check_hotspots(workers):
+    """
+    :param workers: Worker processes of the tiled assignment and Gi*
+    :return: Crash hotspot columns of the stability scenario
+    """
+    workspace = tempfile.mkdtemp(prefix="hotspot_check_")
+    try:
+        backend = get_backend(workspace, CHECK_SCENARIO["network"], CHECK_SCENARIO["crashes"],
+                              CHECK_SCENARIO["segments"], CHECK_SCENARIO["n_crashes"], CHECK_SCENARIO["seed"])
+        return run_pipeline(backend, workers)
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+def compare_hotspots(name, hotspots, reference):
+    """
+    :param name: Label of the compared run
+    :param hotspots: Crash hotspot columns of the run
+    :param reference: Reference columns
+    :return: True if the z-scores match within the tolerance and the bins are the same
+    """
+    z_scores, reference_z = np.asarray(hotspots["GiZScore"]), reference["GiZScore"]
+    if z_scores.shape != reference_z.shape:
+        print("%s: %d segments, the reference has %d" % (name, len(z_scores), len(reference_z)))
+        return False
+    close = np.allclose(z_scores, reference_z, rtol=CHECK_RTOL, atol=CHECK_ATOL)
+    changed_bins = int((np.asarray(hotspots["Gi_Bin"]) != reference["Gi_Bin"]).sum())
+    same_neighbors = np.array_equal(hotspots["NNeighbors"], reference["NNeighbors"])
+    print("%s: max |dz| %.3g, %d changed bins, %s neighbor counts" %
+          (name, np.abs(z_scores - reference_z).max(), changed_bins, "same" if same_neighbors else "different"))
+    return bool(close and not changed_bins and same_neighbors)
+
+
+def check(update=False, workers=2):
+    """
+    :param update: Write the serial results as the new reference
+    :param workers: Worker processes of the tiled run
+    :return: Exit code, 1 if a run drifted from the reference
+    """
+    serial = get_check_hotspots(1)
+    if update:
+        os.makedirs(os.path.dirname(REFERENCE_PATH), exist_ok=True)
+        np.savez_compressed(REFERENCE_PATH, **{name: np.asarray(serial[name]) for name in
+                                               ("SOURCE_ID", "GiZScore", "GiPValue", "NNeighbors", "Gi_Bin")})
+        print("Reference written to %s." % REFERENCE_PATH)
+    reference = np.load(REFERENCE_PATH)
+    stable = compare_hotspots("serial", serial, reference)
+    stable = compare_hotspots("tiled (%d workers)" % workers, get_check_hotspots(workers), reference) and stable
+    print("Gi* results are %s." % ("stable" if stable else "NOT stable"))
+    return 0 if stable else 1
+
+
+def show_history(limit=20):
+    # Last runs of every scenario, oldest first
+    if not os.path.exists(HISTORY_PATH):
+        print("No benchmark history in %s." % HISTORY_PATH)
+        return 0
+    with open(HISTORY_PATH) as history:
+        records = [json.loads(line) for line in history if line.strip()]
+    print("%-10s %-20s %-9s %-9s %-10s %3s %10s %12s %10s" % ("commit", "created", "network", "crashes", "n_crashes",
+                                                             "w", "wall_s", "crashes/s", "peak_mb"))
+    for record in records[-limit:]:
+        scenario = record["scenario"]
+        print("%-10s %-20s %-9s %-9s %-10d %3d %10.3f %12.0f %10.1f" %
+              (record["commit"], record["created"], scenario["network"], scenario["crashes"], scenario["n_crashes"],
+               scenario["workers"], record["wall_s"], record["crashes_per_s"] or 0, record["peak_rss_mb"]))
+    return 0
+
+
+def get_parser():
+    """
+    :return: Argument parser of the benchmark
+    """
+    parser = argparse.ArgumentParser(description="Benchmark of the hotspot pipeline on synthetic data.")
+    parser.add_argument("--scale", choices=sorted(SCALES, key=SCALES.get), help="Preset number of segments and "
+                                                                                 "crashes")
+    parser.add_argument("--network", choices=synthetic.NETWORKS, default="grid", help="Road network kind")
+    parser.add_argument("--crashes", choices=synthetic.CRASH_MODELS, default="clustered", help="Crash model")
+    parser.add_argument("--segments", type=int, default=SCALES["tiny"][0], help="Approximate number of segments")
+    parser.add_argument("--n-crashes", type=int, default=SCALES["tiny"][1], help="Number of crashes")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the scenario")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes of the tiled assignment and Gi*")
+    parser.add_argument("--no-report", action="store_true", help="Skip the HTML report stages")
+    parser.add_argument("--no-history", action="store_true", help="Do not append the run to the history")
+    parser.add_argument("--check", action="store_true", help="Compare the Gi* results with the stored reference")
+    parser.add_argument("--update-reference", action="store_true", help="Write a new Gi* reference, then check")
+    parser.add_argument("--history", action="store_true", help="Show the last runs of the history")
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    if args.history:
+        return show_history()
+    if args.check or args.update_reference:
+        return check(args.update_reference, max(args.workers, 2))
+    if args.scale:
+        args.segments, args.n_crashes = SCALES[args.scale]
+    benchmark(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
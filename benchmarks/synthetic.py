@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic road networks and crash generators for the benchmarks.
+
+Networks are a regular grid or a "real-shaped" network (jittered intersections, missing
+links, curved segments and a few long arterials). Crashes follow a Poisson process along
+the roads, optionally mixed with Gaussian clusters around hotspot centers. Everything is
+seeded, and the crashes are generated batch by batch from their own seed, so the same
+scenario is reproduced exactly and tens of millions of crashes never sit in memory at once.
+
+SyntheticBackend serves the generated layers to road_hotspot.pipeline as a backend without
+any file IO.
+"""
+import numpy as np
+
+from road_hotspot import ingest
+from road_hotspot.backends.base import Backend
+
+NETWORKS = ("grid", "organic")
+CRASH_MODELS = ("poisson", "clustered")
+FATAL_SHARE = 0.02
+START_DATE = np.datetime64("2015-01-01T00:00:00", "us")
+DATE_RANGE_DAYS = 365 * 8
+
+
+class RoadNetwork:
+    """Polylines as consecutive vertices, like the exploded vertices of a feature class."""
+
+    def __init__(self, vertex_ids, vertices):
+        """
+        :param vertex_ids: Segment index of every vertex, vertices of a segment being consecutive
+        :param vertices: (m, 2) array with the vertex coordinates, in meters
+        """
+        self.vertex_ids = np.asarray(vertex_ids, dtype=np.int64)
+        self.vertices = np.asarray(vertices, dtype=float)
+        self.n_segments = int(self.vertex_ids.max()) + 1 if len(self.vertex_ids) else 0
+        self.oids = np.arange(1, self.n_segments + 1, dtype=np.int64)
+
+        # Straight pieces, used to place the crashes and for the lengths and centroids
+        same = self.vertex_ids[1:] == self.vertex_ids[:-1]
+        self.piece_starts = self.vertices[:-1][same]
+        self.piece_ends = self.vertices[1:][same]
+        self.piece_segments = self.vertex_ids[:-1][same]
+        self.piece_lengths = np.hypot(*(self.piece_ends - self.piece_starts).T)
+        self.lengths = np.bincount(self.piece_segments, weights=self.piece_lengths, minlength=self.n_segments)
+
+    def get_centroids(self):
+        """
+        :return: (n, 2) array with the length weighted centroid of every segment, like SHAPE@XY
+        """
+        middle = (self.piece_starts + self.piece_ends) / 2
+        centroids = np.column_stack([np.bincount(self.piece_segments, weights=middle[:, axis] * self.piece_lengths,
+                                                 minlength=self.n_segments) for axis in range(2)])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return centroids / self.lengths[:, None]
+
+
+def get_grid_network(n_side, spacing=100.0, seed=0):
+    """
+    :param n_side: Intersections per side, the network has about 2 * n_side ** 2 segments
+    :param spacing: Block size in meters
+    :param seed: Random seed of the middle vertex offsets
+    :return: RoadNetwork with horizontal and vertical segments between the intersections
+    """
+    rng = np.random.default_rng(seed)
+    grid = np.arange(n_side, dtype=float) * spacing
+    x, y = np.meshgrid(grid[:-1], grid)
+    horizontal = np.column_stack([x.ravel(), y.ravel()])
+    vertical = horizontal[:, ::-1]
+    starts = np.concatenate([horizontal, vertical])
+    directions = np.concatenate([np.tile([1.0, 0.0], (len(horizontal), 1)), np.tile([0.0, 1.0], (len(vertical), 1))])
+    # A middle vertex slightly off the straight line, so the segments have two pieces
+    offsets = rng.normal(0, spacing * 0.02, len(starts))[:, None] * directions[:, ::-1]
+    middles = starts + directions * spacing / 2 + offsets
+    ends = starts + directions * spacing
+    vertices = np.stack([starts, middles, ends], axis=1).reshape(-1, 2)
+    return RoadNetwork(np.repeat(np.arange(len(starts)), 3), vertices)
+
+
+def get_organic_network(n_side, spacing=100.0, seed=0, drop_share=0.25, arterials=4):
+    """
+    :param n_side: Intersections per side before dropping links
+    :param spacing: Average block size in meters
+    :param seed: Random seed
+    :param drop_share: Share of the grid links removed
+    :param arterials: Number of long diagonal arterials added on top of the local streets
+    :return: RoadNetwork with jittered intersections, curved segments of 2 to 8 vertices and arterials
+    """
+    rng = np.random.default_rng(seed)
+    grid = np.arange(n_side, dtype=float) * spacing
+    x, y = np.meshgrid(grid, grid)
+    nodes = np.column_stack([x.ravel(), y.ravel()]) + rng.normal(0, spacing * 0.15, (n_side ** 2, 2))
+    index = np.arange(n_side ** 2).reshape(n_side, n_side)
+    links = np.concatenate([np.column_stack([index[:, :-1].ravel(), index[:, 1:].ravel()]),
+                            np.column_stack([index[:-1, :].ravel(), index[1:, :].ravel()])])
+    links = links[rng.random(len(links)) >= drop_share]
+
+    # Curved local streets: points along the link bent by a sine of random amplitude
+    vertex_ids, vertices = [], []
+    n_vertices = rng.integers(2, 9, len(links))
+    amplitudes = rng.normal(0, spacing * 0.08, len(links))
+    for segment, ((start, end), count, amplitude) in enumerate(zip(links, n_vertices, amplitudes)):
+        t = np.linspace(0, 1, count)
+        line = nodes[start] + t[:, None] * (nodes[end] - nodes[start])
+        normal = (nodes[end] - nodes[start])[::-1] * [-1, 1] / max(np.hypot(*(nodes[end] - nodes[start])), 1e-9)
+        vertices.append(line + np.sin(np.pi * t)[:, None] * amplitude * normal)
+        vertex_ids.append(np.full(count, segment))
+
+    # Arterials crossing the network, split in segments of about four blocks
+    extent = grid[-1]
+    for arterial in range(arterials):
+        start, end = rng.random(2) * [extent, 0], rng.random(2) * [extent, 0] + [0, extent]
+        if arterial % 2:
+            start, end = start[::-1], end[::-1]
+        n_pieces = max(int(np.hypot(*(end - start)) / (spacing * 4)), 1)
+        bounds = np.linspace(0, 1, n_pieces + 1)
+        for low, high in zip(bounds[:-1], bounds[1:]):
+            t = np.linspace(low, high, 5)
+            vertices.append(start + t[:, None] * (end - start))
+            vertex_ids.append(np.full(5, len(vertex_ids)))
+    return RoadNetwork(np.concatenate(vertex_ids), np.concatenate(vertices))
+
+
+def get_network(kind, n_segments, spacing=100.0, seed=0):
+    """
+    :param kind: Network kind {grid, organic}
+    :param n_segments: Approximate number of road segments
+    :param spacing: Block size in meters
+    :param seed: Random seed
+    :return: RoadNetwork
+    """
+    if kind == "grid":
+        return get_grid_network(max(int(np.sqrt(n_segments / 2)) + 1, 3), spacing, seed)
+    if kind == "organic":
+        return get_organic_network(max(int(np.sqrt(n_segments / 1.5)) + 1, 3), spacing, seed)
+    raise ValueError("The network %s is not valid. The values should be %s." % (kind, ", ".join(NETWORKS)))
+
+
+class CrashGenerator:
+    """Crash points along a road network, generated in reproducible batches."""
+
+    def __init__(self, network, n_crashes, model="poisson", seed=0, clusters=20, cluster_share=0.3,
+                 cluster_sigma=150.0, offset_sigma=5.0):
+        """
+        :param network: RoadNetwork the crashes happen on
+        :param n_crashes: Number of crashes
+        :param model: Crash model {poisson, clustered}
+        :param seed: Random seed
+        :param clusters: Number of hotspot centers of the clustered model
+        :param cluster_share: Share of the crashes around the hotspot centers in the clustered model
+        :param cluster_sigma: Standard deviation of the distance to the hotspot center, in meters
+        :param offset_sigma: Standard deviation of the distance to the road, in meters
+        """
+        if model not in CRASH_MODELS:
+            raise ValueError("The crash model %s is not valid. The values should be %s." % (model,
+                                                                                          ", ".join(CRASH_MODELS)))
+        self.network = network
+        self.n_crashes = int(n_crashes)
+        self.model = model
+        self.seed = seed
+        self.cluster_share = cluster_share if model == "clustered" else 0.0
+        self.cluster_sigma = cluster_sigma
+        self.offset_sigma = offset_sigma
+        rng = np.random.default_rng([seed, 0])
+        self.centers = network.vertices[rng.integers(0, len(network.vertices), clusters)]
+        self.piece_cdf = np.cumsum(network.piece_lengths) / network.piece_lengths.sum()
+
+    def get_batch(self, start, size):
+        """
+        :param start: ObjectID - 1 of the first crash of the batch
+        :param size: Number of crashes
+        :return: ObjectIDs, (size, 2) points, dates and report types of the crashes
+        """
+        rng = np.random.default_rng([self.seed, 1, start])
+        # Poisson process along the roads: the pieces are picked in proportion to their length
+        piece = np.minimum(np.searchsorted(self.piece_cdf, rng.random(size)), len(self.piece_cdf) - 1)
+        t = rng.random(size)[:, None]
+        starts, ends = self.network.piece_starts[piece], self.network.piece_ends[piece]
+        points = starts + t * (ends - starts) + rng.normal(0, self.offset_sigma, (size, 2))
+
+        # Clusters around the hotspot centers, with more fatal crashes
+        clustered = rng.random(size) < self.cluster_share
+        center = rng.integers(0, len(self.centers), int(clustered.sum()))
+        points[clustered] = self.centers[center] + rng.normal(0, self.cluster_sigma, (len(center), 2))
+        fatal_share = np.where(clustered, FATAL_SHARE * 3, FATAL_SHARE)
+
+        oids = np.arange(start + 1, start + size + 1, dtype=np.int64)
+        dates = START_DATE + (rng.random(size) * DATE_RANGE_DAYS * 86400e6).astype("timedelta64[us]")
+        report_types = np.where(rng.random(size) < fatal_share, "Fatal", "Injury").astype(object)
+        return oids, points, dates, report_types
+
+    def iter_batches(self, batch_size=ingest.BATCH_SIZE):
+        """
+        :param batch_size: Crashes per batch
+        :return: Generator of the get_batch results
+        """
+        for start in range(0, self.n_crashes, batch_size):
+            yield self.get_batch(start, min(batch_size, self.n_crashes - start))
+
+
+class SyntheticBackend(Backend):
+    """Serves a synthetic network and crash generator to the pipeline, keeping the outputs in memory."""
+
+    name = "synthetic"
+    DATE_FIELD = "CRASH_DATE"
+    REPORT_TYPE_FIELD = "REPORT_TYPE"
+
+    def __init__(self, workspace, network, crashes):
+        """
+        :param workspace: Folder of the sidecar files (columnar store, weights cache)
+        :param network: RoadNetwork served as the "roads" layer
+        :param crashes: CrashGenerator served as the "crashes" layer
+        """
+        super().__init__(workspace)
+        self.network = network
+        self.crashes = crashes
+        self.outputs = {}
+        self.messages = []
+
+    def message(self, text):
+        self.messages.append(text)
+
+    def warning(self, text):
+        self.messages.append("WARNING " + text)
+
+    def get_spatial_reference(self, layer):
+        return None
+
+    def is_projected(self, layer):
+        return True
+
+    def get_meters_per_unit(self, layer):
+        return 1.0
+
+    def get_path(self, layer):
+        return "synthetic:" + str(layer)
+
+    def read_road_vertices(self, roads):
+        return self.network.oids, self.network.vertex_ids, self.network.vertices
+
+    def read_road_segments(self, roads):
+        return self.network.oids, self.network.get_centroids(), self.network.lengths
+
+    def get_field_types(self, layer):
+        return {self.DATE_FIELD: "Date", self.REPORT_TYPE_FIELD: "String"}
+
+    def iter_crash_batches(self, crashes, fields, min_oid=None, spatial_reference=None):
+        dtype = ingest.get_dtype(fields, self.get_field_types(crashes))
+        for oids, points, dates, report_types in self.crashes.iter_batches():
+            keep = slice(None) if min_oid is None else oids > min_oid
+            columns = {"OID@": oids[keep], "SHAPE@XY": points[keep], self.DATE_FIELD: dates[keep],
+                       self.REPORT_TYPE_FIELD: report_types[keep]}
+            batch = np.zeros(len(columns["OID@"]), dtype=dtype)
+            for field in fields:
+                batch[field] = columns[field]
+            yield batch
+
+    def write_road_output(self, roads, output, columns):
+        self.outputs[output] = {name: np.array(values) for name, values in columns.items()}
+        return output
+
+    def write_table(self, output, array, append=False):
+        self.outputs[output] = np.concatenate([self.outputs[output], array]) if append else array
+        return output